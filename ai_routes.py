@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, jsonify, session
-from sql import SQL
+from sql import SQL, AsyncSQL
+import asyncio
 import os
 import time
 import google.generativeai as genai
@@ -20,13 +21,16 @@ model = genai.GenerativeModel('gemini-2.5-flash')
 RATE_LIMIT_DELAY = 2  # seconds between requests
 last_request_time = 0
 
+# Notes database, for async routes
+notes_db = AsyncSQL("sqlite:///notes.db")
+
 # Initialize Blueprint
 ai_bp = Blueprint('ai', __name__, url_prefix='/ai')
 
 def get_all_notes():
-    """Retrieve all notes from the database"""
+    """Stream all notes from the database, without holding every row in memory"""
     db = SQL("sqlite:///notes.db")
-    notes = db.execute("""
+    notes = db.iterate("""
         SELECT id, title, content, unit_number, tags, comments, created_at, last_updated
         FROM notes 
         ORDER BY unit_number, title
@@ -51,7 +55,7 @@ def get_note_context():
     return context
 
 @ai_bp.route('/chat', methods=['GET', 'POST'])
-def chat():
+async def chat():
     """Main chat interface for AI Q&A"""
     if request.method == 'POST':
         data = request.get_json()
@@ -63,14 +67,13 @@ def chat():
         try:
             global last_request_time
             
-            # Enforce rate limiting
+            # Enforce rate limiting while getting context from notes, rather than one after the other
             current_time = time.time()
             time_since_last = current_time - last_request_time
-            if time_since_last < RATE_LIMIT_DELAY:
-                time.sleep(RATE_LIMIT_DELAY - time_since_last)
-            
-            # Get context from notes
-            context = get_note_context()
+            context, _ = await asyncio.gather(
+                notes_db.run(get_note_context),
+                asyncio.sleep(max(0, RATE_LIMIT_DELAY - time_since_last)),
+            )
             
             # Prepare the conversation
             system_prompt = """You are a helpful AI assistant that helps with studying and understanding notes. 
@@ -83,9 +86,10 @@ def chat():
             # Update last request time
             last_request_time = time.time()
             
-            # Call Gemini API
+            # Call Gemini API, off the event loop
             chat = model.start_chat(history=[])
-            response = chat.send_message(
+            response = await asyncio.to_thread(
+                chat.send_message,
                 system_prompt + "\n\nUser: " + user_message + "\nAssistant:",
                 generation_config={
                     "temperature": 0.7,
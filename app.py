@@ -4,9 +4,15 @@ from flask_session import Session
 from datetime import datetime, date
 import pytz
 import os
-import re
+import sqlite3
+import sys
+import click
 from dotenv import load_dotenv
 from sql import *  # Used for database connection and management
+import fulltext  # Used for full-text search of the dictionary and notes
+import setup_fts  # Used to create full-text search indexes and their triggers
+import typeahead  # Used to complete dictionary phrases and note titles as users type
+import spelling  # Used to suggest corrections of searches that find nothing
 from SarvAuth import *  # Used for user authentication functions
 from auth import auth_blueprint
 from dictionary_routes import dict_bp as dictionary_blueprint
@@ -34,6 +40,9 @@ app.config['SECRET_KEY'] = os.urandom(24)  # Required for flash messages
 # Initialize extensions
 Session(app)
 
+# Return each request's database connections to their pools once it's done (see pooling="request" below)
+SQL.init_app(app)
+
 # Initialize blueprints
 def init_blueprints(app):
     app.register_blueprint(auth_blueprint, url_prefix='/auth')
@@ -49,6 +58,146 @@ def init_blueprints(app):
 # Initialize all blueprints
 init_blueprints(app)
 
+# SQLite settings applied to every connection: WAL lets readers proceed while a write is in progress
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # Safe with WAL, and avoids an fsync per commit
+    "cache_size": -16000,  # In KiB
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+# Seconds the driver waits for another connection's lock, and how many times a statement is then retried (with backoff)
+BUSY_TIMEOUT = 5
+BUSY_RETRIES = 3
+
+# Read-only connections per database, so reads scale with cores while one writer thread per database makes writes
+READERS = min(os.cpu_count() or 1, 8)
+
+# Statements slower than this many seconds are logged, with their query plans
+SLOW_QUERY_THRESHOLD = 0.1
+
+# Results of SELECTs executed with cache=True kept per database, and for how many seconds at most, since writes by
+# other processes (e.g., enhance_note.py) don't invalidate them
+CACHE_SIZE = 256
+CACHE_TTL = 300
+
+# Databases used by the blueprints, each shared across requests through SQL's registry, with its settings
+DATABASES = {
+    "sqlite:///users.db": dict(PRAGMAS, cache_size=-2000, mmap_size=0),
+    "sqlite:///dictionary.db": PRAGMAS,
+    "sqlite:///notes.db": dict(PRAGMAS, cache_size=-64000, mmap_size=256 * 1024 * 1024),
+    "sqlite:///calendar.db": dict(PRAGMAS, cache_size=-2000, mmap_size=0),
+}
+
+# Databases attached (read-only) to each database's connections, by alias, so that one statement can join them
+ATTACH = {
+    "sqlite:///notes.db": {"dictionary": "dictionary.db", "calendar": "calendar.db"},
+}
+
+# Full-text search indexes (of words, and of trigrams), by the database they're in, which setup_fts.py creates along
+# with triggers that keep them in sync with their tables
+FTS_INDEXES = {
+    "sqlite:///dictionary.db": ["entries_fts", "entries_trigram"],
+    "sqlite:///notes.db": ["notes_fts", "notes_trigram"],
+}
+
+def setup_full_text_search():
+    """Create any missing full-text search index, and its triggers, so that indexes stay in sync with every write"""
+    try:
+        setup_fts.setup_dictionary_fts()
+        setup_fts.setup_notes_fts()
+    except sqlite3.Error as e:
+        app.logger.warning(f"Could not set up full-text search: {str(e)}")
+
+setup_full_text_search()
+
+# Directory of an in-process search engine's indexes (see inverted.py), which searches run on in place of the FTS5
+# indexes if set, e.g., where round trips to SQLite dominate searches' latency
+SEARCH_INDEX = os.getenv("SEARCH_INDEX")
+
+if SEARCH_INDEX:
+    import inverted
+    inverted.enable(SEARCH_INDEX)
+
+def warm_up_databases():
+    """Configure each database and open its first connection before the first request"""
+    for url, pragmas in DATABASES.items():
+        try:
+            SQL(url, bind_parameters=True, pooling="request", pragmas=pragmas,
+                slow_query_threshold=SLOW_QUERY_THRESHOLD, readers=READERS,
+                cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL, attach=ATTACH.get(url),
+                busy_timeout=BUSY_TIMEOUT, busy_retries=BUSY_RETRIES).warm_up()
+        except ConfigurationError:
+            # Created earlier with other settings (e.g., without bind_parameters), which can't be changed now
+            raise
+        except RuntimeError as e:
+            app.logger.warning(f"Could not warm up {url}: {str(e)}")
+
+warm_up_databases()
+
+@app.cli.command("db-settings")
+def db_settings():
+    """Print the effective SQLite settings of each database"""
+    for url in DATABASES:
+        print(url)
+        for name, value in SQL(url).settings().items():
+            print(f"    {name:<14} {value}")
+
+@app.cli.command("fts")
+@click.argument("action", type=click.Choice(["rebuild", "optimize", "check"]))
+def fts(action):
+    """Rebuild, optimize, or check the integrity of each full-text search index"""
+    failed = False
+    for url, indexes in FTS_INDEXES.items():
+        for index in indexes:
+            if not fulltext.has_index(SQL(url), index):
+                print(f"{index:<16} missing")
+            elif action == "check":
+                problem = fulltext.check(SQL(url), index)
+                failed = failed or problem is not None
+                print(f"{index:<16} {problem or 'ok'}")
+            else:
+                getattr(fulltext, action)(SQL(url), index)
+                print(f"{index:<16} {action} done")
+    
+    # Likewise the in-process engine's indexes, if enabled, whose optimizing is merging their segments
+    if fulltext.engine is not None:
+        for table, index in fulltext.engine.indexes.items():
+            if action == "check":
+                problem = index.check()
+                failed = failed or problem is not None
+                print(f"{table + ' (engine)':<16} {problem or 'ok'}")
+            else:
+                if action == "rebuild":
+                    index.rebuild()
+                else:
+                    index.merge()
+                print(f"{table + ' (engine)':<16} {action} done")
+    if failed:
+        sys.exit(1)
+
+@app.route('/api/search/statistics')
+def api_search_statistics():
+    """Hit ratio and memory use of the search cache, and the sizes of the typeahead and spelling indexes"""
+    if not session.get("name"):
+        return jsonify({"error": "Not authorized. Please log in."}), 401
+    return jsonify({"cache": fulltext.cache.info(),
+                    "typeahead": typeahead.index.info(),
+                    "spelling": spelling.index.info()})
+
+@app.route('/api/db/statistics')
+def api_db_statistics():
+    """Per-statement timings of each database, slowest in total first, its write queue, cache, and lock contention"""
+    if not session.get("name"):
+        return jsonify({"error": "Not authorized. Please log in."}), 401
+    reset = request.args.get('reset') == '1'
+    return jsonify({url: {"statements": SQL(url).statistics(reset=reset),
+                          "writes": SQL(url).write_queue_info(),
+                          "cache": SQL(url).cache_info(),
+                          "contention": SQL(url).contention_info()}
+                    for url in DATABASES})
+
 # Configuration
 autoRun = True  # Set to True to run the server automatically when app.py is executed
 port = 5000  # Change to any available port
@@ -76,91 +225,34 @@ def search():
                                dictionary_results=[],
                                notes_results=[])
         
-        # Search in dictionary
-        try:
-            db = SQL("sqlite:///dictionary.db")
-            
-            # Use a simple LIKE query that works with the existing schema
-            dict_query = """
-                SELECT id, word_phrase, 
-                       substr(definition, 1, 200) || '...' as definition
-                FROM entries
-                WHERE LOWER(word_phrase) LIKE LOWER(:query) 
-                   OR LOWER(definition) LIKE LOWER(:query)
-                LIMIT 10
-            """
-            dictionary_results = db.execute(dict_query, query=f"%{clean_query}%")
-                    
-        except Exception as e:
-            app.logger.error(f"Error searching dictionary: {str(e)}")
-            dictionary_results = []
-        
-        # Search in notes
+        # Search the dictionary (attached to the notes database) and notes over one connection
         try:
             db = SQL("sqlite:///notes.db")
+            # Each search is cached, by this endpoint and the query, until the dictionary or notes are written
+            entries = fulltext.search_entries(db, clean_query, limit=10, schema="dictionary", endpoint=request.endpoint)
+            notes = fulltext.search_notes(db, clean_query, limit=10, endpoint=request.endpoint)
             
-            # Use a simple LIKE query that works with the existing schema
-            notes_query = """
-                SELECT id, title, 
-                       substr(content, 1, 200) || '...' as content
-                FROM notes
-                WHERE LOWER(title) LIKE LOWER(:query) 
-                   OR LOWER(content) LIKE LOWER(:query)
-                LIMIT 10
-            """
-            notes_results = db.execute(notes_query, query=f"%{clean_query}%")
+            # Titles and previews are HTML, with matches highlighted by the search
+            dictionary_results = [{'id': row['id'], 'word_phrase': row['highlight'], 'definition': row['snippet']}
+                                  for row in entries]
+            notes_results = [{'id': row['id'], 'title': row['highlight'], 'content': row['snippet']}
+                             for row in notes]
                     
         except Exception as e:
-            app.logger.error(f"Error searching notes: {str(e)}")
+            app.logger.error(f"Error searching dictionary and notes: {str(e)}")
+            dictionary_results = []
             notes_results = []
     
-    # Highlight the search terms in the results
-    for result in dictionary_results:
-        if 'word_phrase' in result:
-            result['word_phrase'] = highlight_text(result['word_phrase'], clean_query)
-        if 'definition' in result and result['definition']:
-            result['definition'] = highlight_text(result['definition'], clean_query)
-    
-    for result in notes_results:
-        if 'title' in result:
-            result['title'] = highlight_text(result['title'], clean_query)
-        if 'content' in result and result['content']:
-            result['content'] = highlight_text(result['content'], clean_query)
+    # Suggest a correction of misspelled words if nothing was found
+    suggestion = None
+    if query and not dictionary_results and not notes_results:
+        suggestion = spelling.index.correct(query)
     
     return render_template('search.html',
                          query=query,
                          dictionary_results=dictionary_results,
-                         notes_results=notes_results)
-
-def highlight_text(text, query):
-    """Highlight search terms in the text"""
-    if not text or not query:
-        return text or ''
-    
-    try:
-        # Escape special regex characters in the query
-        query = re.escape(query)
-        # Create a case-insensitive regex pattern
-        pattern = re.compile(f'({query})', re.IGNORECASE)
-        # Replace matches with highlighted span
-        return pattern.sub(r'<span class="highlight">\1</span>', text)
-    except Exception as e:
-        app.logger.error(f"Error highlighting text: {str(e)}")
-        return text
-
-# Add a custom filter to highlight text in search results
-@app.template_filter('highlight')
-def highlight_filter(s, query):
-    if not query or not s:
-        return s
-    try:
-        query = re.escape(query)
-        return re.sub(f'({query})', 
-                     r'<span class="highlight">\1</span>', 
-                     s, 
-                     flags=re.IGNORECASE)
-    except:
-        return s
+                         notes_results=notes_results,
+                         suggestion=suggestion)
 
 def get_db_connection(db_name):
     """Create and return a database connection"""
@@ -187,22 +279,8 @@ def api_search_dictionary():
     try:
         # Get database connection
         db = get_db_connection('dictionary.db')
-        # Search in word_phrase, definition, and example fields
-        results = db.execute("""
-            SELECT id, word_phrase, definition, example, 
-                   (CASE 
-                       WHEN word_phrase LIKE ? THEN 1  -- Highest priority: exact match at start of word_phrase
-                       WHEN word_phrase LIKE ? THEN 2  -- High priority: match at start of word_phrase
-                       WHEN definition LIKE ? OR example LIKE ? THEN 3  -- Medium priority: match in definition or example
-                       ELSE 4  -- Lower priority: match anywhere in word_phrase
-                    END) as priority
-            FROM entries
-            WHERE word_phrase LIKE ? OR definition LIKE ? OR example LIKE ?
-            ORDER BY priority, word_phrase
-            LIMIT 5
-        """, 
-        f"{query}%", f"%{query}%", f"%{query}%", f"%{query}%", 
-        f"%{query}%", f"%{query}%", f"%{query}%")
+        # Search in word_phrase, definition, and example fields, best matches first
+        results = fulltext.search_entries(db, query, limit=5, endpoint=request.endpoint)
         
         return jsonify(results)
     except Exception as e:
@@ -212,6 +290,41 @@ def api_search_dictionary():
         if db:
             close_db_connection(db)
 
+@app.route('/api/autocomplete')
+def api_autocomplete():
+    """API endpoint completing a prefix to dictionary phrases and note titles, from an in-memory index, as users type"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify([])
+    limit = min(request.args.get('limit', 8, type=int), 20)
+    
+    try:
+        completions = typeahead.index.complete(query, limit)
+    except RuntimeError as e:
+        app.logger.error(f"API autocomplete error: {str(e)}")
+        return jsonify({"error": "An error occurred while completing the query"}), 500
+    
+    # Link each completion to its entry or note
+    for completion in completions:
+        if completion['kind'] == 'dictionary':
+            completion['url'] = url_for('dictionary.view_entry', entry_id=completion['id'])
+        else:
+            completion['url'] = url_for('notes.view_note', note_id=completion['id'])
+    return jsonify(completions)
+
+@app.route('/api/spelling')
+def api_spelling():
+    """API endpoint suggesting a correction of a query's misspelled words, for searches that find nothing"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'suggestion': None})
+    
+    try:
+        return jsonify({'suggestion': spelling.index.correct(query)})
+    except RuntimeError as e:
+        app.logger.error(f"API spelling error: {str(e)}")
+        return jsonify({"error": "An error occurred while correcting the query"}), 500
+
 @app.route('/api/search/notes')
 def api_search_notes():
     """API endpoint for searching notes"""
@@ -224,57 +337,17 @@ def api_search_notes():
         # Get database connection
         db = get_db_connection('notes.db')
         
-        # Split query into individual words for more flexible searching
-        search_terms = [f"%{term}%" for term in query.split() if term.strip()]
-        if not search_terms:
-            return jsonify([])
-            
-        # Build the WHERE clause to search in title or content
-        where_conditions = []
-        params = []
-        
-        for term in search_terms:
-            where_conditions.append("(title LIKE ? OR content LIKE ?)")
-            params.extend([term, term])
-            
-        where_clause = " OR ".join(where_conditions)
-        
-        # Search in title and content fields with priority to title matches
-        results = db.execute(f"""
-            SELECT id, title, content, last_updated,
-                   (CASE 
-                       WHEN title LIKE ? THEN 1  -- Highest priority: match in title
-                       ELSE 2  -- Lower priority: match in content
-                    END) as priority
-            FROM notes
-            WHERE {where_clause}
-            ORDER BY priority, last_updated DESC
-            LIMIT 5
-        """, *([f"%{query}%"] + params))
+        # Search in title, content, and tags, with priority to title matches
+        results = fulltext.search_notes(db, query, limit=5, endpoint=request.endpoint)
         
-        # Format the results with highlighted content
-        formatted_results = []
-        for row in results:
-            # Find the position of the first match in content for snippet
-            content_lower = row['content'].lower()
-            query_lower = query.lower()
-            match_pos = content_lower.find(query_lower)
-            
-            # Create a snippet around the match (50 chars before and after)
-            if match_pos >= 0:
-                start = max(0, match_pos - 50)
-                end = min(len(row['content']), match_pos + len(query) + 50)
-                snippet = ('...' if start > 0 else '') + row['content'][start:end] + ('...' if end < len(row['content']) else '')
-            else:
-                snippet = row['content'][:150] + ('...' if len(row['content']) > 150 else '')
-            
-            formatted_results.append({
-                'id': row['id'],
-                'title': row['title'],
-                'content': row['content'],  # Include full content for client-side highlighting
-                'snippet': snippet,        # Include a snippet for the preview
-                'last_updated': row['last_updated']
-            })
+        # Send each note's snippet, with matches highlighted, rather than its whole content
+        formatted_results = [{
+            'id': row['id'],
+            'title': row['title'],
+            'highlight': row['highlight'],  # Title, with matches highlighted
+            'snippet': row['snippet'],  # Best fragment of content, with matches highlighted
+            'last_updated': row['last_updated']
+        } for row in results]
         
         return jsonify(formatted_results)
     except Exception as e:
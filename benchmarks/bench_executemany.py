@@ -0,0 +1,90 @@
+"""
+Measure insert throughput for dictionary entries: one db.execute per row
+(each in its own transaction) against one db.executemany for all rows.
+
+Each run uses a fresh temporary database with the schema from
+createDictDB.py, so the real dictionary.db is never touched. Row-at-a-time
+inserts are timed on a sample and extrapolated, since at 100k rows each
+commit's fsync makes them take minutes.
+
+Usage: python benchmarks/bench_executemany.py [rows ...]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from sql import SQL
+
+SCHEMA = """
+CREATE TABLE entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    word_phrase TEXT NOT NULL,
+    definition TEXT NOT NULL,
+    example TEXT,
+    views INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    unit_number INTEGER,
+    comments TEXT
+)
+"""
+
+INSERT = """
+    INSERT INTO entries (word_phrase, definition, example, unit_number, comments)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+# Rows inserted one at a time before extrapolating
+SAMPLE = 1000
+
+
+def create_database(directory, name):
+    """Create an empty dictionary database and return its SQL instance"""
+    path = os.path.join(directory, name)
+    connection = sqlite3.connect(path)
+    connection.execute(SCHEMA)
+    connection.execute("CREATE INDEX idx_word_phrase ON entries(word_phrase)")
+    connection.commit()
+    connection.close()
+    return SQL(f"sqlite:///{path}", bind_parameters=True)
+
+
+def entries(count):
+    """Generate synthetic dictionary entries"""
+    for i in range(count):
+        yield (f"term {i}", f"Definition of legal term number {i}. " * 4,
+               f"Example usage of term {i}.", i % 12 + 1, None)
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000]
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'rows':>8} {'execute (rows/s)':>18} {'executemany (rows/s)':>22} {'speedup':>8}")
+        for count in counts:
+            # Before: one statement, and one transaction, per row
+            db = create_database(directory, f"execute_{count}.db")
+            sample = min(count, SAMPLE)
+            start = time.perf_counter()
+            for row in entries(sample):
+                db.execute(INSERT, *row)
+            execute_rate = sample / (time.perf_counter() - start)
+
+            # After: one transaction for all rows
+            db = create_database(directory, f"executemany_{count}.db")
+            start = time.perf_counter()
+            ids = db.executemany(INSERT, entries(count))
+            executemany_rate = count / (time.perf_counter() - start)
+            assert len(ids) == count
+
+            print(f"{count:>8} {execute_rate:>18,.0f} {executemany_rate:>22,.0f} "
+                  f"{executemany_rate / execute_rate:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Measure searches of notes through the in-process engine (inverted.py)
+against the same searches through FTS5 (notes_fts), at 100k notes by
+default, along with the cost of building, appending to, and merging the
+engine's index.
+
+Both run through fulltext.search_notes, so each includes fetching the rows
+found and marking their matches; the engine's ranking alone is reported
+too. Runs against a temporary database with the notes schema, so the real
+notes.db is never touched.
+
+Usage: python benchmarks/bench_inverted.py [notes]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import fulltext
+import inverted
+from sql import SQL
+
+WORDS = ["the", "court", "held", "that", "charter", "rights", "freedoms", "reasonable", "limits", "prescribed",
+         "by", "law", "justified", "free", "democratic", "society", "criminal", "code", "sentence", "offender",
+         "negligence", "duty", "care", "standard", "breach", "damages", "contract", "offer", "acceptance"]
+
+# Queries, from common to rare words, and prefixes
+QUERIES = ["court", "charter rights", "reasonable limits prescribed", "habeas", "habeas corpus", "neglig", "xqzv"]
+
+
+def create_database(path, count):
+    """Create notes, indexed by notes_fts, with count synthetic notes of about 300 words, some citing Latin"""
+    generator = random.Random(0)
+    connection = sqlite3.connect(path)
+    connection.execute("""
+        CREATE TABLE notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            unit_number INTEGER,
+            tags TEXT,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    def content(i):
+        words = generator.choices(WORDS, k=300)
+        if i % 10000 == 0:
+            words.append("habeas corpus")
+        return " ".join(words)
+
+    connection.executemany("INSERT INTO notes (title, content, tags) VALUES (?, ?, ?)",
+                           ((f"Note {i}", content(i), "law") for i in range(count)))
+    connection.execute("""
+        CREATE VIRTUAL TABLE notes_fts USING fts5(
+            title, content, tags, content='notes', content_rowid='id', tokenize='porter unicode61'
+        )
+    """)
+    connection.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+    connection.commit()
+    connection.close()
+
+
+def time_calls(f, repeat=5):
+    """Return median milliseconds of f()"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1e3
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "notes.db")
+        create_database(path, count)
+        url = f"sqlite:///{path}"
+        db = SQL(url)
+
+        start = time.perf_counter()
+        engine = inverted.Engine(os.path.join(directory, "index"), notes=url)
+        index = engine.indexes["notes"]
+        index.rebuild()
+        print(f"{count:,} notes, engine's index built in {time.perf_counter() - start:.1f} s "
+              f"({index.info()['bytes'] / 2**20:.0f} MiB)")
+
+        print(f"{'query':<30} {'FTS5 (ms)':>10} {'engine (ms)':>12} {'ranking (ms)':>13}")
+        for query in QUERIES:
+            fulltext.engine = None
+            fts = time_calls(lambda: fulltext.search_notes(db, query, limit=10))
+            fulltext.engine = engine
+            found = time_calls(lambda: fulltext.search_notes(db, query, limit=10))
+            ranking = time_calls(lambda: index.search(fulltext.terms(query), 10))
+            print(f"{query:<30} {fts:>10.2f} {found:>12.2f} {ranking:>13.2f}")
+        fulltext.engine = None
+
+        # Edits, each appending a segment, until there are enough to merge
+        start = time.perf_counter()
+        for id in range(1, inverted.MAX_SEGMENTS + 1):
+            db.execute("UPDATE notes SET title = ? WHERE id = ?", f"Edited {id}", id)
+            index.update([id])
+        print(f"  update:  {(time.perf_counter() - start) / inverted.MAX_SEGMENTS * 1e3:8.2f} ms per edit")
+        print(f"  search, {index.info()['segments']} segments: {time_calls(lambda: index.search(['court'], 10)):8.2f} ms")
+        start = time.perf_counter()
+        index.merge()
+        print(f"  merge:   {time.perf_counter() - start:8.2f} s")
+
+
+if __name__ == '__main__':
+    main()
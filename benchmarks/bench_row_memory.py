@@ -0,0 +1,81 @@
+"""
+Measure memory held by a SELECT's result set as dict rows and as compact
+records (db.execute(..., rows="record")).
+
+Rows come from a temporary database with the notes table's columns as
+selected by notes.index, so the real notes.db is never touched.
+
+Usage: python benchmarks/bench_row_memory.py [rows]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from sql import SQL
+
+# Columns selected by notes.index
+SELECT = """
+    SELECT id, title, unit_number,
+           strftime('%Y-%m-%d', created_at) as created_date,
+           strftime('%Y-%m-%d', last_updated) as last_updated,
+           is_favorite, has_worksheet
+    FROM notes
+"""
+
+
+def create_database(path, count):
+    """Create a notes table with count synthetic rows"""
+    connection = sqlite3.connect(path)
+    connection.execute("""
+        CREATE TABLE notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            unit_number INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_favorite BOOLEAN DEFAULT 0,
+            has_worksheet BOOLEAN DEFAULT 0
+        )
+    """)
+    connection.executemany(
+        "INSERT INTO notes (title, content, unit_number) VALUES (?, ?, ?)",
+        ((f"Note {i}", "Content", i % 12 + 1) for i in range(count)))
+    connection.commit()
+    connection.close()
+
+
+def measure(db, **options):
+    """Return bytes allocated by the result set still held after the query"""
+    tracemalloc.start()
+    rows = db.execute(SELECT, **options)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert rows[0]['title'] == 'Note 0'
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'notes.db')
+        create_database(path, count)
+        db = SQL(f"sqlite:///{path}", bind_parameters=True)
+        db.warm_up()
+
+        dicts = measure(db)
+        records = measure(db, rows="record")
+        print(f"{count:,} rows")
+        print(f"  dict rows:  {dicts / 2**20:8.1f} MiB ({dicts / count:.0f} bytes/row)")
+        print(f"  records:    {records / 2**20:8.1f} MiB ({records / count:.0f} bytes/row)")
+        print(f"  reduction:  {1 - records / dicts:8.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Measure the search cache (fulltext.cache) on a workload of popular
+queries: its hit ratio, and searches' latency when missed and when hit, at
+100k notes by default, searched through FTS5 (notes_fts).
+
+Queries are drawn from a Zipf distribution, in varying case and with
+stopwords, as users type them, and a note is written every so often,
+invalidating the notes' results. Runs against a temporary database with
+the notes schema, so the real notes.db is never touched.
+
+Usage: python benchmarks/bench_search_cache.py [notes] [searches]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import fulltext
+from sql import SQL
+
+WORDS = ["court", "held", "charter", "rights", "freedoms", "reasonable", "limits", "prescribed", "law", "justified",
+         "free", "democratic", "society", "criminal", "code", "sentence", "offender", "negligence", "duty", "care",
+         "standard", "breach", "damages", "contract", "offer", "acceptance"]
+
+# Searches between writes of a note
+WRITE_EVERY = 200
+
+
+def create_database(path, count):
+    """Create notes, indexed by notes_fts, with count synthetic notes of about 300 words"""
+    generator = random.Random(0)
+    connection = sqlite3.connect(path)
+    connection.execute("""
+        CREATE TABLE notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            unit_number INTEGER,
+            tags TEXT,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    connection.executemany("INSERT INTO notes (title, content, tags) VALUES (?, ?, ?)",
+                           ((f"Note {i}", " ".join(generator.choices(WORDS, k=300)), "law") for i in range(count)))
+    connection.execute("""
+        CREATE VIRTUAL TABLE notes_fts USING fts5(
+            title, content, tags, content='notes', content_rowid='id', tokenize='porter unicode61'
+        )
+    """)
+    connection.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+    connection.commit()
+    connection.close()
+
+
+def queries(count, generator):
+    """Yield count queries, of 200 distinct ones, each typed in one of a few ways"""
+    distinct = [" ".join(generator.sample(WORDS, generator.randint(1, 2))) for _ in range(200)]
+    weights = [1 / rank for rank in range(1, len(distinct) + 1)]
+    for query in generator.choices(distinct, weights, k=count):
+        yield generator.choice([query, query.title(), f"the {query}", f"{query} of the"])
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    searches = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    generator = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "notes.db")
+        create_database(path, count)
+        db = SQL(f"sqlite:///{path}")
+        fulltext.cache = fulltext.QueryCache(1024, ttl=300)
+
+        hits, misses = [], []
+        for i, query in enumerate(queries(searches, generator)):
+            if i % WRITE_EVERY == WRITE_EVERY - 1:
+                db.execute("UPDATE notes SET title = ? WHERE id = ?", f"Edited {i}", 1)
+                fulltext.changed("notes", 1)
+            before = fulltext.cache.info()["hits"]
+            start = time.perf_counter()
+            fulltext.search_notes(db, query, limit=10, endpoint="bench")
+            (hits if fulltext.cache.info()["hits"] > before else misses).append(time.perf_counter() - start)
+
+        info = fulltext.cache.info()
+        print(f"{count:,} notes, {searches:,} searches (a write every {WRITE_EVERY})")
+        print(f"  hit ratio: {info['hit_ratio']:.1%}, {info['size']} results cached in ~{info['bytes'] / 1024:.0f} KiB")
+        for name, times in [("miss", misses), ("hit", hits)]:
+            times.sort()
+            print(f"  {name + ':':<6} {times[len(times) // 2] * 1e3:8.2f} ms median, "
+                  f"{times[int(len(times) * 0.99)] * 1e3:8.2f} ms p99")
+        total = sum(hits) + sum(misses)
+        print(f"  total: {total:.1f} s, against ~{searches * misses[len(misses) // 2]:.1f} s uncached")
+
+
+if __name__ == '__main__':
+    main()
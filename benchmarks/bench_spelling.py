@@ -0,0 +1,83 @@
+"""
+Measure spelling corrections' latency with a large vocabulary, and the cost
+of loading and updating the index.
+
+Labels are made of synthetic words, so the real databases are never
+touched. Queries are vocabulary words with one or two typos (insertions,
+deletions, substitutions, or transpositions), plus words with no
+correction.
+
+Usage: python benchmarks/bench_spelling.py [labels]
+"""
+import os
+import random
+import string
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from spelling import Speller
+
+
+def vocabulary(count, generator):
+    """Return count synthetic words, of 4 to 12 letters"""
+    return ["".join(generator.choices(string.ascii_lowercase, k=generator.randint(4, 12))) for _ in range(count)]
+
+
+def typo(word, edits, generator):
+    """Return word with edits random typos"""
+    for _ in range(edits):
+        i = generator.randrange(len(word) - 1)
+        kind = generator.choice(["insert", "delete", "substitute", "transpose"])
+        if kind == "insert":
+            word = word[:i] + generator.choice(string.ascii_lowercase) + word[i:]
+        elif kind == "delete":
+            word = word[:i] + word[i + 1:]
+        elif kind == "substitute":
+            word = word[:i] + generator.choice(string.ascii_lowercase) + word[i + 1:]
+        else:
+            word = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word
+
+
+def time_calls(f, queries):
+    """Return median and maximum milliseconds of f(query) over queries"""
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        f(query)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1e3, max(times) * 1e3
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    generator = random.Random(0)
+    words = vocabulary(count * 2, generator)
+    labels = [("dictionary", i, " ".join(words[2 * i:2 * i + 2])) for i in range(count)]
+
+    start = time.perf_counter()
+    index = Speller(lambda: labels)
+    index.suggest("a")
+    info = index.info()
+    print(f"{count:,} labels ({info['words']:,} words, {info['deletes']:,} deletes), "
+          f"loaded in {time.perf_counter() - start:.1f} s")
+
+    sample = generator.sample(words, 1000)
+    for edits in [0, 1, 2]:
+        queries = [typo(word, edits, generator) for word in sample]
+        print("  suggest, {} typo{}: {:8.3f} ms median, {:8.3f} ms max".format(
+            edits, "s" if edits != 1 else " ", *time_calls(index.suggest, queries)))
+    print("  suggest, unknown: {:8.3f} ms median, {:8.3f} ms max".format(
+        *time_calls(index.suggest, ["".join(generator.choices("0123456789", k=8)) + "x" for _ in range(1000)])))
+
+    start = time.perf_counter()
+    for i in range(1000):
+        index.add("dictionary", i, f"updated {typo(words[i], 1, generator)}")
+    print(f"  add (replace):    {(time.perf_counter() - start) / 1000 * 1e3:8.3f} ms per call")
+
+
+if __name__ == '__main__':
+    main()
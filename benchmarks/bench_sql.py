@@ -0,0 +1,353 @@
+"""
+Benchmark representative statements from each blueprint through SQL.execute
+(with values bound natively and with values escaped into the statement) and
+through raw sqlite3, against synthetic databases of increasing size.
+
+For each statement, reports median latency per call, memory allocated by one
+call (peak, per tracemalloc), and the parts of the wrapper's overhead that
+can be measured on their own: parsing with sqlparse (on a cache miss),
+escaping values with _escape, and turning rows into dicts (with _coerce).
+Also reports how long constructing SQL (and thus its engine) takes.
+
+Results are saved as JSON, and can be compared against an earlier run's to
+catch regressions: with --compare, exits with status 1 if any statement got
+slower than --threshold times its earlier latency.
+
+Synthetic databases have the schemas of the real ones, with as many rows in
+each table as asked, so the real databases are never touched. 1M rows take a
+while to create (and about 500 MB), so --directory can keep them for reuse.
+
+Usage: python benchmarks/bench_sql.py [--rows 1000 100000 1000000] [--output bench_sql.json]
+                                      [--directory DIR] [--compare BASELINE] [--threshold 1.2]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import sqlalchemy
+import sqlparse
+
+from sql import SQL, _coerce, _parse_statement
+
+SCHEMA = [
+    """
+    CREATE TABLE entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        word_phrase TEXT NOT NULL,
+        definition TEXT NOT NULL,
+        example TEXT,
+        views INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        unit_number INTEGER DEFAULT NULL,
+        comments TEXT DEFAULT NULL
+    )
+    """,
+    "CREATE INDEX idx_word_phrase ON entries(word_phrase)",
+    "CREATE INDEX idx_views ON entries(views)",
+    """
+    CREATE TABLE notes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        unit_number INTEGER,
+        tags TEXT,
+        related_entries TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        views INTEGER DEFAULT 0,
+        is_favorite BOOLEAN DEFAULT 0,
+        comments TEXT,
+        has_worksheet BOOLEAN DEFAULT 0
+    )
+    """,
+    "CREATE INDEX idx_notes_unit ON notes(unit_number)",
+    "CREATE INDEX idx_notes_favorite ON notes(is_favorite)",
+    """
+    CREATE TABLE worksheet_images (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        note_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        original_filename TEXT NOT NULL,
+        upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (note_id) REFERENCES notes (id) ON DELETE CASCADE
+    )
+    """,
+    "CREATE INDEX idx_worksheet_images_note_id ON worksheet_images (note_id)",
+    """
+    CREATE TABLE calendar_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        entry_date DATE NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX idx_calendar_entries_user_date ON calendar_entries(user_id, entry_date)",
+    """
+    CREATE TABLE users (id INTEGER, username NOT NULL, password NOT NULL, dateJoined, salt, accountStatus, role,
+                        twoFactorAuth, lastLogin, emailAddress, phoneNumber, name, dateOfBirth, gender,
+                        PRIMARY KEY(id))
+    """,
+]
+
+# (blueprint, name, statement, values), with values as a tuple for qmark or a dict for named placeholders, as
+# issued by the routes; n is the number of rows, so values can refer to rows in the middle of each table
+STATEMENTS = [
+    ("dictionary", "index", """
+        SELECT id, word_phrase, definition, example, views,
+               strftime('%Y-%m-%d', created_at) as created_date
+        FROM entries
+        ORDER BY word_phrase ASC
+    """, lambda n: {}),
+    ("dictionary", "render_entry", """
+        SELECT id, word_phrase, definition, example, views, unit_number, comments,
+               strftime('%Y-%m-%d', created_at) as created_date,
+               strftime('%Y-%m-%d', last_updated) as last_updated
+        FROM entries
+        WHERE id = :id
+    """, lambda n: {"id": n // 2}),
+    ("dictionary", "increment_views", """
+        UPDATE entries
+        SET views = COALESCE(views, 0) + 1
+        WHERE id = :id
+    """, lambda n: {"id": n // 2}),
+    ("notes", "index", """
+        SELECT id, title, unit_number,
+               strftime('%Y-%m-%d', created_at) as created_date,
+               strftime('%Y-%m-%d', last_updated) as last_updated,
+               is_favorite, has_worksheet
+        FROM notes
+        ORDER BY
+            CASE WHEN unit_number = '' OR unit_number IS NULL THEN 1 ELSE 0 END,
+            CAST(unit_number AS INTEGER) DESC,
+            last_updated DESC
+    """, lambda n: {}),
+    ("notes", "view_note", """
+        SELECT *,
+               strftime('%Y-%m-%d', created_at) as created_date,
+               strftime('%Y-%m-%d', last_updated) as last_updated
+        FROM notes
+        WHERE id = :id
+    """, lambda n: {"id": n // 2}),
+    ("notes", "worksheet_images", """
+        SELECT id, filename, original_filename, upload_date
+        FROM worksheet_images
+        WHERE note_id = ?
+        ORDER BY upload_date DESC
+    """, lambda n: (n // 2,)),
+    ("calendar", "month", """
+        SELECT id, entry_date, title, description
+        FROM calendar_entries
+        WHERE user_id = :user_id
+        AND entry_date >= :start_date
+        AND entry_date < :end_date
+        ORDER BY entry_date
+    """, lambda n: {"user_id": 1, "start_date": "2024-03-01", "end_date": "2024-04-01"}),
+    ("auth", "login", "SELECT * FROM users WHERE username = :username",
+     lambda n: {"username": "user{}".format(n // 2)}),
+    ("tests", "unit_entries", """
+        SELECT word_phrase, definition, example, unit_number
+        FROM entries
+        WHERE unit_number = :unit_number
+    """, lambda n: {"unit_number": 3}),
+    ("app", "search_notes", """
+        SELECT id, title,
+               substr(content, 1, 200) || '...' as content
+        FROM notes
+        WHERE LOWER(title) LIKE LOWER(:query)
+           OR LOWER(content) LIKE LOWER(:query)
+        LIMIT 10
+    """, lambda n: {"query": "%note {}%".format(n - 1)}),
+]
+
+
+def create_database(path, count):
+    """Create a database with the real schemas and count synthetic rows per table"""
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.executemany(
+        "INSERT INTO entries (word_phrase, definition, example, unit_number) VALUES (?, ?, ?, ?)",
+        ((f"term {i}", f"Definition of legal term number {i}. " * 3, f"Example of term {i}.", i % 12 + 1)
+         for i in range(count)))
+    connection.executemany(
+        "INSERT INTO notes (title, content, unit_number, tags, has_worksheet) VALUES (?, ?, ?, ?, 1)",
+        ((f"Note {i}", f"Content of note {i}. " * 8, i % 12 + 1, "law,unit") for i in range(count)))
+    connection.executemany(
+        "INSERT INTO worksheet_images (note_id, filename, original_filename) VALUES (?, ?, ?)",
+        ((i + 1, f"{i}.png", "scan.png") for i in range(count)))
+    connection.executemany(
+        "INSERT INTO calendar_entries (user_id, entry_date, title, description) VALUES (?, ?, ?, ?)",
+        ((i % 100 + 1, (datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 366)).isoformat(),
+          f"Event {i}", "Description") for i in range(count)))
+    connection.executemany(
+        "INSERT INTO users (id, username, password, name) VALUES (?, ?, ?, ?)",
+        ((i + 1, f"user{i}", "hash", f"User {i}") for i in range(count)))
+    connection.commit()
+    connection.close()
+
+
+def open_sql(url, **options):
+    """Construct SQL without its registry, so that one database can be opened with several configurations"""
+    db = object.__new__(SQL)
+    db.__init__(url, **options)
+    return db
+
+
+def time_calls(f, seconds):
+    """Return median seconds per call of f, calling it for at least seconds (and at least 3 times)"""
+    times = []
+    deadline = time.perf_counter() + seconds
+    while len(times) < 3 or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def allocated(f):
+    """Return KiB allocated at peak by one call of f"""
+    tracemalloc.start()
+    f()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def benchmark(path, count, seconds):
+    """Return results for each statement against database at path with count rows"""
+    url = f"sqlite:///{path}"
+    raw = sqlite3.connect(path, isolation_level=None)
+    bound = open_sql(url, bind_parameters=True)
+    escaped = open_sql(url)
+
+    results = []
+    for blueprint, name, sql, values in STATEMENTS:
+        values = values(count)
+        args, kwargs = (values, {}) if isinstance(values, tuple) else ((), values)
+
+        def execute_raw():
+            raw.execute("BEGIN")
+            rows = raw.execute(sql, values).fetchall()
+            raw.execute("COMMIT")
+            return rows
+
+        # Rows (and column names) as fetched by the driver, to time turning them into dicts
+        cursor = raw.execute(sql, values)
+        rows = cursor.fetchall()
+        columns = [column[0] for column in cursor.description] if cursor.description else []
+        escapes = list(values) if isinstance(values, tuple) else list(values.values())
+
+        result = {
+            "rows": count,
+            "blueprint": blueprint,
+            "name": name,
+            "rows_returned": len(rows),
+            "raw_us": time_calls(execute_raw, seconds) * 1e6,
+            "bind_us": time_calls(lambda: bound.execute(sql, *args, **kwargs), seconds) * 1e6,
+            "escape_us": time_calls(lambda: escaped.execute(sql, *args, **kwargs), seconds) * 1e6,
+            "bind_alloc_kib": allocated(lambda: bound.execute(sql, *args, **kwargs)),
+            "raw_alloc_kib": allocated(execute_raw),
+            "parse_us": time_calls(lambda: _parse_statement.__wrapped__(sql), seconds / 4) * 1e6,
+            "escape_values_us": time_calls(lambda: [escaped._escape(value) for value in escapes],
+                                           seconds / 4) * 1e6,
+            "coerce_us": time_calls(lambda: [_coerce(dict(zip(columns, row))) for row in rows],
+                                    seconds / 4) * 1e6,
+        }
+        result["overhead_us"] = result["bind_us"] - result["raw_us"]
+        results.append(result)
+        print(f"{count:>9} {blueprint + '.' + name:<28} {result['rows_returned']:>9} {result['raw_us']:>11.1f} "
+              f"{result['bind_us']:>11.1f} {result['escape_us']:>11.1f} {result['bind_alloc_kib']:>10.1f} "
+              f"{result['parse_us']:>9.1f} {result['escape_values_us']:>9.1f} {result['coerce_us']:>11.1f}")
+    raw.close()
+
+    # Constructing SQL creates an engine and tests a connection
+    construction = statistics.median(_time_construction(url) for _ in range(5))
+    print(f"{count:>9} {'SQL(...) construction':<28} {construction * 1e3:>9.2f} ms")
+    return results, construction * 1e3
+
+
+def _time_construction(url):
+    start = time.perf_counter()
+    open_sql(url)
+    return time.perf_counter() - start
+
+
+def compare(results, baseline, threshold):
+    """Print each statement's latency relative to baseline's, returning whether any regressed beyond threshold"""
+    earlier = {(r["rows"], r["blueprint"], r["name"]): r for r in baseline["results"]}
+    regressed = False
+    print(f"\n{'rows':>9} {'statement':<28} {'bind':>8} {'escape':>8}")
+    for result in results:
+        key = (result["rows"], result["blueprint"], result["name"])
+        if key not in earlier:
+            continue
+        ratios = [result[field] / earlier[key][field] for field in ["bind_us", "escape_us"]]
+        flag = " REGRESSED" if max(ratios) > threshold else ""
+        regressed = regressed or bool(flag)
+        print(f"{key[0]:>9} {key[1] + '.' + key[2]:<28} {ratios[0]:>7.2f}x {ratios[1]:>7.2f}x{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sql.SQL against raw sqlite3")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000, 1_000_000],
+                        help="rows per table of each synthetic database")
+    parser.add_argument("--seconds", type=float, default=0.5, help="minimum seconds to time each statement")
+    parser.add_argument("--output", default="bench_sql.json", help="file to save results to, as JSON")
+    parser.add_argument("--directory", help="directory in which to keep (and reuse) synthetic databases")
+    parser.add_argument("--compare", help="earlier run's JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = args.directory or temporary
+        os.makedirs(directory, exist_ok=True)
+
+        print(f"{'rows':>9} {'statement':<28} {'returned':>9} {'raw (us)':>11} {'bind (us)':>11} "
+              f"{'escape (us)':>11} {'alloc (KiB)':>10} {'parse':>9} {'_escape':>9} {'dicts (us)':>11}")
+        results, construction = [], {}
+        for count in args.rows:
+            path = os.path.join(directory, f"bench_{count}.db")
+            if not os.path.exists(path):
+                create_database(path, count)
+            rows, construction[count] = benchmark(path, count, args.seconds)
+            results.extend(rows)
+
+    run = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "sqlalchemy": sqlalchemy.__version__,
+        "sqlparse": sqlparse.__version__,
+        "construction_ms": construction,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nSaved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Measure the per-call overhead of SQL.execute with and without the
+parsed-statement cache, by executing statements as the routes issue them
+against a real (temporary) table of each kind.
+
+Without the cache, every call parses its statement with sqlparse, as before
+the cache, which is simulated by swapping the cached parser for the function
+it wraps. Statements are point lookups and updates on small tables, so that
+the wrapper's overhead, rather than SQLite's work, dominates.
+
+Usage: python benchmarks/bench_statement_cache.py [iterations]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import sql
+from sql import SQL
+
+SCHEMA = [
+    """
+    CREATE TABLE entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        word_phrase TEXT NOT NULL,
+        definition TEXT NOT NULL,
+        example TEXT,
+        views INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        unit_number INTEGER DEFAULT NULL,
+        comments TEXT DEFAULT NULL
+    )
+    """,
+    """
+    CREATE TABLE notes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        unit_number INTEGER,
+        tags TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        views INTEGER DEFAULT 0,
+        is_favorite BOOLEAN DEFAULT 0,
+        has_worksheet BOOLEAN DEFAULT 0
+    )
+    """,
+]
+
+# (name, statement, values), as issued by the routes
+STATEMENTS = [
+    ("dictionary.render_entry", """
+        SELECT id, word_phrase, definition, example, views, unit_number, comments,
+               strftime('%Y-%m-%d', created_at) as created_date,
+               strftime('%Y-%m-%d', last_updated) as last_updated
+        FROM entries
+        WHERE id = :id
+    """, {"id": 500}),
+    ("dictionary.increment_views", """
+        UPDATE entries
+        SET views = COALESCE(views, 0) + 1
+        WHERE id = :id
+    """, {"id": 500}),
+    ("notes.view_note", """
+        SELECT *,
+               strftime('%Y-%m-%d', created_at) as created_date,
+               strftime('%Y-%m-%d', last_updated) as last_updated
+        FROM notes
+        WHERE id = :id
+    """, {"id": 500}),
+    ("notes.toggle_favorite", "UPDATE notes SET is_favorite = NOT is_favorite WHERE id = ?", (500,)),
+]
+
+
+def create_database(path, count):
+    """Create entries and notes, with count rows each"""
+    connection = sqlite3.connect(path)
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.executemany("INSERT INTO entries (word_phrase, definition) VALUES (?, ?)",
+                           ((f"phrase {i}", f"definition {i}") for i in range(count)))
+    connection.executemany("INSERT INTO notes (title, content) VALUES (?, ?)",
+                           ((f"Note {i}", f"content {i}") for i in range(count)))
+    connection.commit()
+    connection.close()
+
+
+def time_execute(db, statement, values, iterations):
+    """Return median microseconds per call of db.execute(statement, values), over batches of iterations // 10"""
+    batch = max(iterations // 10, 1)
+    call = (lambda: db.execute(statement, **values)) if isinstance(values, dict) else \
+        (lambda: db.execute(statement, *values))
+    times = []
+    for _ in range(10):
+        start = time.perf_counter()
+        for _ in range(batch):
+            call()
+        times.append((time.perf_counter() - start) / batch)
+    return sorted(times)[len(times) // 2] * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        create_database(path, 1000)
+        db = SQL(f"sqlite:///{path}", bind_parameters=True, pooling="thread")
+        db.execute("SELECT 1")
+
+        print(f"{'statement':<28} {'uncached (us)':>14} {'cached (us)':>12} {'speedup':>8}")
+        cached_parser = sql._parse_statement
+        total_uncached = total_cached = 0.0
+        for name, statement, values in STATEMENTS:
+            # Before: every call parses with sqlparse
+            sql._parse_statement = cached_parser.__wrapped__
+            try:
+                uncached = time_execute(db, statement, values, iterations)
+            finally:
+                sql._parse_statement = cached_parser
+
+            # After: first call parses, the rest hit the cache
+            cached = time_execute(db, statement, values, iterations)
+
+            total_uncached += uncached
+            total_cached += cached
+            print(f"{name:<28} {uncached:>14.1f} {cached:>12.1f} {uncached / cached:>7.1f}x")
+
+        count = len(STATEMENTS)
+        print(f"{'mean per call':<28} {total_uncached / count:>14.1f} {total_cached / count:>12.1f} "
+              f"{total_uncached / total_cached:>7.1f}x")
+        print(SQL.statement_cache_info())
+
+
+if __name__ == '__main__':
+    main()
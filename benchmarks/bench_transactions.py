@@ -0,0 +1,109 @@
+"""
+Measure write-heavy route patterns with one commit per statement (each
+db.execute autocommits) against one commit per route (db.transaction()).
+
+delete_worksheet deletes a worksheet, counts the note's remaining ones and
+clears its flag; duplicate_note inserts a note, its worksheets and sets its
+flag. Each commit in SQLite's default rollback-journal mode costs fsyncs,
+so fewer commits per request means fewer fsyncs.
+
+Runs against a temporary database with the notes schema, so the real
+notes.db is never touched.
+
+Usage: python benchmarks/bench_transactions.py [operations]
+"""
+import contextlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from sql import SQL
+
+SCHEMA = [
+    """
+    CREATE TABLE notes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        unit_number INTEGER,
+        has_worksheet BOOLEAN DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE worksheet_images (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        note_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        original_filename TEXT NOT NULL,
+        FOREIGN KEY (note_id) REFERENCES notes (id) ON DELETE CASCADE
+    )
+    """,
+    "CREATE INDEX idx_worksheet_images_note_id ON worksheet_images(note_id)",
+]
+
+
+def create_database(path, count):
+    """Create notes with one worksheet each"""
+    connection = sqlite3.connect(path)
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.executemany(
+        "INSERT INTO notes (title, content, unit_number, has_worksheet) VALUES (?, ?, 1, 1)",
+        ((f"Note {i}", "Content " * 50) for i in range(count)))
+    connection.executemany(
+        "INSERT INTO worksheet_images (note_id, filename, original_filename) VALUES (?, ?, ?)",
+        ((i + 1, f"{i}.png", "scan.png") for i in range(count)))
+    connection.commit()
+    connection.close()
+
+
+def delete_worksheet(db, worksheet_id):
+    """Statements issued by notes.delete_worksheet (3 autocommitted statements)"""
+    db.execute("DELETE FROM worksheet_images WHERE id = :id", id=worksheet_id)
+    remaining = db.execute("SELECT COUNT(*) as count FROM worksheet_images WHERE note_id = :note_id",
+                           note_id=worksheet_id)
+    if remaining[0]['count'] == 0:
+        db.execute("UPDATE notes SET has_worksheet = 0 WHERE id = :note_id", note_id=worksheet_id)
+
+
+def duplicate_note(db, note_id):
+    """Statements issued by notes.duplicate_note for a note with three worksheets (5 autocommitted statements)"""
+    new_note_id = db.execute("INSERT INTO notes (title, content, unit_number) VALUES (?, ?, ?)",
+                             f"Note {note_id} (Copy)", "Content " * 50, 2)
+    for i in range(3):
+        db.execute("INSERT INTO worksheet_images (note_id, filename, original_filename) VALUES (?, ?, ?)",
+                   new_note_id, f"{note_id}-{i}.png", "scan.png")
+    db.execute("UPDATE notes SET has_worksheet = 1 WHERE id = ?", new_note_id)
+
+
+def run(db, route, count, grouped):
+    """Return seconds per route, optionally wrapping each in a transaction"""
+    start = time.perf_counter()
+    for i in range(1, count + 1):
+        with db.transaction() if grouped else contextlib.nullcontext():
+            route(db, i)
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'route':<18} {'per statement (ms)':>19} {'transaction (ms)':>17} {'speedup':>8}")
+        for route in [delete_worksheet, duplicate_note]:
+            results = []
+            for grouped in [False, True]:
+                path = os.path.join(directory, f"{route.__name__}_{grouped}.db")
+                create_database(path, count)
+                results.append(run(SQL(f"sqlite:///{path}", bind_parameters=True), route, count, grouped))
+            print(f"{route.__name__:<18} {results[0] * 1e3:>19.2f} {results[1] * 1e3:>17.2f} "
+                  f"{results[0] / results[1]:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
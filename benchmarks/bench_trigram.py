@@ -0,0 +1,115 @@
+"""
+Measure substring searches of notes through the trigram index (notes_trigram)
+against the LIKE '%q%' scans it replaces, at 100k notes by default.
+
+Fragments range from common to absent, since LIKE with a LIMIT stops early
+when matches are common but scans every note when they're rare, while the
+trigram index intersects the postings of each fragment's trigrams either way.
+Also reports the index's size and how long building it takes.
+
+Runs against a temporary database with the notes schema, so the real
+notes.db is never touched.
+
+Usage: python benchmarks/bench_trigram.py [notes]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import setup_fts
+
+WORDS = ["the", "court", "held", "that", "charter", "rights", "freedoms", "reasonable", "limits", "prescribed",
+         "by", "law", "justified", "free", "democratic", "society", "criminal", "code", "sentence", "offender",
+         "negligence", "duty", "care", "standard", "breach", "damages", "contract", "offer", "acceptance"]
+
+# Fragments, from common to absent, and the share of notes that contain each
+FRAGMENTS = [("ourt hel", "common"), ("emocrati", "common"), ("718.2(e)", "1 in 1,000"),
+             ("habeas", "1 in 10,000"), ("xqzv", "none")]
+
+# LIKE query as issued by the search routes before the trigram index
+LIKE = """
+    SELECT id, title, substr(content, 1, 200) AS content
+    FROM notes
+    WHERE LOWER(title) LIKE LOWER(:query) OR LOWER(content) LIKE LOWER(:query)
+    LIMIT 10
+"""
+
+TRIGRAM = """
+    SELECT n.id, n.title, substr(n.content, 1, 200) AS content
+    FROM notes_trigram
+    JOIN notes AS n ON n.id = notes_trigram.rowid
+    WHERE notes_trigram MATCH :query
+    LIMIT 10
+"""
+
+
+def create_database(path, count):
+    """Create notes with count synthetic notes of about 300 words, some citing statutes or Latin"""
+    generator = random.Random(0)
+    connection = sqlite3.connect(path)
+    connection.execute("""
+        CREATE TABLE notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            tags TEXT
+        )
+    """)
+
+    def content(i):
+        words = generator.choices(WORDS, k=300)
+        if i % 1000 == 0:
+            words.append("s. 718.2(e)")
+        if i % 10000 == 0:
+            words.append("habeas corpus")
+        return " ".join(words)
+
+    connection.executemany("INSERT INTO notes (title, content, tags) VALUES (?, ?, ?)",
+                           ((f"Note {i}", content(i), "law") for i in range(count)))
+    connection.commit()
+    connection.close()
+
+
+def time_query(connection, query, value, repeat=5):
+    """Return median milliseconds of query, and its rows' count"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = connection.execute(query, {"query": value}).fetchall()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1e3, len(rows)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "notes.db")
+        create_database(path, count)
+        size = os.path.getsize(path)
+
+        # Build the trigram index (and its triggers) as the app does
+        connection = sqlite3.connect(path)
+        start = time.perf_counter()
+        setup_fts.setup_trigram_index(connection.cursor(), "notes", ["title", "content", "tags"])
+        connection.commit()
+        print(f"{count:,} notes ({size / 2**20:.0f} MiB), trigram index built in {time.perf_counter() - start:.1f} s "
+              f"(+{(os.path.getsize(path) - size) / 2**20:.0f} MiB)")
+
+        print(f"{'fragment':<12} {'matches':<12} {'LIKE (ms)':>10} {'trigram (ms)':>13} {'speedup':>8}")
+        for fragment, share in FRAGMENTS:
+            like, rows = time_query(connection, LIKE, f"%{fragment}%")
+            trigram, trigram_rows = time_query(connection, TRIGRAM, f'"{fragment}"')
+            assert rows == trigram_rows, (fragment, rows, trigram_rows)
+            print(f"{fragment:<12} {share:<12} {like:>10.2f} {trigram:>13.2f} {like / trigram:>7.1f}x")
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
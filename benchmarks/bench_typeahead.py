@@ -0,0 +1,80 @@
+"""
+Measure typeahead completion latency at a million labels, against the
+prefix LIKE query it replaces, and the cost of loading and updating the
+index.
+
+Labels are synthetic multi-word phrases, so the real databases are never
+touched. The LIKE query, which matches the start of a label or of any of
+its words, as the index does, runs against a temporary table of the same
+labels.
+
+Usage: python benchmarks/bench_typeahead.py [labels]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from typeahead import Typeahead
+
+WORDS = ["actus", "reus", "mens", "rea", "habeas", "corpus", "estoppel", "tort", "contract", "negligence",
+         "statute", "common", "law", "civil", "criminal", "appeal", "crown", "charter", "rights", "freedoms"]
+
+
+def labels(count):
+    """Yield count synthetic (kind, id, label)"""
+    generator = random.Random(0)
+    for i in range(count):
+        words = generator.sample(WORDS, generator.randint(1, 4))
+        yield "dictionary", i, " ".join(words) + f" {i}"
+
+
+def time_calls(f, prefixes):
+    """Return median and maximum milliseconds of f(prefix) over prefixes"""
+    times = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        f(prefix)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1e3, max(times) * 1e3
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    prefixes = [word[:n] for word in WORDS for n in [1, 2, 4]] + ["actus reus", "habeas corpus 12", "xyz"]
+
+    start = time.perf_counter()
+    index = Typeahead(lambda: labels(count))
+    index.complete("a")
+    print(f"{count:,} labels ({index.info()['keys']:,} keys), loaded in {time.perf_counter() - start:.1f} s")
+    print("  complete:         {:8.3f} ms median, {:8.3f} ms max".format(
+        *time_calls(lambda prefix: index.complete(prefix, 8), prefixes)))
+
+    start = time.perf_counter()
+    for i in range(1000):
+        index.add("dictionary", i, f"updated {i}")
+    print(f"  add (replace):    {(time.perf_counter() - start) / 1000 * 1e3:8.3f} ms per call")
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, "labels.db"))
+        connection.execute("CREATE TABLE entries (id INTEGER PRIMARY KEY, word_phrase TEXT COLLATE NOCASE)")
+        connection.executemany("INSERT INTO entries VALUES (?, ?)", ((i, label) for _, i, label in labels(count)))
+        connection.execute("CREATE INDEX idx_word_phrase ON entries(word_phrase)")
+        connection.commit()
+
+        def like(prefix):
+            return connection.execute(
+                "SELECT id, word_phrase FROM entries WHERE word_phrase LIKE ? OR word_phrase LIKE ? LIMIT 8",
+                (prefix + "%", "% " + prefix + "%")
+            ).fetchall()
+        print("  LIKE:             {:8.3f} ms median, {:8.3f} ms max".format(*time_calls(like, prefixes)))
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
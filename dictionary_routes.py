@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, abort, jsonify
 from sql import SQL
-import sqlite3
+import fulltext
+import spelling
+import typeahead
 from datetime import datetime
 import re
 
@@ -102,12 +104,14 @@ def get_related_terms(word_phrase, current_id=None, limit=5):
 def index():
     
     db = SQL("sqlite:///dictionary.db")
+
+    # Not cached, since public views of entries write their views, invalidating results that read entries
     entries = db.execute("""
         SELECT id, word_phrase, definition, example, views, 
                strftime('%Y-%m-%d', created_at) as created_date
         FROM entries 
         ORDER BY word_phrase ASC
-    """)
+    """, rows="record")
     return render_template("dictionary/index.html", entries=entries)
 
 @dict_bp.route('/add', methods=['GET', 'POST'])
@@ -139,7 +143,7 @@ def add_entry():
         
         try:
             db = SQL("sqlite:///dictionary.db")
-            db.execute("""
+            entry_id = db.execute("""
                 INSERT INTO entries (word_phrase, definition, example, unit_number, comments)
                 VALUES (:word_phrase, :definition, :example, :unit_number, :comments)
             """, 
@@ -148,11 +152,14 @@ def add_entry():
             example=example if example else None,
             unit_number=unit_number,
             comments=comments if comments else None)
+            typeahead.index.add("dictionary", entry_id, word_phrase)
+            spelling.index.add("dictionary", entry_id, word_phrase)
+            fulltext.changed("entries", entry_id)
             
             flash('Entry added successfully!', 'success')
             return redirect(url_for('dictionary.index'))
             
-        except sqlite3.IntegrityError:
+        except ValueError:  # SQL raises ValueError when a constraint is violated
             flash('This word/phrase already exists in the dictionary', 'error')
             return render_template('dictionary/add.html',
                                 word_phrase=word_phrase,
@@ -228,6 +235,9 @@ def edit_entry(entry_id):
             definition=definition,
             example=example if example else None,
             id=entry_id)
+            typeahead.index.add("dictionary", entry_id, word_phrase)
+            spelling.index.add("dictionary", entry_id, word_phrase)
+            fulltext.changed("entries", entry_id)
             
             flash('Entry updated successfully!', 'success')
             return redirect(url_for('dictionary.view_entry', entry_id=entry_id))
@@ -260,6 +270,9 @@ def delete_entry(entry_id):
             
         # Delete the entry
         db.execute("DELETE FROM entries WHERE id = ?", entry_id)
+        typeahead.index.remove("dictionary", entry_id)
+        spelling.index.remove("dictionary", entry_id)
+        fulltext.changed("entries", entry_id)
         
         return jsonify({'success': True, 'message': 'Entry deleted successfully'})
     except Exception as e:
@@ -275,99 +288,16 @@ def search():
     try:
         db = SQL("sqlite:///dictionary.db")
         
-        # Split query into keywords
-        keywords = re.findall(r'\b\w+\b', query.lower())
-        
-        # Base query
-        search_query = """
-            SELECT id, word_phrase, definition, example, views, 
-                   strftime('%Y-%m-%d', created_at) as created_date
-            FROM entries
-            WHERE 1=1
-        """
-        
-        # Start with empty params list
-        params = []
-        
-        # Add conditions based on query type
-        search_fields = [
-            'word_phrase',
-            'definition',
-            'example'
-        ]
-        
-        if len(keywords) == 1 and ' ' not in query:
-            # Single word search - check for exact match, starts with, or contains
-            exact_term = keywords[0]
-            starts_with = f"{exact_term}%"
-            contains = f"%{exact_term}%"
-            
-            # Build conditions for each field
-            field_conditions = []
-            for field in search_fields:
-                field_conditions.append(f"{field} = ?")  # Exact match
-                field_conditions.append(f"{field} LIKE ?")  # Starts with
-                field_conditions.append(f"{field} LIKE ?")  # Contains
-                
-                # Add parameters for each condition
-                params.extend([exact_term, starts_with, contains])
-            
-            # Combine all field conditions with OR
-            search_query += " AND (" + " OR ".join(field_conditions) + ")"
-            
-            # Add ORDER BY with relevance scoring
-            search_query += """
-                ORDER BY 
-                    CASE 
-                        WHEN word_phrase = ? THEN 1
-                        WHEN word_phrase LIKE ? THEN 2
-                        ELSE 3
-                    END,
-                    LENGTH(word_phrase) ASC,
-                    word_phrase ASC
-            """
-            # Add parameters for ORDER BY
-            params.extend([exact_term, starts_with])
-        else:
-            # Multi-word or phrase search
-            search_query += " AND ("
-            conditions = []
-            
-            # Add exact phrase match across all fields
-            for field in search_fields:
-                conditions.append(f"{field} = ?")
-                conditions.append(f"{field} LIKE ?")
-                params.extend([query, f"%{query}%"])
-            
-            # Add individual word matches across all fields
-            for keyword in keywords:
-                if len(keyword) > 2:  # Only consider words longer than 2 characters
-                    for field in search_fields:
-                        conditions.append(f"{field} LIKE ?")
-                        params.append(f"%{keyword}%")
-            
-            search_query += " OR ".join(conditions)
-            search_query += """)
-                ORDER BY 
-                    CASE 
-                        WHEN word_phrase = ? THEN 1
-                        WHEN word_phrase LIKE ? THEN 2
-                        ELSE 3
-                    END,
-                    LENGTH(word_phrase) ASC,
-                    word_phrase ASC
-            """
-            params.extend([query, f"{query}%"])
-        
-        # Add limit
-        search_query += " LIMIT 50"
+        # Search word_phrase, definition, and example, an exact match first, then best matches
+        entries = fulltext.search_entries(db, query, limit=50, endpoint=request.endpoint)
         
-        # Execute the query
-        entries = db.execute(search_query, *params)
+        # Suggest a correction of misspelled words if nothing was found
+        suggestion = None if entries else spelling.index.correct(query)
         
         return render_template('dictionary/search.html', 
                              entries=entries, 
-                             query=query)
+                             query=query,
+                             suggestion=suggestion)
                              
     except Exception as e:
         current_app.logger.error(f"Search error for '{query}': {str(e)}")
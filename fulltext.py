@@ -0,0 +1,401 @@
+"""
+Full-text search over the dictionary's entries and the notes, shared by app.search, the /api/search endpoints, and
+dictionary.search.
+
+Searches run on the FTS5 indexes that setup_fts.py creates (entries_fts and notes_fts), ranked by bm25() with
+phrases and titles weighted above bodies, so their cost grows with the number of matches rather than with the size
+of the tables. Fragments in the middle of words (e.g., statute numbers), which those indexes of whole words can't
+match, are then matched through trigram indexes (entries_trigram and notes_trigram), which intersect the postings of
+each fragment's trigrams rather than scanning. Where indexes are missing (e.g., setup_fts.py was never run, or
+SQLite was built without FTS5), searches fall back to LIKE scans, which rank more crudely. Where an in-process engine
+is enabled instead (see inverted.py), searches run on it, and the routes that write rows tell it through changed.
+
+Routes' searches are cached, as the rows they return, by route, query (lowercased, without stopwords), and limit,
+so that popular queries don't search again until the table searched is written (of which changed tells the cache,
+too).
+"""
+import collections
+import html
+import re
+import sys
+import threading
+import time
+
+# bm25() weights of each index's columns, in order: word_phrase, definition, example; and title, content, tags
+ENTRIES_WEIGHTS = (10.0, 1.0, 0.5)
+NOTES_WEIGHTS = (10.0, 1.0, 2.0)
+
+# Length of snippets, in tokens (at most 64) when from an index, else in characters
+SNIPPET_TOKENS = 24
+SNIPPET_CHARACTERS = 160
+
+# Markup around matches, in place of the control characters that mark them until then (which text never contains)
+HIGHLIGHT = ('<mark class="highlight">', "</mark>")
+_OPEN, _CLOSE = chr(2), chr(3)
+
+# An HTML tag, or the start of one cut off by a snippet
+TAG = re.compile(r"</?[a-zA-Z][^<>]*(?:>|$)")
+
+# Words too common to narrow searches, which are dropped from them (unless they're all there is)
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from has have he her his i if in into is it its not of on or she so than that
+    the their them then there these they this to was were what when which who will with
+""".split())
+
+# In-process engine that searches run on in place of the indexes, if enabled (see inverted.py)
+engine = None
+
+
+class QueryCache(object):
+    """
+    Least-recently-used cache of searches' rows, by endpoint, table, normalized query, and limit, each expiring after
+    ttl seconds (unless None), since changes by other processes (e.g., enhance_note.py) don't invalidate them.
+
+    Each table has a generation, incremented by changed whenever one of its rows is written, and results are only
+    returned while their table's generation is the one they were computed at, so a write invalidates every result of
+    its table at once, without finding them.
+    """
+
+    def __init__(self, size, ttl=None):
+        self._size = size
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()  # key: (generation, expiry, rows, bytes)
+        self._generations = collections.defaultdict(int)
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._bytes = 0
+
+    def get(self, key):
+        """Return the cached rows for key (whose second item is its table), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] != self._generations[key[1]] or
+                                      entry[1] is not None and entry[1] < time.monotonic()):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[2]
+
+    def generation(self, table):
+        """Return table's current generation, to be passed to put."""
+        with self._lock:
+            return self._generations[table]
+
+    def put(self, key, generation, rows):
+        """Cache rows for key, unless its table has been written since generation was returned."""
+        size = (sys.getsizeof(rows) + sum(sys.getsizeof(row) + sum(map(sys.getsizeof, row.values())) for row in rows)
+                + sum(map(sys.getsizeof, key)))
+        with self._lock:
+            if generation != self._generations[key[1]]:
+                return
+            if key in self._entries:
+                self._remove(key)
+            expiry = time.monotonic() + self._ttl if self._ttl is not None else None
+            self._entries[key] = (generation, expiry, rows, size)
+            self._bytes += size
+            while len(self._entries) > self._size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, table):
+        """Invalidate every result of table."""
+        with self._lock:
+            self._generations[table] += 1
+
+    def info(self):
+        """Return hits, misses, hit ratio, current and maximum size, and an estimate of the bytes used by results."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 3) if lookups else None,
+                "size": len(self._entries),
+                "max_size": self._size,
+                "bytes": self._bytes,
+            }
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[3]
+
+
+# Cache of searches made with an endpoint, of the 1024 most recent queries, for at most 5 minutes
+cache = QueryCache(1024, ttl=300)
+
+
+def terms(text):
+    """Return text's words, lowercased, as searched for"""
+    return re.findall(r"\w+", text.lower())
+
+
+def normalize(text):
+    """Return text's words, lowercased, without stopwords (unless there are only stopwords), as searched for"""
+    words = terms(text)
+    return [word for word in words if word not in STOPWORDS] or words
+
+
+def match_expression(words):
+    """
+    Return an FTS5 query matching rows that contain every word (or a word that it prefixes), quoting each so that
+    FTS5's own syntax (e.g., AND, NEAR, column filters) in users' queries is taken literally
+    """
+    return " ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+def has_index(db, name, schema="main"):
+    """Return whether the FTS5 table name exists in db (or in the database attached to it as schema)"""
+    return bool(db.execute(
+        f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", name, cache=True
+    ))
+
+
+def substring_expression(text):
+    """
+    Return an FTS5 query of a trigram index matching rows that contain every fragment of text (as separated by
+    whitespace, e.g., "718.2(e)" or "psa loq") anywhere, even mid-word, ignoring fragments shorter than a trigram,
+    or None if there are no longer ones
+    """
+    fragments = [fragment for fragment in text.split() if len(fragment) >= 3]
+    if not fragments:
+        return None
+    return " AND ".join('"{}"'.format(fragment.replace('"', '""')) for fragment in fragments)
+
+
+def search_entries(db, text, limit=50, schema="main", endpoint=None):
+    """
+    Return up to limit dictionary entries containing every word of text, an exact match of word_phrase first, then
+    by rank, followed (if fewer than limit) by entries containing text's fragments mid-word, with id, word_phrase,
+    definition, example, views, and created_date, along with highlight (word_phrase) and snippet (of definition) as
+    HTML in which matches are highlighted. If endpoint (e.g., the calling route's), the entries are cached, by
+    endpoint, text's normalized words, and limit, until entries are written.
+    """
+    words = normalize(text)
+    if not words:
+        return []
+    return _cached((endpoint, "entries", " ".join(words), limit),
+                   lambda: _search_entries(db, text, words, limit, schema))
+
+
+def search_notes(db, text, limit=10, endpoint=None):
+    """
+    Return up to limit notes containing every word of text, by rank, followed (if fewer than limit) by notes
+    containing text's fragments mid-word, with id, title, unit_number, and last_updated, along with highlight (title)
+    and snippet (of content) as HTML in which matches are highlighted, but not content. If endpoint, the notes are
+    cached, as search_entries' are.
+    """
+    words = normalize(text)
+    if not words:
+        return []
+    return _cached((endpoint, "notes", " ".join(words), limit), lambda: _search_notes(db, text, words, limit))
+
+
+def entries_by_id(db, ids, text, schema="main"):
+    """
+    Return dictionary entries ids, as search_entries does, an exact match of text first, then in order of ids, with
+    matches of text's words marked here
+    """
+    rows = list(db.get_many(f"{schema}.entries", ids, [
+        "word_phrase", "definition", "example", "views", "created_at"]).values())
+    rows.sort(key=lambda row: (row["word_phrase"] or "").casefold() != text.strip().casefold())
+    pattern = _pattern(normalize(text))
+    for row in rows:
+        row["created_date"] = str(row.pop("created_at") or "")[:10] or None
+        row["highlight"] = markup(_mark(row["word_phrase"], pattern))
+        row["snippet"] = markup(_mark(row["definition"], pattern, SNIPPET_CHARACTERS))
+    return rows
+
+
+def notes_by_id(db, ids, text):
+    """Return notes ids, as search_notes does, in order of ids, with matches of text's words marked here"""
+    rows = list(db.get_many("notes", ids, ["title", "content", "unit_number", "last_updated"]).values())
+    pattern = _pattern(normalize(text))
+    for row in rows:
+        row["highlight"] = markup(_mark(row["title"], pattern))
+        row["snippet"] = markup(_mark(TAG.sub("", row.pop("content") or ""), pattern, SNIPPET_CHARACTERS))
+    return rows
+
+
+def _cached(key, search):
+    """
+    Return search()'s rows, or, if cached for key (unless its endpoint is None), the rows cached, copying rows that
+    callers could change
+    """
+    if key[0] is None or cache is None:
+        return search()
+    rows = cache.get(key)
+    if rows is not None:
+        return [dict(row) for row in rows]
+    generation = cache.generation(key[1])
+    rows = search()
+    cache.put(key, generation, [dict(row) for row in rows])
+    return rows
+
+
+def _search_entries(db, text, words, limit, schema):
+    """Return search_entries' rows, from the engine, if enabled, else from the indexes, else by scanning"""
+    if engine is not None:
+        return engine.search_entries(db, text, limit, schema)
+
+    # Match words (or their prefixes) by the word index, then fragments anywhere by the trigram index
+    fts, trigram = has_index(db, "entries_fts", schema), has_index(db, "entries_trigram", schema)
+    select = """t.id, t.word_phrase, t.definition, t.example, t.views,
+                strftime('%Y-%m-%d', t.created_at) AS created_date"""
+    exact = "t.word_phrase = :text COLLATE NOCASE DESC"
+    rows = []
+    if fts:
+        rows = _match(db, "entries_fts", "entries", select, match_expression(words), ENTRIES_WEIGHTS, limit,
+                      schema, first=exact, text=text.strip())
+    if trigram and len(rows) < limit and substring_expression(text):
+        rows += _others(rows, _match(db, "entries_trigram", "entries", select, substring_expression(text),
+                                     ENTRIES_WEIGHTS, limit, schema, first=exact, text=text.strip()), limit)
+
+    # Fall back to scanning, ranking phrases that start with text above others, and to marking matches here
+    if not fts and not trigram:
+        conditions, values = _like_conditions(words, ["word_phrase", "definition", "example"])
+        rows = db.execute(f"""
+            SELECT id, word_phrase, definition, example, views,
+                   strftime('%Y-%m-%d', created_at) AS created_date
+            FROM {schema}.entries
+            WHERE {conditions}
+            ORDER BY word_phrase = :text COLLATE NOCASE DESC, word_phrase LIKE :prefix DESC,
+                     LENGTH(word_phrase), word_phrase
+            LIMIT :limit
+        """, text=text.strip(), prefix=f"{text.strip()}%", limit=limit, **values)
+        pattern = _pattern(words)
+        for row in rows:
+            row["highlight"] = _mark(row["word_phrase"], pattern)
+            row["snippet"] = _mark(row["definition"], pattern, SNIPPET_CHARACTERS)
+
+    for row in rows:
+        row["highlight"], row["snippet"] = markup(row["highlight"]), markup(row["snippet"])
+    return rows
+
+
+def _search_notes(db, text, words, limit):
+    """Return search_notes' rows, from the engine, if enabled, else from the indexes, else by scanning"""
+    if engine is not None:
+        return engine.search_notes(db, text, limit)
+
+    # Match words (or their prefixes) by the word index, then fragments anywhere by the trigram index
+    fts, trigram = has_index(db, "notes_fts"), has_index(db, "notes_trigram")
+    select = "t.id, t.title, t.unit_number, t.last_updated"
+    rows = []
+    if fts:
+        rows = _match(db, "notes_fts", "notes", select, match_expression(words), NOTES_WEIGHTS, limit)
+    if trigram and len(rows) < limit and substring_expression(text):
+        rows += _others(rows, _match(db, "notes_trigram", "notes", select, substring_expression(text),
+                                     NOTES_WEIGHTS, limit), limit)
+
+    # Fall back to scanning, ranking notes whose title contains text above others, and to marking matches here
+    if not fts and not trigram:
+        conditions, values = _like_conditions(words, ["title", "content", "tags"])
+        rows = db.execute(f"""
+            SELECT id, title, content, unit_number, last_updated
+            FROM notes
+            WHERE {conditions}
+            ORDER BY title LIKE :contains DESC, last_updated DESC
+            LIMIT :limit
+        """, contains=f"%{text.strip()}%", limit=limit, **values)
+        pattern = _pattern(words)
+        for row in rows:
+            row["highlight"] = _mark(row["title"], pattern)
+            row["snippet"] = _mark(TAG.sub("", row.pop("content")), pattern, SNIPPET_CHARACTERS)
+
+    for row in rows:
+        row["highlight"], row["snippet"] = markup(row["highlight"]), markup(row["snippet"])
+    return rows
+
+
+def _match(db, index, table, select, expression, weights, limit, schema="main", first=None, **values):
+    """
+    Return up to limit rows of table (as t) whose index matches expression, selecting select, ordered by first (if
+    any) then by bm25() with weights, along with highlight (of the first column) and snippet (of the second) as
+    marked text
+    """
+    rank = "bm25({}, {})".format(index, ", ".join(map(str, weights)))
+
+    # Snippets' lengths are in tokens, which a trigram index has one of per character
+    tokens = 64 if index.endswith("_trigram") else SNIPPET_TOKENS
+    return db.execute(f"""
+        SELECT {select},
+               highlight({index}, 0, char(2), char(3)) AS highlight,
+               snippet({index}, 1, char(2), char(3), '...', {tokens}) AS snippet
+        FROM {schema}.{index}
+        JOIN {schema}.{table} AS t ON t.id = {index}.rowid
+        WHERE {index} MATCH :match
+        ORDER BY {first + ", " if first else ""}{rank}
+        LIMIT :limit
+    """, match=expression, limit=limit, **values)
+
+
+def _others(rows, more, limit):
+    """Return those of more that aren't among rows, enough to bring rows to limit"""
+    ids = {row["id"] for row in rows}
+    return [row for row in more if row["id"] not in ids][:limit - len(rows)]
+
+
+def markup(text):
+    """
+    Return text, as marked by highlight(), snippet(), or _mark, as HTML: escaped, without any (partial) tags of its
+    own (e.g., from notes' HTML content), and with matches highlighted
+    """
+    text = html.escape(TAG.sub("", text or ""), quote=False)
+    return text.replace(_OPEN, HIGHLIGHT[0]).replace(_CLOSE, HIGHLIGHT[1])
+
+
+def _pattern(words):
+    """Return a pattern matching any of words (longest first, so that one word doesn't split another's match)"""
+    return re.compile("|".join(map(re.escape, sorted(words, key=len, reverse=True))), re.IGNORECASE)
+
+
+def _mark(text, pattern, width=None):
+    """
+    Return text with pattern's matches marked, as highlight() would, or, if width, as snippet() would: cut to width
+    characters, starting a little before the first match
+    """
+    text = text or ""
+    if width is not None and len(text) > width:
+        match = pattern.search(text)
+        start = max(0, match.start() - width // 4) if match else 0
+        text = ("..." if start > 0 else "") + text[start:start + width] + ("..." if start + width < len(text) else "")
+    return pattern.sub(lambda match: _OPEN + match.group(0) + _CLOSE, text)
+
+
+def _like_conditions(words, columns):
+    """Return a condition that each word is in one of columns, along with its named placeholders' values"""
+    conditions, values = [], {}
+    for i, word in enumerate(words):
+        conditions.append("(" + " OR ".join(f"{column} LIKE :term{i}" for column in columns) + ")")
+        values[f"term{i}"] = f"%{word}%"
+    return " AND ".join(conditions), values
+
+
+def changed(table, id):
+    """
+    Invalidate cached searches of table ("entries" or "notes"), and update the in-process engine's index of it, if
+    enabled, with row id as just written
+    """
+    if cache is not None:
+        cache.invalidate(table)
+    if engine is not None:
+        engine.changed(table, id)
+
+
+def rebuild(db, index):
+    """Rebuild index from its content table, as after changes made while its triggers were missing"""
+    db.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+
+
+def optimize(db, index):
+    """Merge index's b-trees into one, which speeds up queries after many incremental changes"""
+    db.execute(f"INSERT INTO {index} ({index}) VALUES ('optimize')")
+
+
+def check(db, index):
+    """Return None if index is consistent with itself and with its content table, else why not"""
+    try:
+        db.execute(f"INSERT INTO {index} ({index}, rank) VALUES ('integrity-check', 1)")
+    except RuntimeError as e:
+        return str(e)
@@ -0,0 +1,442 @@
+"""
+In-process full-text search of the dictionary's entries and the notes, for deployments large enough that round trips
+to SQLite's FTS5 indexes dominate searches' latency. Enabled by enable (as app.py does if SEARCH_INDEX is set), after
+which fulltext's searches rank documents here, then fetch just the rows found, by id.
+
+Each table's index is a directory of immutable segments, listed in order by a MANIFEST. A segment is a file of arrays
+(documents' ids and lengths, terms' offsets, and postings of documents and weights, sorted by term, then document),
+which every process memory-maps, so workers share one copy of each through the OS's page cache and open it without
+parsing anything. Terms are stemmed, as by FTS5's porter tokenizer (see porter.py), so that searches match what
+FTS5's would. Searches score a word's postings, all of its prefixed terms' at once, as whole NumPy arrays.
+
+Edits append a segment of just the documents changed (or, if deleted, a tombstone), superseding their copies in older
+segments, and once there are more than MAX_SEGMENTS, they're merged into one in the background. Writers serialize
+through a lock file; readers never lock, as the MANIFEST is only ever replaced (atomically), and pick up other
+processes' changes when it is.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+
+import fulltext
+import porter
+from sql import SQL
+
+# bm25's parameters, as FTS5's
+K1 = 1.2
+B = 0.75
+
+# Number of segments beyond which an index's segments are merged into one
+MAX_SEGMENTS = 8
+
+# Segments' header: magic, version, and numbers of documents, terms, postings, and bytes of terms (in native order, as
+# segments are only shared by processes on one host); indexes of another version (e.g., 1's unstemmed terms) are
+# rebuilt on first use
+HEADER = struct.Struct("=4s5I")
+MAGIC, VERSION = b"LNIX", 2
+
+
+class Segment(object):
+    """Memory-mapped segment, as written by _write."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, documents, terms, postings, size = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise RuntimeError(f"{path} is not a segment of version {VERSION}")
+
+        # Arrays over the file, without copying it
+        offset = HEADER.size
+        arrays = []
+        for dtype, count in [(np.int64, documents), (np.float32, documents), (np.uint32, terms + 1),
+                             (np.uint32, terms + 1), (np.uint32, postings), (np.float32, postings)]:
+            arrays.append(np.frombuffer(self._map, dtype, count, offset))
+            offset += np.dtype(dtype).itemsize * count
+        self.ids, self.lengths, self._terms, self._postings, self.documents, self.weights = arrays
+        self._text = offset  # Terms' UTF-8, concatenated
+
+    def term(self, i):
+        """Return term i (in sorted order), as UTF-8."""
+        return self._map[self._text + int(self._terms[i]):self._text + int(self._terms[i + 1])]
+
+    def prefixed(self, prefix):
+        """Return the range of postings (as start and stop) of every term that prefix (UTF-8) prefixes."""
+        lo, hi = 0, len(self._terms) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = lo
+        hi = len(self._terms) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid)[:len(prefix)] <= prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        return int(self._postings[start]), int(self._postings[lo])
+
+    def terms(self):
+        """Return every term, in sorted order."""
+        return [self.term(i).decode() for i in range(len(self._terms) - 1)]
+
+    def postings(self):
+        """Return each posting's term's index."""
+        return np.repeat(np.arange(len(self._terms) - 1, dtype=np.uint32), np.diff(self._postings))
+
+
+class Index(object):
+    """Segmented inverted index of one table, whose documents are its rows' columns, weighted by weights."""
+
+    def __init__(self, directory, load, weights):
+        """
+        load is called with a list of ids (or None, for every row) to return an iterable of (id, values), values being
+        the columns to index, in the order of weights.
+        """
+        self.directory = directory
+        self._load = load
+        self._weights = weights
+        self._lock = threading.Lock()  # Held while changing state
+        self._merging = threading.Lock()  # Held while merging in the background
+        self._version = None  # MANIFEST's inode and modification time, as of state
+
+        # Segments' names, the segments, with masks of their documents that later segments don't supersede, and
+        # the number and total length of those documents
+        self._state = ([], [], 0, 0.0)
+
+    def search(self, words, limit):
+        """Return the ids of up to limit documents containing every word (or a word that it prefixes), by bm25."""
+        names, segments, count, total = self._refresh()
+        words = list(dict.fromkeys(map(porter.stem, words)))
+        if not words or not count:
+            return []
+        average = total / count or 1.0
+
+        # Each word's weighted frequencies in each segment's documents, and its number of documents
+        frequencies, found = [], []
+        for word in words:
+            prefix = word.encode()
+            frequencies.append([])
+            found.append(0)
+            for segment, mask in segments:
+                start, stop = segment.prefixed(prefix)
+                frequency = np.bincount(segment.documents[start:stop], segment.weights[start:stop],
+                                        minlength=len(segment.ids))
+                frequency[~mask] = 0
+                frequencies[-1].append(frequency)
+                found[-1] += np.count_nonzero(frequency)
+
+        # Score documents containing every word, by bm25, as FTS5 would
+        ids, scores = [], []
+        for s, (segment, mask) in enumerate(segments):
+            matched = mask.copy()
+            for w in range(len(words)):
+                matched &= frequencies[w][s] > 0
+            documents = np.flatnonzero(matched)
+            norm = K1 * (1 - B + B * segment.lengths[documents] / average)
+            score = np.zeros(len(documents))
+            for w in range(len(words)):
+                frequency = frequencies[w][s][documents]
+                idf = np.log(1 + (count - found[w] + 0.5) / (found[w] + 0.5))
+                score += idf * frequency * (K1 + 1) / (frequency + norm)
+            ids.append(segment.ids[documents])
+            scores.append(score)
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        if len(ids) > limit:
+            best = np.argpartition(-scores, limit - 1)[:limit]
+            ids, scores = ids[best], scores[best]
+        return ids[np.lexsort((ids, -scores))].tolist()
+
+    def update(self, ids):
+        """Index rows ids as just written (or deleted, if not found), in a new segment."""
+        documents = dict(self._load(list(ids)))
+        if not self._append({id: documents.get(id) for id in ids}):
+            return
+        if len(self._refresh()[0]) > MAX_SEGMENTS and self._merging.acquire(blocking=False):
+            threading.Thread(target=self.merge, kwargs={"release": True}, daemon=True).start()
+
+    def rebuild(self):
+        """Index every row, in one segment replacing the others."""
+        with self._locked():
+            manifest = self._manifest() or {"segments": [], "next": 1}
+            name = self._create(manifest, self._documents(self._load(None)))
+            self._commit(manifest, [name], manifest["segments"])
+
+    def merge(self, release=False):
+        """Merge the index's segments into one, dropping superseded and deleted documents."""
+        try:
+            names, segments, _, _ = self._refresh()
+            if len(names) < 2:
+                return
+
+            # Merge the segments that the MANIFEST lists now, then replace them if they're still its first ones
+            terms, postings = {}, [[], [], []]
+            for segment, mask in segments:
+                kept = mask[segment.documents]
+                indexes = np.array([terms.setdefault(term, len(terms)) for term in segment.terms()], dtype=np.int64)
+                postings[0].append(indexes[segment.postings()[kept]])
+                postings[1].append(segment.ids[segment.documents[kept]])
+                postings[2].append(segment.weights[kept])
+            ids = np.concatenate([segment.ids[mask] for segment, mask in segments])
+            lengths = np.concatenate([segment.lengths[mask] for segment, mask in segments])
+            order = np.argsort(ids)
+            path = os.path.join(self.directory, f"merge-{os.getpid()}-{threading.get_ident()}.tmp")
+            _write(path, ids[order], lengths[order], list(terms), [np.concatenate(array) for array in postings])
+            with self._locked():
+                manifest = self._manifest()
+                if manifest is None or manifest["segments"][:len(names)] != names:
+                    os.remove(path)
+                    return
+                name = f"{manifest['next']:08d}.seg"
+                os.replace(path, os.path.join(self.directory, name))
+                manifest["next"] += 1
+                self._commit(manifest, [name] + manifest["segments"][len(names):], names)
+        finally:
+            if release:
+                self._merging.release()
+
+    def check(self):
+        """Return None if the index's documents are exactly its table's rows, else how they differ."""
+        _, segments, _, _ = self._refresh()
+        indexed = set()
+        for segment, mask in segments:
+            indexed.update(segment.ids[mask].tolist())
+        ids = {id for id, _ in self._load(None)}
+        missing, extra = ids - indexed, indexed - ids
+        if not missing and not extra:
+            return None
+        return f"{len(missing)} rows missing, {len(extra)} deleted rows still indexed"
+
+    def info(self):
+        """Return the number of segments and of documents, and the segments' total size in bytes."""
+        names, _, count, _ = self._refresh()
+        return {
+            "segments": len(names),
+            "documents": count,
+            "bytes": sum(os.path.getsize(os.path.join(self.directory, name)) for name in names
+                         if os.path.exists(os.path.join(self.directory, name))),
+        }
+
+    def _refresh(self):
+        """Return state, first reopening the segments if the MANIFEST changed (building the index if it's missing)."""
+        path = os.path.join(self.directory, "MANIFEST")
+        for attempt in range(3):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self._build()
+                continue
+            if (stat.st_ino, stat.st_mtime_ns) == self._version:
+                return self._state
+            with self._lock:
+                try:
+                    if self._open((stat.st_ino, stat.st_mtime_ns)):
+                        return self._state
+                except FileNotFoundError:  # Merged away meanwhile, so the MANIFEST changed again
+                    continue
+        raise RuntimeError(f"Could not open the index in {self.directory}")
+
+    def _open(self, version):
+        """
+        Open segments that the MANIFEST lists, reusing those already open if only others were appended, returning
+        whether opened, or, if the MANIFEST is of another version, rebuild the index instead and return False.
+        """
+        with open(os.path.join(self.directory, "MANIFEST")) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != VERSION:
+            self._upgrade()
+            return False
+        names = manifest["segments"]
+
+        # Copy masks before changing them, since searches may be reading them
+        old, segments, _, _ = self._state
+        if names[:len(old)] == old:
+            segments = [(segment, mask.copy()) for segment, mask in segments]
+        else:
+            old, segments = [], []
+
+        # Mask documents superseded by those of segments appended since
+        for name in names[len(old):]:
+            segment = Segment(os.path.join(self.directory, name))
+            for older, mask in segments:
+                i = np.minimum(np.searchsorted(older.ids, segment.ids), len(older.ids) - 1)
+                if len(older.ids):
+                    mask[i[older.ids[i] == segment.ids]] = False
+            segments.append((segment, segment.lengths >= 0))
+        count = sum(int(np.count_nonzero(mask)) for _, mask in segments)
+        total = sum(float(segment.lengths[mask].sum()) for segment, mask in segments)
+        self._state = (names, segments, count, total)
+        self._version = version
+        return True
+
+    def _build(self):
+        """Index every row, unless another process did meanwhile."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._locked():
+            if self._manifest() is None:
+                manifest = {"segments": [], "next": 1}
+                self._commit(manifest, [self._create(manifest, self._documents(self._load(None)))], [])
+
+    def _upgrade(self):
+        """Index every row, replacing the segments of another version, unless another process did meanwhile."""
+        with self._locked():
+            manifest = self._manifest()
+            if manifest is not None and manifest.get("version") != VERSION:
+                self._commit(manifest, [self._create(manifest, self._documents(self._load(None)))],
+                             manifest["segments"])
+
+    def _append(self, documents):
+        """Append a segment of documents (None for deleted ones), returning whether the index exists to append to."""
+        with self._locked():
+            manifest = self._manifest()
+            if manifest is None:
+                return False  # Built from the table on first use, changes and all
+            name = self._create(manifest, self._documents(documents.items()))
+            self._commit(manifest, manifest["segments"] + [name], [])
+            return True
+
+    def _documents(self, rows):
+        """Return ids, lengths, terms, and postings of rows of (id, values), or (id, None) for deleted ones."""
+        ids, lengths, terms, postings = [], [], {}, ([], [], [])
+        for id, values in sorted(rows, key=lambda row: row[0]):
+            ids.append(id)
+            if values is None:
+                lengths.append(-1.0)
+                continue
+            frequencies, length = {}, 0.0
+            for value, weight in zip(values, self._weights):
+                words = [porter.stem(word) for word in fulltext.terms(fulltext.TAG.sub(" ", value or ""))]
+                length += weight * len(words)
+                for word in words:
+                    frequencies[word] = frequencies.get(word, 0.0) + weight
+            lengths.append(length)
+            for word, frequency in frequencies.items():
+                postings[0].append(terms.setdefault(word, len(terms)))
+                postings[1].append(id)
+                postings[2].append(frequency)
+        return (np.array(ids, dtype=np.int64), np.array(lengths, dtype=np.float32), list(terms),
+                [np.array(postings[0], dtype=np.int64), np.array(postings[1], dtype=np.int64),
+                 np.array(postings[2], dtype=np.float32)])
+
+    def _create(self, manifest, documents):
+        """Write documents, as from _documents, to the MANIFEST's next segment, returning its name."""
+        name = f"{manifest['next']:08d}.seg"
+        manifest["next"] += 1
+        _write(os.path.join(self.directory, name), *documents)
+        return name
+
+    def _manifest(self):
+        """Return the MANIFEST, or None if the index hasn't been built."""
+        try:
+            with open(os.path.join(self.directory, "MANIFEST")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _commit(self, manifest, names, replaced):
+        """Replace the MANIFEST with one listing names, of this version, then delete replaced segments."""
+        manifest["segments"] = names
+        manifest["version"] = VERSION
+        path = os.path.join(self.directory, f"MANIFEST.{os.getpid()}.tmp")
+        with open(path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(path, os.path.join(self.directory, "MANIFEST"))
+        for name in replaced:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:  # e.g., still mapped, on Windows
+                pass
+
+    def _locked(self):
+        """Return a lock, shared by every process, to hold while writing segments and the MANIFEST."""
+
+        # Lazily import
+        from filelock import FileLock
+
+        os.makedirs(self.directory, exist_ok=True)
+        return FileLock(os.path.join(self.directory, "LOCK"))
+
+
+class Engine(object):
+    """Indexes of the dictionary's entries and of the notes, searched as fulltext's searches are."""
+
+    def __init__(self, directory, dictionary="sqlite:///dictionary.db", notes="sqlite:///notes.db"):
+        self.indexes = {
+            "entries": Index(os.path.join(directory, "entries"), _loader(dictionary, "entries", [
+                "word_phrase", "definition", "example"]), fulltext.ENTRIES_WEIGHTS),
+            "notes": Index(os.path.join(directory, "notes"), _loader(notes, "notes", [
+                "title", "content", "tags"]), fulltext.NOTES_WEIGHTS),
+        }
+
+    def search_entries(self, db, text, limit=50, schema="main"):
+        """Search entries, as fulltext.search_entries does (except for fragments mid-word)."""
+        ids = self.indexes["entries"].search(fulltext.normalize(text), limit)
+        return fulltext.entries_by_id(db, ids, text, schema)
+
+    def search_notes(self, db, text, limit=10):
+        """Search notes, as fulltext.search_notes does (except for fragments mid-word)."""
+        ids = self.indexes["notes"].search(fulltext.normalize(text), limit)
+        return fulltext.notes_by_id(db, ids, text)
+
+    def changed(self, table, id):
+        """Index table's row id as just written (or deleted)."""
+        self.indexes[table].update([id])
+
+
+def enable(directory, **urls):
+    """Search through an Engine whose indexes are in directory (built on first use), in place of the FTS5 indexes."""
+    fulltext.engine = Engine(directory, **urls)
+    return fulltext.engine
+
+
+def _loader(url, table, columns):
+    """Return a function loading the columns of table's rows by id, as Index expects."""
+
+    def load(ids):
+        db = SQL(url)
+        if ids is None:
+            rows = db.iterate(f"SELECT id, {', '.join(columns)} FROM {table}")
+        else:
+            rows = db.get_many(table, ids, columns).values()
+        return [(row["id"], tuple(row[column] for column in columns)) for row in rows]
+    return load
+
+
+def _write(path, ids, lengths, terms, postings):
+    """
+    Write a segment of documents ids (sorted) with lengths (-1 if deleted) and of postings, arrays of each posting's
+    term (as an index into terms), document (as an id), and weight, in any order.
+    """
+
+    # Drop terms without postings, then sort terms and postings by term, then document
+    indexes, documents, weights = postings
+    used = np.unique(indexes)
+    terms = [terms[i] for i in used]
+    order = sorted(range(len(terms)), key=terms.__getitem__)
+    rank = np.empty(len(terms), dtype=np.int64)
+    rank[order] = np.arange(len(terms))
+    indexes = rank[np.searchsorted(used, indexes)]
+    documents = np.searchsorted(ids, documents)
+    sort = np.lexsort((documents, indexes))
+    indexes, documents, weights = indexes[sort], documents[sort], weights[sort]
+
+    encoded = [terms[i].encode() for i in order]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    np.cumsum([len(term) for term in encoded], out=offsets[1:])
+    text = b"".join(encoded)
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(ids), len(encoded), len(documents), len(text)))
+        for array, dtype in [(ids, np.int64), (lengths, np.float32), (offsets, np.uint32),
+                             (np.searchsorted(indexes, np.arange(len(encoded) + 1)), np.uint32),
+                             (documents, np.uint32), (weights, np.float32)]:
+            f.write(np.asarray(array, dtype=dtype).tobytes())
+        f.write(text)
+    os.replace(path + ".tmp", path)
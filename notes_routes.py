@@ -1,6 +1,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, abort, send_from_directory, jsonify, current_app
-from sql import SQL
-import sqlite3
+from sql import SQL, AsyncSQL
+import fulltext
+import spelling
+import typeahead
+import asyncio
 from datetime import datetime
 import re
 import os
@@ -13,6 +16,9 @@ import json
 UPLOAD_FOLDER = os.path.join('uploads', 'worksheets')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx', 'txt'}
 
+# Notes database, for async routes
+notes_db = AsyncSQL("sqlite:///notes.db")
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -22,7 +28,7 @@ def save_worksheet_images(note_id, files):
     if 'worksheet_images' not in files:
         return []
     
-    saved_files = []
+    uploaded_files = []
     for file in files.getlist('worksheet_images'):
         if file and allowed_file(file.filename):
             # Generate a unique filename to prevent collisions
@@ -35,24 +41,22 @@ def save_worksheet_images(note_id, files):
             # Save the file
             filepath = os.path.join(UPLOAD_FOLDER, filename)
             file.save(filepath)
-            
-            # Save file info to database using raw SQLite connection
-            conn = sqlite3.connect('notes.db')
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO worksheet_images (note_id, filename, original_filename)
-                VALUES (?, ?, ?)
-            """, (note_id, filename, file.filename))
-            
-            # Get the ID of the last inserted row
-            worksheet_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            
+            uploaded_files.append((note_id, filename, file.filename))
+    
+    # Save all files' info to database in one transaction
+    saved_files = []
+    if uploaded_files:
+        db = SQL("sqlite:///notes.db")
+        worksheet_ids = db.executemany("""
+            INSERT INTO worksheet_images (note_id, filename, original_filename)
+            VALUES (?, ?, ?)
+        """, uploaded_files)
+        
+        for worksheet_id, (_, filename, original_filename) in zip(worksheet_ids, uploaded_files):
             saved_files.append({
                 'id': worksheet_id,
                 'filename': filename,
-                'original_filename': file.filename
+                'original_filename': original_filename
             })
     
     # Update the has_worksheet flag on the note
@@ -85,6 +89,8 @@ def index():
     """Display all notes"""
     
     db = SQL("sqlite:///notes.db")
+
+    # Not cached, since views of notes write their views, invalidating results that read notes
     notes = db.execute("""
         SELECT id, title, unit_number, 
                strftime('%Y-%m-%d', created_at) as created_date,
@@ -95,7 +101,7 @@ def index():
             CASE WHEN unit_number = '' OR unit_number IS NULL THEN 1 ELSE 0 END,
             CAST(unit_number AS INTEGER) DESC,
             last_updated DESC
-    """)
+    """, rows="record")
     
     # Group notes by unit number for better organization
     notes_by_unit = {}
@@ -137,27 +143,23 @@ def add_note():
         try:
             unit_number = int(unit_number) if unit_number else None
             
-            # Use a raw SQLite connection to get the lastrowid
-            conn = sqlite3.connect('notes.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("""
+            # Insert through SQL, so the write is queued with the others, returning the new row's ID
+            db = SQL("sqlite:///notes.db")
+            note_id = db.execute("""
                 INSERT INTO notes (title, content, unit_number, tags, 
                                  related_entries, comments, is_favorite)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             """, 
-            (title,
-             content,
-             unit_number,
-             tags if tags else None,
-             related_entries if related_entries else None,
-             comments if comments else None,
-             is_favorite))
-            
-            # Get the last inserted row ID
-            note_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            title,
+            content,
+            unit_number,
+            tags if tags else None,
+            related_entries if related_entries else None,
+            comments if comments else None,
+            is_favorite)
+            typeahead.index.add("notes", note_id, title)
+            spelling.index.add("notes", note_id, title)
+            fulltext.changed("notes", note_id)
             if 'worksheet_images' in request.files:
                 saved_files = save_worksheet_images(note_id, request.files)
                 if saved_files:
@@ -241,6 +243,9 @@ def edit_note(note_id):
             related_entries=related_entries if related_entries else None,
             comments=comments if comments else None,
             is_favorite=is_favorite)
+            typeahead.index.add("notes", note_id, title)
+            spelling.index.add("notes", note_id, title)
+            fulltext.changed("notes", note_id)
             
             # Handle worksheet images if any
             if 'worksheet_images' in request.files:
@@ -314,6 +319,9 @@ def delete_note(note_id):
         
         # Delete the note from the database
         db.execute("DELETE FROM notes WHERE id = :note_id", note_id=note_id)
+        typeahead.index.remove("notes", note_id)
+        spelling.index.remove("notes", note_id)
+        fulltext.changed("notes", note_id)
         
         flash('Note deleted successfully', 'success')
         return redirect(url_for('notes.index'))
@@ -357,62 +365,60 @@ def duplicate_note(note_id):
             'is_favorite': 0  # Reset favorite status
         }
         
-        # Insert the new note
-        conn = sqlite3.connect('notes.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO notes (title, content, unit_number, tags, related_entries, comments, is_favorite)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
+        # Insert the new note and its worksheets in one transaction
+        with db.transaction():
+            new_note_id = db.execute("""
+                INSERT INTO notes (title, content, unit_number, tags, related_entries, comments, is_favorite)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
             new_note['title'],
             new_note['content'],
             new_note['unit_number'],
             new_note['tags'],
             new_note['related_entries'],
             new_note['comments'],
-            new_note['is_favorite']
-        ))
-        
-        new_note_id = cursor.lastrowid
-        
-        # Handle worksheet images if requested
-        if include_worksheets and note.get('has_worksheet'):
-            # Get original worksheets
-            worksheets = db.execute("""
-                SELECT filename, original_filename 
-                FROM worksheet_images 
-                WHERE note_id = :note_id
-            """, note_id=note_id)
+            new_note['is_favorite'])
             
-            # Copy worksheet files and create new records
-            for worksheet in worksheets:
-                original_path = os.path.join(UPLOAD_FOLDER, worksheet['filename'])
-                if os.path.exists(original_path):
-                    # Generate new filename to avoid conflicts
-                    file_ext = os.path.splitext(worksheet['filename'])[1]
-                    new_filename = f"{uuid.uuid4()}{file_ext}"
-                    new_path = os.path.join(UPLOAD_FOLDER, new_filename)
-                    
-                    # Copy the file
-                    import shutil
-                    shutil.copy2(original_path, new_path)
-                    
-                    # Create new worksheet record
-                    cursor.execute("""
+            # Handle worksheet images if requested
+            if include_worksheets and note.get('has_worksheet'):
+                # Get original worksheets
+                worksheets = db.execute("""
+                    SELECT filename, original_filename 
+                    FROM worksheet_images 
+                    WHERE note_id = :note_id
+                """, note_id=note_id)
+                
+                # Copy worksheet files
+                copied_worksheets = []
+                for worksheet in worksheets:
+                    original_path = os.path.join(UPLOAD_FOLDER, worksheet['filename'])
+                    if os.path.exists(original_path):
+                        # Generate new filename to avoid conflicts
+                        file_ext = os.path.splitext(worksheet['filename'])[1]
+                        new_filename = f"{uuid.uuid4()}{file_ext}"
+                        new_path = os.path.join(UPLOAD_FOLDER, new_filename)
+                        
+                        # Copy the file
+                        import shutil
+                        shutil.copy2(original_path, new_path)
+                        copied_worksheets.append((new_note_id, new_filename, worksheet['original_filename']))
+                
+                # Create new worksheet records
+                if copied_worksheets:
+                    db.executemany("""
                         INSERT INTO worksheet_images (note_id, filename, original_filename)
                         VALUES (?, ?, ?)
-                    """, (new_note_id, new_filename, worksheet['original_filename']))
-            
-            # Update has_worksheet flag
-            cursor.execute("""
-                UPDATE notes 
-                SET has_worksheet = 1 
-                WHERE id = ?
-            """, (new_note_id,))
-        
-        conn.commit()
-        conn.close()
+                    """, copied_worksheets)
+                
+                # Update has_worksheet flag
+                db.execute("""
+                    UPDATE notes 
+                    SET has_worksheet = 1 
+                    WHERE id = ?
+                """, new_note_id)
+        typeahead.index.add("notes", new_note_id, new_note['title'])
+        spelling.index.add("notes", new_note_id, new_note['title'])
+        fulltext.changed("notes", new_note_id)
         
         return jsonify({
             "success": True,
@@ -422,9 +428,6 @@ def duplicate_note(note_id):
         
     except Exception as e:
         current_app.logger.error(f"Error duplicating note: {str(e)}")
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
         return jsonify({"error": f"Failed to duplicate note: {str(e)}"}), 500
 
 @notes_bp.route('/delete_worksheet/<int:worksheet_id>', methods=['POST'])
@@ -454,23 +457,25 @@ def delete_worksheet(worksheet_id):
         if os.path.exists(filepath):
             os.remove(filepath)
         
-        # Delete the database record
-        db.execute("DELETE FROM worksheet_images WHERE id = :id", id=worksheet_id)
-        
-        # Check if there are any remaining worksheets for this note
-        remaining = db.execute("""
-            SELECT COUNT(*) as count 
-            FROM worksheet_images 
-            WHERE note_id = :note_id
-        """, note_id=worksheet['note_id'])
-        
-        # Update the has_worksheet flag if no more worksheets
-        if remaining and remaining[0]['count'] == 0:
-            db.execute("""
-                UPDATE notes 
-                SET has_worksheet = 0 
-                WHERE id = :note_id
+        # Delete the record and update the note's flag in one transaction
+        with db.transaction():
+            # Delete the database record
+            db.execute("DELETE FROM worksheet_images WHERE id = :id", id=worksheet_id)
+            
+            # Check if there are any remaining worksheets for this note
+            remaining = db.execute("""
+                SELECT COUNT(*) as count 
+                FROM worksheet_images 
+                WHERE note_id = :note_id
             """, note_id=worksheet['note_id'])
+            
+            # Update the has_worksheet flag if no more worksheets
+            if remaining and remaining[0]['count'] == 0:
+                db.execute("""
+                    UPDATE notes 
+                    SET has_worksheet = 0 
+                    WHERE id = :note_id
+                """, note_id=worksheet['note_id'])
         
         flash('Worksheet deleted successfully', 'success')
         return redirect(url_for('notes.edit_note', note_id=worksheet['note_id']))
@@ -559,13 +564,8 @@ def view_note(note_id):
     if note.get('related_entries'):
         entry_ids = [int(id_str.strip()) for id_str in note['related_entries'].split(',') if id_str.strip().isdigit()]
         if entry_ids:
-            # Connect to the dictionary database
-            dict_db = SQL("sqlite:///dictionary.db")
-            related_entries = dict_db.execute("""
-                SELECT id, word_phrase 
-                FROM entries 
-                WHERE id IN ({})
-            """.format(','.join(['?'] * len(entry_ids))), *entry_ids)
+            # Read the dictionary, which is attached to the notes database, over the same connection
+            related_entries = list(db.get_many("dictionary.entries", entry_ids, ["word_phrase"]).values())
     
     # Get worksheet images for this note
     worksheet_images = []
@@ -579,12 +579,11 @@ def view_note(note_id):
                          worksheet_images=worksheet_images)
 
 @notes_bp.route('/<int:note_id>/enhance', methods=['POST'])
-def enhance_note(note_id):
+async def enhance_note(note_id):
     """Enhance a note using AI"""
     try:
         # Get the note from the database
-        db = SQL("sqlite:///notes.db")
-        note = db.execute("SELECT * FROM notes WHERE id = :id", id=note_id)
+        note = await notes_db.execute("SELECT * FROM notes WHERE id = :id", id=note_id)
         
         if not note:
             return jsonify({'success': False, 'message': 'Note not found'}), 404
@@ -599,15 +598,15 @@ def enhance_note(note_id):
             import os
             # Add the current directory to the path to ensure imports work
             sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-            from enhance_note import enhance_note_content, update_note
+            from enhance_note import enhance_note_content
             
             # Get the note content
             note_content = note[0]['content']
             note_title = note[0]['title']
             
-            # Enhance the note content
+            # Enhance the note content, off the event loop
             try:
-                enhanced_content = enhance_note_content(note_title, note_content, comment)
+                enhanced_content = await asyncio.to_thread(enhance_note_content, note_title, note_content, comment)
                 print(f"Debug: enhanced_content type: {type(enhanced_content)}, length: {len(enhanced_content) if enhanced_content else 'None'}")
                 
                 if not enhanced_content:
@@ -617,13 +616,15 @@ def enhance_note(note_id):
                 raise ValueError(f"Failed to enhance note content: {str(enhance_error)}")
                 
             # Update the note in the database
-            update_success = update_note(note_id, enhanced_content)
+            update_success = await notes_db.execute("UPDATE notes SET content = ? WHERE id = ?",
+                                                    enhanced_content, note_id)
             
             if not update_success:
                 raise ValueError("Failed to update note in database")
+            await asyncio.to_thread(fulltext.changed, "notes", note_id)
                 
             # Get the updated note to return
-            updated_note = db.execute("SELECT * FROM notes WHERE id = :id", id=note_id)
+            updated_note = await notes_db.execute("SELECT * FROM notes WHERE id = :id", id=note_id)
             
             if not updated_note:
                 raise ValueError("Failed to retrieve updated note")
@@ -0,0 +1,116 @@
+"""
+The Porter stemming algorithm (https://tartarus.org/martin/PorterStemmer/), as SQLite's FTS5 porter tokenizer
+implements it, so that indexes built here (see inverted.py) match words as FTS5's do (e.g., "laws" as "law").
+
+Words are expected lowercased. Like FTS5's, words shorter than 3 characters or longer than 64 bytes aren't stemmed.
+"""
+import functools
+
+# Suffixes replaced by steps 2 and 3, in the order tried (longer first, where one ends another), each only if the
+# rest of the word has a positive measure; only the first suffix that a word ends with is tried
+_STEP2 = [
+    ("ational", "ate"), ("tional", "tion"), ("enci", "ence"), ("anci", "ance"), ("izer", "ize"), ("bli", "ble"),
+    ("alli", "al"), ("entli", "ent"), ("eli", "e"), ("ousli", "ous"), ("ization", "ize"), ("ation", "ate"),
+    ("ator", "ate"), ("alism", "al"), ("iveness", "ive"), ("fulness", "ful"), ("ousness", "ous"), ("aliti", "al"),
+    ("iviti", "ive"), ("biliti", "ble"), ("logi", "log"),
+]
+_STEP3 = [("icate", "ic"), ("ative", ""), ("alize", "al"), ("iciti", "ic"), ("ical", "ic"), ("ful", ""), ("ness", "")]
+
+# Suffixes removed by step 4, each only if the rest of the word has a measure greater than 1 (and, for "ion", ends
+# with "s" or "t"); again, only the first suffix that a word ends with is tried
+_STEP4 = ["al", "ance", "ence", "er", "ic", "able", "ible", "ant", "ement", "ment", "ent", "ion", "ou", "ism", "ate",
+          "iti", "ous", "ive", "ize"]
+
+
+@functools.lru_cache(maxsize=65536)
+def stem(word):
+    """Return word's stem"""
+    if len(word) < 3 or len(word.encode()) > 64:
+        return word
+
+    # Step 1a: plurals
+    if word.endswith(("sses", "ies")):
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+
+    # Step 1b: past participles and gerunds
+    if word.endswith("eed"):
+        if _measure(word[:-3]) > 0:
+            word = word[:-1]
+    else:
+        for suffix in ["ed", "ing"]:
+            if word.endswith(suffix) and _has_vowel(word[:-len(suffix)]):
+                word = word[:-len(suffix)]
+                if word.endswith(("at", "bl", "iz")):
+                    word += "e"
+                elif _is_double(word) and word[-1] not in "lsz":
+                    word = word[:-1]
+                elif _measure(word) == 1 and _is_cvc(word):
+                    word += "e"
+                break
+
+    # Step 1c: y after a vowel
+    if word.endswith("y") and _has_vowel(word[:-1]):
+        word = word[:-1] + "i"
+
+    # Steps 2 and 3: double and single suffixes
+    for suffixes in [_STEP2, _STEP3]:
+        for suffix, replacement in suffixes:
+            if word.endswith(suffix):
+                if _measure(word[:-len(suffix)]) > 0:
+                    word = word[:-len(suffix)] + replacement
+                break
+
+    # Step 4: other suffixes
+    for suffix in _STEP4:
+        if word.endswith(suffix):
+            rest = word[:-len(suffix)]
+            if _measure(rest) > 1 and (suffix != "ion" or rest.endswith(("s", "t"))):
+                word = rest
+            break
+
+    # Step 5: final e, and double l
+    if word.endswith("e"):
+        measure = _measure(word[:-1])
+        if measure > 1 or measure == 1 and not _is_cvc(word[:-1]):
+            word = word[:-1]
+    if word.endswith("ll") and _measure(word[:-1]) > 1:
+        word = word[:-1]
+    return word
+
+
+def _is_consonant(word, i):
+    """Return whether word[i] is a consonant: not a vowel, nor a y after a consonant"""
+    if word[i] in "aeiou":
+        return False
+    if word[i] == "y":
+        return i == 0 or not _is_consonant(word, i - 1)
+    return True
+
+
+def _measure(word):
+    """Return word's measure, m in [C](VC)^m[V], where C and V are runs of consonants and of vowels"""
+    measure, vowel = 0, False
+    for i in range(len(word)):
+        consonant = _is_consonant(word, i)
+        if consonant and vowel:
+            measure += 1
+        vowel = not consonant
+    return measure
+
+
+def _has_vowel(word):
+    """Return whether word contains a vowel"""
+    return any(not _is_consonant(word, i) for i in range(len(word)))
+
+
+def _is_double(word):
+    """Return whether word ends with a double consonant"""
+    return len(word) >= 2 and word[-1] == word[-2] and _is_consonant(word, len(word) - 1)
+
+
+def _is_cvc(word):
+    """Return whether word ends with a consonant, a vowel, and a consonant other than w, x, or y"""
+    return (len(word) >= 3 and _is_consonant(word, len(word) - 3) and not _is_consonant(word, len(word) - 2)
+            and _is_consonant(word, len(word) - 1) and word[-1] not in "wxy")
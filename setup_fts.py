@@ -1,5 +1,63 @@
+import logging
 import sqlite3
 
+# Messages go through logging rather than stdout, since app.py runs this setup as it's imported
+logger = logging.getLogger(__name__)
+
+def create_sync_triggers(cursor, table, columns, fts=None):
+    """Create triggers that keep an external-content FTS index of table (table_fts by default) in sync with its rows"""
+    fts = fts or f"{table}_fts"
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    columns = ", ".join(columns)
+    
+    # Index new rows
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts} (rowid, {columns}) VALUES (new.id, {new});
+        END
+    """)
+    
+    # Remove deleted rows, which an external-content index needs the old values of
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {columns}) VALUES ('delete', old.id, {old});
+        END
+    """)
+    
+    # Reindex rows only when an indexed column changes (not, e.g., views or last_updated)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {columns} ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {columns}) VALUES ('delete', old.id, {old});
+            INSERT INTO {fts} (rowid, {columns}) VALUES (new.id, {new});
+        END
+    """)
+
+def setup_trigram_index(cursor, table, columns):
+    """Set up a trigram index of table's columns, table_trigram, for substring searches, if SQLite supports one"""
+    trigram = f"{table}_trigram"
+    
+    # Create trigram virtual table if it doesn't exist (the trigram tokenizer needs SQLite 3.34 or later)
+    try:
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {trigram}
+            USING fts5(
+                {", ".join(columns)},
+                content='{table}',
+                content_rowid='id',
+                tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        logger.warning("Skipping %s: %s", trigram, e)
+        return
+    
+    # Populate the index if empty, and keep it up to date
+    cursor.execute(f"SELECT COUNT(*) FROM {trigram}_docsize")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"INSERT INTO {trigram} ({trigram}) VALUES ('rebuild')")
+    create_sync_triggers(cursor, table, columns, trigram)
+
 def setup_dictionary_fts():
     """Set up FTS for the dictionary database"""
     conn = sqlite3.connect('dictionary.db')
@@ -18,14 +76,18 @@ def setup_dictionary_fts():
         )
     """)
     
-    # Check if the FTS table is empty
-    cursor.execute("SELECT COUNT(*) FROM entries_fts")
+    # Check if the FTS index is empty (COUNT(*) on the FTS table itself would count entries, its content table)
+    cursor.execute("SELECT COUNT(*) FROM entries_fts_docsize")
     if cursor.fetchone()[0] == 0:
-        # Populate the FTS table with existing data
-        cursor.execute("""
-            INSERT INTO entries_fts (rowid, word_phrase, definition, example)
-            SELECT id, word_phrase, definition, example FROM entries
-        """)
+        # Populate the FTS index from the content table's existing data
+        logger.info("Populating entries_fts from entries")
+        cursor.execute("INSERT INTO entries_fts (entries_fts) VALUES ('rebuild')")
+    
+    # Keep the FTS index up to date as entries change
+    create_sync_triggers(cursor, 'entries', ["word_phrase", "definition", "example"])
+    
+    # Index the same columns by trigram, for fragments in the middle of words
+    setup_trigram_index(cursor, 'entries', ["word_phrase", "definition", "example"])
     
     conn.commit()
     conn.close()
@@ -48,23 +110,29 @@ def setup_notes_fts():
         )
     """)
     
-    # Check if the FTS table is empty
-    cursor.execute("SELECT COUNT(*) FROM notes_fts")
+    # Check if the FTS index is empty (COUNT(*) on the FTS table itself would count notes, its content table)
+    cursor.execute("SELECT COUNT(*) FROM notes_fts_docsize")
     if cursor.fetchone()[0] == 0:
-        # Populate the FTS table with existing data
-        cursor.execute("""
-            INSERT INTO notes_fts (rowid, title, content, tags)
-            SELECT id, title, content, tags FROM notes
-        """)
+        # Populate the FTS index from the content table's existing data
+        logger.info("Populating notes_fts from notes")
+        cursor.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+    
+    # Keep the FTS index up to date as notes change
+    create_sync_triggers(cursor, 'notes', ["title", "content", "tags"])
+    
+    # Index the same columns by trigram, for fragments in the middle of words (e.g., statute numbers)
+    setup_trigram_index(cursor, 'notes', ["title", "content", "tags"])
     
     conn.commit()
     conn.close()
 
 if __name__ == '__main__':
-    print("Setting up full-text search for dictionary...")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    
+    logger.info("Setting up full-text search for dictionary...")
     setup_dictionary_fts()
     
-    print("Setting up full-text search for notes...")
+    logger.info("Setting up full-text search for notes...")
     setup_notes_fts()
     
-    print("Full-text search setup complete!")
+    logger.info("Full-text search setup complete!")
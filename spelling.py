@@ -0,0 +1,145 @@
+"""
+Typo-tolerant lookup of the words of dictionary entries' phrases and notes' titles, to suggest corrections (e.g.,
+"habeas corpus" for "habeus corpus") when searches find nothing.
+
+Words are indexed as in SymSpell: by every string obtained by deleting up to MAX_DISTANCE characters from each word's
+first PREFIX_LENGTH characters. A misspelling then shares such a deletion with every word within that edit distance of
+it, so candidates are found by looking up the misspelling's own deletions (a few dozen dict lookups), and only they
+are compared with it, which takes well under a millisecond however large the vocabulary.
+
+Like typeahead's index, the vocabulary is loaded on first use, kept up to date by the routes that add, edit, and delete
+entries and notes, through add and remove, and reloaded in the background once older than max_age seconds.
+"""
+import itertools
+import re
+
+import typeahead
+
+# Edit distance (insertions, deletions, substitutions, and transpositions) up to which words are corrected
+MAX_DISTANCE = 2
+
+# Number of words' first characters whose deletions are indexed, as longer words differ by more than their start
+PREFIX_LENGTH = 7
+
+
+class Speller(typeahead.LabelIndex):
+    """In-memory index of labels' words, by their deletions."""
+
+    def suggest(self, word, limit=5):
+        """
+        Return up to limit known words within edit distance of word (casefolded), closest first, then those in the
+        most labels, as dicts with word, distance, and count (the number of labels containing it)
+        """
+        self._refresh()
+        word = word.casefold()
+        counts, deletes, _ = self._state
+        bound = _bound(word)
+        found = {}
+        for key in _deletes(word[:PREFIX_LENGTH], bound):
+            for candidate in deletes.get(key, ()):
+                if candidate in found or abs(len(candidate) - len(word)) > bound:
+                    continue
+                distance = _distance(word, candidate, bound)
+                if distance <= bound and candidate in counts:
+                    found[candidate] = distance
+        ranked = sorted(found.items(), key=lambda item: (item[1], -counts.get(item[0], 0), item[0]))
+        return [{"word": candidate, "distance": distance, "count": counts.get(candidate, 0)}
+                for candidate, distance in ranked[:limit]]
+
+    def correct(self, text):
+        """
+        Return text, casefolded, with each unknown word replaced by its best suggestion, or None if every word is known
+        or has no suggestion
+        """
+        self._refresh()
+        counts = self._state[0]
+        words = re.findall(r"\w+", text.casefold())
+        corrected = []
+        for word in words:
+            suggestions = [] if word in counts else self.suggest(word, limit=1)
+            corrected.append(suggestions[0]["word"] if suggestions else word)
+        return " ".join(corrected) if corrected != words else None
+
+    def info(self):
+        """Return the number of words and of deletions indexed, and the index's age in seconds (None if not loaded)."""
+        counts, deletes, _ = self._state
+        return {"words": len(counts), "deletes": len(deletes), "age": self._age()}
+
+    def _build(self, rows):
+        """Return the number of labels containing each word, the words with each deletion, and labels."""
+        counts, deletes, labels = {}, {}, {}
+        for kind, id, label in rows:
+            labels[kind, id] = label
+            for word in _words(label):
+                counts[word] = counts.get(word, 0) + 1
+        for word in counts:
+            for key in _deletes(word[:PREFIX_LENGTH], MAX_DISTANCE):
+                deletes.setdefault(key, []).append(word)
+        return counts, deletes, labels
+
+    def _add(self, kind, id, label):
+        self._remove(kind, id)
+        counts, deletes, labels = self._state
+        labels[kind, id] = label
+        for word in _words(label):
+            if word not in counts:
+                counts[word] = 0
+                for key in _deletes(word[:PREFIX_LENGTH], MAX_DISTANCE):
+                    deletes.setdefault(key, []).append(word)
+            counts[word] += 1
+
+    def _remove(self, kind, id):
+        counts, deletes, labels = self._state
+        label = labels.pop((kind, id), None)
+        if label is None:
+            return
+        for word in _words(label):
+            counts[word] -= 1
+            if counts[word] == 0:
+                del counts[word]
+                for key in _deletes(word[:PREFIX_LENGTH], MAX_DISTANCE):
+                    words = deletes[key]
+                    words.remove(word)
+                    if not words:
+                        del deletes[key]
+
+
+def _words(label):
+    """Return label's distinct words, casefolded, as indexed (ignoring numbers, which aren't misspelled)"""
+    return {word for word in re.findall(r"\w+", label.casefold()) if not word.isdigit()}
+
+
+def _bound(word):
+    """Return the edit distance up to which to correct word: none for the shortest, where any edit is a new word"""
+    return min(MAX_DISTANCE, len(word) // 3)
+
+
+def _deletes(word, distance):
+    """Return the strings obtained by deleting up to distance characters from word, including word itself"""
+    found = {word}
+    for n in range(1, min(distance, len(word)) + 1):
+        found.update("".join(kept) for kept in itertools.combinations(word, len(word) - n))
+    return found
+
+
+def _distance(a, b, bound):
+    """
+    Return the edit distance between a and b, counting a transposition of adjacent characters as one edit, or more
+    than bound as soon as it must be
+    """
+    if a == b:
+        return 0
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > bound:
+            return bound + 1
+    return current[-1]
+
+
+# Index shared by the app's routes, of the same labels as typeahead's, reloaded every 5 minutes
+index = Speller(typeahead.load_labels, max_age=300)
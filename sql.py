@@ -1,3 +1,10 @@
+import bisect
+import collections
+import collections.abc
+import contextlib
+import functools
+import itertools
+import queue
 import sys
 import threading
 import re
@@ -5,6 +12,46 @@ import re
 # Thread-local data
 _data = threading.local()
 
+# Maximum number of parsed statements to remember
+_STATEMENT_CACHE_SIZE = 512
+
+# Number of rows fetched at a time by SQL.iterate
+_ITERATE_BATCH_SIZE = 500
+
+# Upper bounds, in seconds, of histogram buckets for statements' timings, each 2^(1/4) times the last, from 10us
+_HISTOGRAM_BOUNDS = [1e-5 * 2 ** (i / 4) for i in range(96)]
+
+# Commands whose plans are logged with slow statements
+_EXPLAIN_COMMANDS = ["DELETE", "INSERT", "SELECT", "UPDATE"]
+
+# Tables written by statements in a trigger's body (i.e., after its BEGIN)
+_WRITTEN_TABLE = re.compile(
+    r"(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+[\"`\[]?(\w+)", re.IGNORECASE
+)
+
+# Seconds to wait before first retry of a statement for which the database was busy, doubled (up to a maximum) for
+# each retry thereafter, and then jittered
+_BUSY_BACKOFF = 0.01
+_BUSY_BACKOFF_MAX = 1.0
+
+# Seconds to wait for room in a full write queue before giving up
+_WRITE_QUEUE_TIMEOUT = 30
+
+# SQLite settings reported by SQL.settings
+_SETTINGS = [
+    "journal_mode",
+    "synchronous",
+    "cache_size",
+    "mmap_size",
+    "temp_store",
+    "busy_timeout",
+    "foreign_keys",
+]
+
+# Instances of SQL (and thus engines and their pools), keyed by URL, along with their arguments
+_instances = {}
+_instances_lock = threading.Lock()
+
 
 def _enable_logging(f):
     """Enable logging of SQL statements when Flask is in use."""
@@ -33,40 +80,143 @@ def _enable_logging(f):
     return decorator
 
 
+class ConfigurationError(RuntimeError):
+    """Raised when an instance of SQL is created again for a URL but configured differently."""
+
+
 class SQL(object):
     """Wrap SQLAlchemy to provide a simple SQL API."""
 
-    def __init__(self, url, **kwargs):
+    def __new__(cls, url, *args, **kwargs):
+        """
+        Return the instance already created for URL, if any, else create and remember one.
+
+        Arguments are only needed the first time; later constructions with no arguments besides URL share the
+        instance (and its engine's pool) however it was configured, while conflicting arguments raise
+        ConfigurationError (a RuntimeError).
+        """
+        with _instances_lock:
+            if url in _instances:
+                self, options = _instances[url]
+                if (args or kwargs) and (args, kwargs) != options:
+                    raise ConfigurationError("already configured differently: {}".format(url))
+                return self
+            self = super().__new__(cls)
+            self.__init__(url, *args, **kwargs)
+            _instances[url] = (self, (args, kwargs))
+            return self
+
+    def __init__(
+        self,
+        url,
+        bind_parameters=False,
+        pooling="statement",
+        max_idle=None,
+        pragmas=None,
+        slow_query_threshold=None,
+        readers=None,
+        max_queued_writes=100,
+        cache_size=0,
+        cache_ttl=None,
+        attach=None,
+        busy_timeout=None,
+        busy_retries=0,
+        **kwargs
+    ):
         """
-        Create instance of sqlalchemy.engine.Engine.
+        Create instance of sqlalchemy.engine.Engine, unless already created for this instance.
 
         URL should be a string that indicates database dialect and connection arguments.
 
+        If bind_parameters is True, values are passed to the driver as bound parameters rather than escaped into
+        the statement as literals, so that the driver can prepare each distinct statement once and reuse it.
+
+        Pooling determines how long each thread keeps its connection before returning it to the engine's pool:
+        "statement" returns it after each statement outside of a transaction, "request" keeps it until the Flask app
+        context is torn down (see init_app), and "thread" keeps it for the life of the thread. With "thread", a
+        connection idle for more than max_idle seconds is closed rather than reused. The pool itself is bounded by
+        create_engine's pool_size and max_overflow, and pool_pre_ping=True checks connections' health as they are
+        checked out.
+
+        For SQLite, pragmas is a dict of settings (e.g., {"journal_mode": "WAL", "synchronous": "NORMAL"}) applied, in
+        order, to each new connection, after foreign_keys=ON.
+
+        Each statement's timing, call count, and rows are recorded under its fingerprint (see statistics). Statements
+        that take longer than slow_query_threshold seconds are also logged as warnings (to the "cs50.slow" logger,
+        which is enabled even when "cs50" isn't), along with their EXPLAIN QUERY PLAN for SQLite.
+
+        For SQLite, if readers is a number, SELECTs outside of transactions use a pool of (at least) that many
+        read-only connections (mode=ro), while every other statement is executed by one writer thread, in order, from
+        a queue of at most max_queued_writes statements, so that writes never contend with each other. A transaction
+        holds the writer from BEGIN until COMMIT or ROLLBACK. Readers see the writer's changes once committed, but only
+        don't block it (or each other) in WAL mode.
+
+        If cache_size is positive, SELECTs executed with cache=True outside of transactions are cached, up to
+        cache_size results, least recently used first out, each for at most cache_ttl seconds (or, if None, until
+        invalidated). A result is invalidated once any INSERT, DELETE, or UPDATE (by this instance) touches a table it
+        read, including via a cascading foreign key or a trigger; any other statement besides SELECT (e.g., CREATE or
+        PRAGMA) invalidates all results. Writes by other processes are only seen once results expire.
+
+        For SQLite, attach is a dict of other databases' files, keyed by alias (e.g., {"dictionary": "dictionary.db"}),
+        attached read-only to each connection, so that statements can read (and join) their tables as alias.table.
+        Writes to those databases should go through their own instances of SQL, whose writes also invalidate this
+        instance's cached results.
+
+        For SQLite, busy_timeout is how many seconds the driver itself waits for a lock before failing with "database
+        is locked". A statement outside of a transaction that fails anyway (and is thus rolled back) is retried up to
+        busy_retries times, after a jittered, exponential backoff. Statements within transactions aren't, since the
+        transaction as a whole would need to be retried, nor are executemany's, whose rows might not be reusable.
+        Contention is counted (see contention_info).
+
         http://docs.sqlalchemy.org/en/latest/core/engines.html#sqlalchemy.create_engine
         http://docs.sqlalchemy.org/en/latest/dialects/index.html
         """
 
+        # Initialize only once, since instances are shared
+        if hasattr(self, "_engine"):
+            return
+
         # Lazily import
         import logging
         import os
         import re
         import sqlalchemy
         import sqlalchemy.orm
+        import termcolor
         import threading
+        import urllib.parse
 
         # Temporary fix for missing sqlite3 module on the buildpack stack
         try:
             import sqlite3
-        except:
-            pass
+        except ModuleNotFoundError:
+            sqlite3 = None
 
-        # Require that file already exist for SQLite
+        # Require that file (and any to attach) already exist for SQLite
         matches = re.search(r"^sqlite:///(.+)$", url)
-        if matches:
-            if not os.path.exists(matches.group(1)):
-                raise RuntimeError("does not exist: {}".format(matches.group(1)))
-            if not os.path.isfile(matches.group(1)):
-                raise RuntimeError("not a file: {}".format(matches.group(1)))
+        attach = dict(attach or {})
+        if attach and not matches:
+            raise RuntimeError("attach is only supported for SQLite")
+        for path in ([matches.group(1)] if matches else []) + list(attach.values()):
+            if not os.path.exists(path):
+                raise RuntimeError("does not exist: {}".format(path))
+            if not os.path.isfile(path):
+                raise RuntimeError("not a file: {}".format(path))
+
+        # Validate aliases, since they can't be parameterized
+        for alias in attach:
+            if not re.search(r"^[a-zA-Z_]\w*$", alias) or alias.lower() in ["main", "temp"]:
+                raise RuntimeError("invalid alias: {}".format(alias))
+
+        # Open databases as URIs, so that attached ones can be read-only
+        if attach:
+            kwargs["connect_args"] = dict(kwargs.get("connect_args", {}), uri=True)
+
+        # Wait for locks in driver, if asked
+        if busy_timeout is not None:
+            if not matches:
+                raise RuntimeError("busy_timeout is only supported for SQLite")
+            kwargs["connect_args"] = dict(kwargs.get("connect_args", {}), timeout=busy_timeout)
 
         # Create engine, disabling SQLAlchemy's own autocommit mode raising exception if back end's module not installed;
         # without isolation_level, PostgreSQL warns with "there is already a transaction in progress" for our own BEGIN and
@@ -79,29 +229,104 @@ class SQL(object):
         # https://github.com/cs50/python-cs50/issues/171
         self._engine.dialect.identifier_preparer._double_percents = False
 
-        # Get logger
+        # Get loggers
         self._logger = logging.getLogger("cs50")
+        self._slow_logger = logging.getLogger("cs50.slow")
+
+        # Validate pragmas, since they can't be parameterized
+        pragmas = dict(pragmas or {})
+        for name, value in pragmas.items():
+            if not re.search(r"^[a-z_]+$", name) or not re.search(r"^-?\w+$", str(value)):
+                raise RuntimeError("invalid pragma: {}={}".format(name, value))
 
         # Listener for connections
-        def connect(dbapi_connection, connection_record):
-            # Enable foreign key constraints
-            try:
-                if isinstance(
+        def listener(pragmas):
+            def connect(dbapi_connection, connection_record):
+                # Enable foreign key constraints, unless sqlite3 module is missing (and thus back end isn't sqlite)
+                if sqlite3 is not None and isinstance(
                     dbapi_connection, sqlite3.Connection
                 ):  # If back end is sqlite
                     cursor = dbapi_connection.cursor()
                     cursor.execute("PRAGMA foreign_keys=ON")
+
+                    # Apply settings, failing to connect (rather than connecting without them) if one fails
+                    for name, value in pragmas.items():
+                        try:
+                            cursor.execute("PRAGMA {}={}".format(name, value))
+                        except sqlite3.Error:
+                            self._logger.error(termcolor.colored("PRAGMA {}={}".format(name, value), "red"))
+                            raise
                     cursor.close()
-            except:
-                # Temporary fix for missing sqlite3 module on the buildpack stack
-                pass
+
+                # Attach other databases, read-only, after settings, which would otherwise apply to them too
+                if attach:
+                    cursor = dbapi_connection.cursor()
+                    for alias, path in attach.items():
+                        cursor.execute(
+                            "ATTACH DATABASE ? AS {}".format(alias),
+                            ("file:{}?mode=ro".format(urllib.parse.quote(path)),),
+                        )
+                    cursor.close()
+
+            return connect
 
         # Register listener
-        sqlalchemy.event.listen(self._engine, "connect", connect)
+        sqlalchemy.event.listen(self._engine, "connect", listener(pragmas))
+
+        # Split reads from writes, if asked
+        self._reader = None
+        self._writer = None
+        if readers is not None:
+            if self._engine.url.get_backend_name() != "sqlite":
+                raise RuntimeError("readers are only supported for SQLite")
+
+            # Open database read-only for readers, which can't change its journal mode
+            self._reader = sqlalchemy.create_engine(
+                "sqlite:///file:{}?mode=ro&uri=true".format(urllib.parse.quote(self._engine.url.database)),
+                pool_size=readers,
+                pool_pre_ping=kwargs.get("pool_pre_ping", False),
+                connect_args={"timeout": busy_timeout} if busy_timeout is not None else {},
+            ).execution_options(autocommit=False, isolation_level="AUTOCOMMIT", no_parameters=True)
+            sqlalchemy.event.listen(
+                self._reader,
+                "connect",
+                listener({name: value for name, value in pragmas.items() if name != "journal_mode"}),
+            )
+            self._writer = _Writer("sql-writer-{}".format(self._engine.url.database), max_queued_writes)
+
+        # Cache results of SELECTs, if asked
+        self._cache = _ResultCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self._dependents = None
+
+        # Count contention, shared across threads
+        self._busy_retries = busy_retries
+        self._contention = collections.Counter()
+        self._contention_lock = threading.Lock()
+
+        # Remember files, so that writes to one can invalidate results cached by instances that attach it
+        self._path = os.path.abspath(matches.group(1)) if matches else None
+        self._attached = {os.path.abspath(path) for path in attach.values()}
 
         # Autocommit by default
         self._autocommit = True
 
+        # Bind values natively or escape them as literals
+        self._bind_parameters = bind_parameters
+
+        # Coerce types of values in result sets, unless SQLite, which only returns bytes, float, int, str, and None
+        self._coerce = self._engine.url.get_backend_name() != "sqlite"
+
+        # Return connections to pool after each statement, request, or not at all
+        if pooling not in ["statement", "request", "thread"]:
+            raise RuntimeError("invalid pooling: {}".format(pooling))
+        self._pooling = pooling
+        self._max_idle = max_idle
+
+        # Statistics for each statement's fingerprint, shared across threads
+        self._slow_query_threshold = slow_query_threshold
+        self._statistics = {}
+        self._statistics_lock = threading.Lock()
+
         # Test database
         disabled = self._logger.disabled
         self._logger.disabled = True
@@ -120,94 +345,653 @@ class SQL(object):
         """Disconnect from database."""
         self._disconnect()
 
+    def _connect(self, read_only=False):
+        """
+        Return this thread's database connection, connecting (or reconnecting) as needed.
+
+        If read_only is True and reads are split from writes, return this thread's read-only connection instead.
+        """
+
+        # Lazily import
+        import time
+
+        # Choose connection
+        engine, name = self._engine, self._name()
+        if read_only and self._reader is not None:
+            engine, name = self._reader, self._name() + "_reader"
+
+        # Discard connection if no longer usable or, outside of a transaction, idle for too long
+        connection = getattr(_data, name, None)
+        now = time.monotonic()
+        if connection is not None:
+            if connection.closed or connection.invalidated:
+                delattr(_data, name)
+                connection = None
+            elif (
+                self._max_idle is not None
+                and self._autocommit
+                and now - getattr(_data, name + "_used") > self._max_idle
+            ):
+                self._disconnect()
+                connection = None
+
+        # If no connection yet
+        if connection is None:
+            # Disconnect if/when a Flask app is torn down, registering teardown now if app wasn't set up with init_app
+            self._init_current_app()
+
+            # Connect to database
+            connection = engine.connect()
+            setattr(_data, name, connection)
+
+        # Remember when connection was last used
+        setattr(_data, name + "_used", now)
+        return connection
+
     def _disconnect(self):
-        """Close database connection."""
+        """Close database connection(s)."""
+        if hasattr(_data, self._name() + "_reader"):
+            getattr(_data, self._name() + "_reader").close()
+            delattr(_data, self._name() + "_reader")
         if hasattr(_data, self._name()):
             getattr(_data, self._name()).close()
             delattr(_data, self._name())
+            self._autocommit = True
+
+    def _teardown_appcontext(self, exception):
+        """Disconnect when a Flask app context is torn down, unless keeping connection for life of thread."""
+        if self._pooling != "thread" or not self._autocommit:
+            self._disconnect()
+
+    @staticmethod
+    def init_app(app):
+        """
+        Disconnect every instance (but those keeping connections for the life of their threads) whenever one of a
+        Flask app's contexts is torn down, as pooling="request" expects.
+
+        Should be called while setting up the app, since Flask refuses to register teardown functions once an app has
+        handled its first request.
+        """
+        if "cs50.sql" not in app.extensions:
+            app.teardown_appcontext(_teardown_appcontext)
+            app.extensions["cs50.sql"] = True
+
+    def _init_current_app(self):
+        """
+        Call init_app for the current Flask app, if any, unless already called, raising RuntimeError if too late for
+        this instance's connections to be returned at the end of each request.
+        """
+        try:
+            import flask
+        except ModuleNotFoundError:
+            return
+        if not flask.current_app or "cs50.sql" in flask.current_app.extensions:
+            return
+        try:
+            SQL.init_app(flask.current_app)
+        except AssertionError:
+            if self._pooling == "request":
+                raise RuntimeError("call SQL.init_app(app) before the app's first request, for pooling=\"request\"")
 
     def _name(self):
         """Return object's hash as a str."""
         return str(hash(self))
 
+    @property
+    def _autocommit(self):
+        """Whether this thread autocommits, since instances are shared across threads."""
+        return getattr(_data, self._name() + "_autocommit", True)
+
+    @_autocommit.setter
+    def _autocommit(self, value):
+        # Hold the writer, if any, from the start of this thread's transaction until its end
+        if self._writer is not None and value != self._autocommit:
+            if value:
+                getattr(_data, self._name() + "_release")()
+                delattr(_data, self._name() + "_release")
+            else:
+                setattr(_data, self._name() + "_release", self._writer.hold())
+
+        # Invalidate cached results that read tables written during transaction, now that others can see the writes
+        if value and hasattr(_data, self._name() + "_written"):
+            self._invalidate(getattr(_data, self._name() + "_written"))
+            delattr(_data, self._name() + "_written")
+        setattr(_data, self._name() + "_autocommit", value)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Execute statements within block in one transaction, committed if block succeeds, else rolled back.
+
+        Transactions nest: within another transaction (or after BEGIN), a block is a savepoint instead, released if
+        block succeeds, else rolled back to (without ending the enclosing transaction).
+        """
+
+        # Lazily import
+        import sqlalchemy
+
+        # Use this thread's connection for the whole block
+        connection = self._connect()
+        depth = getattr(_data, self._name() + "_depth", 0)
+
+        # Begin transaction, or savepoint if already in one
+        savepoint = None
+        if self._autocommit:
+            self._autocommit = False  # Waits for the writer, if any
+            try:
+                connection.execute(sqlalchemy.text("BEGIN"))
+            except BaseException:
+                self._autocommit = True
+                raise
+        else:
+            savepoint = "_sql_{}".format(depth)
+            connection.execute(sqlalchemy.text("SAVEPOINT {}".format(savepoint)))
+        setattr(_data, self._name() + "_depth", depth + 1)
+
+        try:
+            yield self
+
+        except BaseException:
+            # Undo block, unless connection (and thus transaction) was already closed because of an error
+            if getattr(_data, self._name(), None) is connection:
+                if savepoint:
+                    connection.execute(sqlalchemy.text("ROLLBACK TO {}".format(savepoint)))
+                    connection.execute(sqlalchemy.text("RELEASE {}".format(savepoint)))
+                else:
+                    connection.execute(sqlalchemy.text("ROLLBACK"))
+                    self._autocommit = True
+            raise
+
+        else:
+            if savepoint:
+                connection.execute(sqlalchemy.text("RELEASE {}".format(savepoint)))
+            else:
+                connection.execute(sqlalchemy.text("COMMIT"))
+                self._autocommit = True
+
+        finally:
+            setattr(_data, self._name() + "_depth", depth)
+            if self._autocommit and self._pooling == "statement":  # Don't stay connected unnecessarily
+                self._disconnect()
+
+    def settings(self):
+        """Return effective values of SQLite's performance-related settings, as seen by this thread's connection."""
+
+        # Lazily import
+        import sqlalchemy
+
+        if self._engine.url.get_backend_name() != "sqlite":
+            raise RuntimeError("settings are only supported for SQLite")
+
+        # Query each setting
+        connection = self._connect()
+        try:
+            return {
+                name: connection.execute(sqlalchemy.text("PRAGMA {}".format(name))).scalar()
+                for name in _SETTINGS
+            }
+        finally:
+            if self._autocommit and self._pooling == "statement":  # Don't stay connected unnecessarily
+                self._disconnect()
+
+    def warm_up(self):
+        """Connect and execute a trivial statement, so that the first request needn't."""
+        self.execute("SELECT 1")
+
     @_enable_logging
-    def execute(self, sql, *args, **kwargs):
-        """Execute a SQL statement."""
+    def execute(self, sql, *args, rows="dict", cache=False, **kwargs):
+        """
+        Execute a SQL statement.
+
+        SELECT returns a list of dict objects, unless rows is "record", in which case it returns a list of compact,
+        read-only records, which support row["column"], row.get("column"), and the rest of a dict's read methods
+        but store values in __slots__.
+
+        If cache is True and this instance has a cache (see cache_size), a SELECT's result is reused until a write
+        to one of its tables, keyed by statement and values, so it should only be used for deterministic statements.
+        (Because of rows and cache, named placeholders can't be called :rows or :cache.)
+        """
+
+        # Validate row format
+        if rows not in ["dict", "record"]:
+            raise RuntimeError("invalid rows: {}".format(rows))
 
         # Lazily import
-        import decimal
-        import re
         import sqlalchemy
-        import sqlparse
-        import termcolor
         import warnings
 
-        # Parse statement, stripping comments and then leading/trailing whitespace
-        statements = sqlparse.parse(sqlparse.format(sql, strip_comments=True).strip())
+        # Parse statement, preparing it with its values
+        parsed, statement, parameters, _display = self._prepare(sql, args, kwargs)
+        command = parsed.command
+
+        # Outside of a transaction, queue statements other than SELECT for the writer, if any
+        if (
+            self._writer is not None
+            and self._autocommit
+            and command not in ["BEGIN", "SELECT", "START"]
+            and not self._writer.is_current()
+        ):
+            return self._writer.submit(self.execute, sql, *args, rows=rows, cache=cache, **kwargs)
+
+        # Reuse cached result, if any, outside of a transaction (whose own writes wouldn't be cached)
+        key = None
+        if cache and self._cache is not None and command == "SELECT" and self._autocommit:
+            key = (statement, tuple(sorted(parameters.items())), rows)
+            ret = self._cache.get(key)
+            if ret is not None:
+                return [dict(row) for row in ret] if rows == "dict" else list(ret)
+            generations = self._cache.generations(parsed.tables)
+
+        # Use this thread's connection, read-only for SELECT outside of a transaction if reads are split from writes
+        connection = self._connect(read_only=command == "SELECT" and self._autocommit)
 
-        # Allow only one statement at a time, since SQLite doesn't support multiple
-        # https://docs.python.org/3/library/sqlite3.html#sqlite3.Cursor.execute
-        if len(statements) > 1:
-            raise RuntimeError("too many statements at once")
-        elif len(statements) == 0:
-            raise RuntimeError("missing statement")
+        # Catch SQLAlchemy warnings
+        with warnings.catch_warnings():
+            # Raise exceptions for warnings
+            warnings.simplefilter("error")
 
-        # Ensure named and positional parameters are mutually exclusive
-        if len(args) > 0 and len(kwargs) > 0:
-            raise RuntimeError("cannot pass both positional and named parameters")
+            # Prepare, execute statement, timing, logging, and recording it, and translating errors
+            with self._executing(parsed, connection, statement, parameters, _display, self._disconnect) as recorded:
+                # Check for start of transaction
+                if command in ["BEGIN", "START", "VACUUM"]:  # cannot VACUUM from within a transaction
+                    self._autocommit = False
 
-        # Infer command from flattened statement to a single string separated by spaces
-        full_statement = " ".join(
-            str(token)
-            for token in statements[0].tokens
-            if token.ttype
-            in [
-                sqlparse.tokens.Keyword,
-                sqlparse.tokens.Keyword.DDL,
-                sqlparse.tokens.Keyword.DML,
-            ]
-        )
-        full_statement = full_statement.upper()
-
-        # Set of possible commands
-        commands = {
-            "BEGIN",
-            "CREATE VIEW",
-            "DELETE",
-            "INSERT",
-            "SELECT",
-            "START",
-            "UPDATE",
-            "VACUUM",
-        }
+                # Execute statement, retrying (outside of a transaction) if database is busy
+                def _execute():
+                    if self._autocommit:
+                        connection.execute(sqlalchemy.text("BEGIN"))
+                    result = connection.execute(sqlalchemy.text(statement), parameters)
+                    if self._autocommit:
+                        connection.execute(sqlalchemy.text("COMMIT"))
+                    return result
+
+                result = self._retrying(connection, _execute)
+
+                # Check for end of transaction
+                if command in ["COMMIT", "ROLLBACK", "VACUUM"]:  # cannot VACUUM from within a transaction
+                    self._autocommit = True
+
+                # Return value
+                ret = True
 
-        # Check if the full_statement starts with any command
-        command = next(
-            (cmd for cmd in commands if full_statement.startswith(cmd)), None
+                # If SELECT, return result set as list of dict objects
+                if command == "SELECT":
+                    # Return compact records, one class per set of columns
+                    if rows == "record":
+                        record = _record_class(tuple(result.keys()))
+                        if self._coerce:
+                            ret = [record(_coerce(dict(row)).values()) for row in result.mappings().all()]
+                        else:
+                            ret = [record(row) for row in result.all()]
+
+                    # Coerce types, unless back end never returns types to coerce
+                    else:
+                        ret = [dict(row) for row in result.mappings().all()]
+                        if self._coerce:
+                            for row in ret:
+                                _coerce(row)
+
+                # If INSERT, return primary key value for a newly inserted row (or None if none)
+                elif command == "INSERT":
+                    # If PostgreSQL
+                    if self._engine.url.get_backend_name() == "postgresql":
+                        # Return LASTVAL() or NULL, avoiding
+                        # "(psycopg2.errors.ObjectNotInPrerequisiteState) lastval is not yet defined in this session",
+                        # a la https://stackoverflow.com/a/24186770/5156190;
+                        # cf. https://www.psycopg.org/docs/errors.html re 55000
+                        result = connection.execute(
+                            sqlalchemy.text(
+                                """
+                            CREATE OR REPLACE FUNCTION _LASTVAL()
+                            RETURNS integer LANGUAGE plpgsql
+                            AS $$
+                            BEGIN
+                                BEGIN
+                                    RETURN (SELECT LASTVAL());
+                                EXCEPTION
+                                    WHEN SQLSTATE '55000' THEN RETURN NULL;
+                                END;
+                            END $$;
+                            SELECT _LASTVAL();
+                        """
+                            )
+                        )
+                        ret = result.first()[0]
+
+                    # If not PostgreSQL
+                    else:
+                        ret = result.lastrowid if result.rowcount == 1 else None
+
+                # If DELETE or UPDATE, return number of rows matched
+                elif command in ["DELETE", "UPDATE"]:
+                    ret = result.rowcount
+
+                # If CREATE VIEW, return True
+                elif command == "CREATE VIEW":
+                    ret = True
+
+                # Record rows returned (or matched)
+                if command == "SELECT":
+                    recorded["rows"] = len(ret)
+                elif command in ["DELETE", "UPDATE"]:
+                    recorded["rows"] = ret
+                else:
+                    recorded["rows"] = int(command == "INSERT" and ret is not None)
+
+            # Cache result, copying rows that caller could change, or invalidate results that a write affects
+            if key is not None:
+                self._cache.put(
+                    key, parsed.tables, generations, [dict(row) for row in ret] if rows == "dict" else ret
+                )
+            elif command not in ["BEGIN", "COMMIT", "ROLLBACK", "SELECT", "START"]:
+                self._wrote(command, parsed.tables)
+
+            if self._autocommit and self._pooling == "statement":  # Don't stay connected unnecessarily
+                self._disconnect()
+            return ret
+
+    def iterate(self, sql, *args, **kwargs):
+        """
+        Execute a SELECT statement, returning a generator of its rows (as dict objects) instead of a list.
+
+        Rows are fetched (and their types coerced) _ITERATE_BATCH_SIZE at a time, on a connection of the generator's
+        own (unless in a transaction), which is released once the generator is exhausted or closed. Statements are
+        retried, logged, and recorded as execute's are, once exhausted.
+        """
+
+        # Lazily import
+        import sqlalchemy
+
+        # Parse statement, preparing it with its values, now rather than on first iteration
+        parsed, statement, parameters, _display = self._prepare(sql, args, kwargs)
+        if parsed.command != "SELECT":
+            raise RuntimeError("iterate supports only SELECT")
+
+        def _iterate():
+            # Within a transaction, use this thread's connection, so as to see its changes
+            if not self._autocommit:
+                connection, close = self._connect(), False
+            else:
+                connection, close = (self._reader or self._engine).connect(), True
+            disconnect = connection.invalidate if close else self._disconnect
+            try:
+                with self._executing(parsed, connection, statement, parameters, _display, disconnect) as recorded:
+                    result = self._retrying(connection, lambda: connection.execution_options(
+                        stream_results=True
+                    ).execute(sqlalchemy.text(statement), parameters))
+                    while True:
+                        rows = result.mappings().fetchmany(_ITERATE_BATCH_SIZE)
+                        if not rows:
+                            break
+                        recorded["rows"] += len(rows)
+                        for row in rows:
+                            row = dict(row)
+                            yield _coerce(row) if self._coerce else row
+            finally:
+                if close:
+                    connection.close()
+
+        return _iterate()
+
+    @contextlib.contextmanager
+    def _executing(self, parsed, connection, statement, parameters, _display, disconnect):
+        """
+        Time the statement executed on connection (and its rows fetched) within, counting rows in the dict yielded
+        (as "rows"). If it succeeds, log it, record it, and log it as slow, if so. If a constraint is violated, roll
+        back (if autocommitting) and raise ValueError; if any other database error, disconnect and raise RuntimeError.
+        """
+
+        # Lazily import
+        import logging
+        import sqlalchemy
+        import termcolor
+        import time
+
+        recorded = {"rows": 0}
+        start = time.perf_counter()
+        try:
+            yield recorded
+
+            # Time statement, including fetching its rows
+            elapsed = time.perf_counter() - start
+
+        # If constraint violated
+        except sqlalchemy.exc.IntegrityError as e:
+            if self._autocommit:
+                connection.execute(sqlalchemy.text("ROLLBACK"))
+            self._logger.error(termcolor.colored(_display(), "red"))
+            e = ValueError(e.orig)
+            e.__cause__ = None
+            raise e
+
+        # If user error (or other database error, e.g., corruption, after which the connection can't be trusted)
+        except (
+            sqlalchemy.exc.OperationalError,
+            sqlalchemy.exc.ProgrammingError,
+            sqlalchemy.exc.DatabaseError,
+        ) as e:
+            disconnect()
+            self._logger.error(termcolor.colored(_display(), "red"))
+            e = RuntimeError(e.orig)
+            e.__cause__ = None
+            raise e
+
+        if not self._logger.disabled and self._logger.isEnabledFor(logging.INFO):
+            self._logger.info(termcolor.colored(_display(), "green"))
+
+        # Record timing, along with rows returned (or matched)
+        self._record(parsed.fingerprint, elapsed, recorded["rows"])
+
+        # Log slow statement, with its plan
+        if self._slow_query_threshold is not None and elapsed > self._slow_query_threshold:
+            self._slow_logger.warning(
+                "{:.1f} ms: {}{}".format(
+                    elapsed * 1000,
+                    _display(),
+                    self._explain(connection, parsed.command, statement, parameters),
+                )
+            )
+
+    def _retrying(self, connection, f):
+        """Returns f(), which executes a statement on connection, retrying it if busy, as _retry decides."""
+
+        # Lazily import
+        import sqlalchemy
+
+        for attempt in itertools.count():
+            try:
+                result = f()
+            except sqlalchemy.exc.OperationalError as e:
+                if not self._retry(e, connection, attempt):
+                    raise
+            else:
+                if attempt > 0:
+                    self._contended("recovered")
+                return result
+
+    @_enable_logging
+    def executemany(self, sql, rows, chunk_size=1000):
+        """
+        Execute a SQL statement once per row of values, all in one transaction (or in the current one, if any).
+
+        Rows are sequences of values for qmark, numeric, and format placeholders, or mappings of names to values for
+        named and pyformat placeholders. Values are bound natively, and rows are read and handed to the driver
+        chunk_size at a time, so rows may be a generator. Returns a list of new rows' primary keys for INSERT,
+        otherwise the total number of rows matched.
+        """
+
+        # Lazily import
+        import sqlalchemy
+        import termcolor
+        import time
+
+        # Parse statement
+        parsed = _parse_statement(sql)
+        if parsed.command not in ["DELETE", "INSERT", "UPDATE"]:
+            raise RuntimeError("executemany supports only DELETE, INSERT, and UPDATE")
+
+        # Outside of a transaction, queue for the writer, if any
+        if self._writer is not None and self._autocommit and not self._writer.is_current():
+            return self._writer.submit(self.executemany, sql, rows, chunk_size=chunk_size)
+
+        # Compile statement into driver's own paramstyle
+        compiled = sqlalchemy.text(parsed.bound).compile(dialect=self._engine.dialect)
+        names = list(parsed.placeholders.values())
+
+        def _parameters(row):
+            """Return row's values, bound in order of placeholders."""
+            if parsed.paramstyle in ["qmark", "format"]:
+                if len(row) != len(names):
+                    raise RuntimeError(
+                        "{} placeholders but {} values in row ({})".format(len(names), len(row), row)
+                    )
+                values = row
+            elif parsed.paramstyle == "numeric":
+                if any(i >= len(row) for i in names):
+                    raise RuntimeError("missing value for placeholder in row ({})".format(row))
+                values = [row[i] for i in names]
+            elif parsed.paramstyle in ["named", "pyformat"]:
+                missing = [name for name in names if name not in row]
+                if missing:
+                    raise RuntimeError("missing value for placeholder (:{})".format(missing[0]))
+                values = [row[name] for name in names]
+            else:
+                values = []
+            values = [_bind_value(value) for value in values]
+            if compiled.positiontup is None:
+                return {"p{}".format(n): value for n, value in enumerate(values)}
+            return tuple(values)
+
+        # Use this thread's connection, beginning a transaction unless already in one
+        connection = self._connect()
+        autocommit = self._autocommit
+        cursor = connection.connection.cursor()
+        dbapi = self._engine.dialect.dbapi
+
+        # Don't stay connected unnecessarily
+        disconnect = autocommit and self._pooling == "statement"
+        start = time.perf_counter()
+        try:
+            if autocommit:
+                connection.execute(sqlalchemy.text("BEGIN"))
+
+            # Execute statement chunk_size rows at a time
+            ids, count = [], 0
+            rows = iter(rows)
+            while True:
+                chunk = [_parameters(row) for row in itertools.islice(rows, chunk_size)]
+                if not chunk:
+                    break
+
+                # Execute INSERTs one at a time, to know each row's primary key
+                if parsed.command == "INSERT":
+                    for parameters in chunk:
+                        cursor.execute(compiled.string, parameters)
+                        ids.append(cursor.lastrowid if cursor.rowcount == 1 else None)
+                else:
+                    cursor.executemany(compiled.string, chunk)
+                    count += cursor.rowcount
+
+            if autocommit:
+                connection.execute(sqlalchemy.text("COMMIT"))
+
+        # If constraint violated
+        except dbapi.IntegrityError as e:
+            if autocommit:
+                connection.execute(sqlalchemy.text("ROLLBACK"))
+            self._logger.error(termcolor.colored(parsed.bound, "red"))
+            e = ValueError(e)
+            e.__cause__ = None
+            raise e
+
+        # If user error
+        except (dbapi.OperationalError, dbapi.ProgrammingError) as e:
+            disconnect = True
+            if _is_busy(e):
+                self._contended("busy", "failed")
+            self._logger.error(termcolor.colored(parsed.bound, "red"))
+            e = RuntimeError(e)
+            e.__cause__ = None
+            raise e
+
+        # If invalid row, undo rows executed so far
+        except RuntimeError:
+            if autocommit:
+                connection.execute(sqlalchemy.text("ROLLBACK"))
+            raise
+
+        # Return value
+        else:
+            self._logger.info(
+                termcolor.colored("{} ({} rows)".format(parsed.bound, len(ids) or count), "green")
+            )
+            self._record(parsed.fingerprint, time.perf_counter() - start, len(ids) or count)
+            self._wrote(parsed.command, parsed.tables)
+            return ids if parsed.command == "INSERT" else count
+
+        finally:
+            cursor.close()
+            if disconnect:
+                self._disconnect()
+
+    def get_many(self, table, ids, columns=None, key="id", cache=False):
+        """
+        Select rows of table whose key is among ids, returning a dict of key to row, in order of ids (omitting ids
+        not found).
+
+        ids are passed as a single JSON array, expanded by SQLite's json_each, so the statement (and its parse) is
+        the same however many ids there are. columns (all, if None) always include key, and ids should be of key's
+        type (e.g., int for an INTEGER PRIMARY KEY) to be found among the rows' keys.
+        """
+
+        # Lazily import
+        import json
+
+        if self._engine.url.get_backend_name() != "sqlite":
+            raise RuntimeError("get_many supports only SQLite")
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return {}
+
+        # Quote identifiers, which can't be placeholders, allowing for a schema (e.g., an attached database's)
+        quote = self._engine.dialect.identifier_preparer.quote
+        if columns is None:
+            selected = "*"
+        else:
+            selected = ", ".join(quote(column) for column in [key] + [c for c in columns if c != key])
+        rows = self.execute(
+            "SELECT {} FROM {} WHERE {} IN (SELECT value FROM json_each(?))".format(
+                selected, ".".join(quote(part) for part in table.split(".")), quote(key)
+            ),
+            json.dumps(ids),
+            cache=cache,
         )
 
-        # Flatten statement
-        tokens = list(statements[0].flatten())
+        # Key rows, in order of ids
+        rows = {row[key]: row for row in rows}
+        return {id: rows[id] for id in ids if id in rows}
+
+    def _prepare(self, sql, args, kwargs):
+        """
+        Returns parsed statement, statement with its values (escaped or as parameters), parameters' values, and a
+        function that returns the statement as logged.
+        """
 
-        # Validate paramstyle
-        placeholders = {}
-        paramstyle = None
-        for index, token in enumerate(tokens):
-            # If token is a placeholder
-            if token.ttype == sqlparse.tokens.Name.Placeholder:
-                # Determine paramstyle, name
-                _paramstyle, name = _parse_placeholder(token)
+        # Lazily import
+        import re
+        import sqlparse
 
-                # Remember paramstyle
-                if not paramstyle:
-                    paramstyle = _paramstyle
+        # Parse statement, reusing the parsed shape of statements seen before
+        parsed = _parse_statement(sql)
 
-                # Ensure paramstyle is consistent
-                elif _paramstyle != paramstyle:
-                    raise RuntimeError("inconsistent paramstyle")
+        # Ensure named and positional parameters are mutually exclusive
+        if len(args) > 0 and len(kwargs) > 0:
+            raise RuntimeError("cannot pass both positional and named parameters")
 
-                # Remember placeholder's index, name
-                placeholders[index] = name
+        # Copy flattened statement, since placeholders are replaced with values below
+        tokens = list(parsed.tokens)
+        placeholders = parsed.placeholders
+        paramstyle = parsed.paramstyle
 
         # If no placeholders
         if not paramstyle:
@@ -220,8 +1004,12 @@ class SQL(object):
                 paramstyle = "named"
 
         # In case of errors
-        _placeholders = ", ".join([str(tokens[index]) for index in placeholders])
-        _args = ", ".join([str(self._escape(arg)) for arg in args])
+        if paramstyle in ["qmark", "format"] and len(placeholders) != len(args):
+            _placeholders = ", ".join([str(tokens[index]) for index in placeholders])
+            _args = ", ".join([str(self._escape(arg)) for arg in args])
+
+        # Values for placeholders, keyed by placeholders' indices
+        values = {}
 
         # qmark
         if paramstyle == "qmark":
@@ -240,19 +1028,19 @@ class SQL(object):
                         )
                     )
 
-            # Escape values
+            # Remember values
             for i, index in enumerate(placeholders.keys()):
-                tokens[index] = self._escape(args[i])
+                values[index] = args[i]
 
         # numeric
         elif paramstyle == "numeric":
-            # Escape values
+            # Remember values
             for index, i in placeholders.items():
                 if i >= len(args):
                     raise RuntimeError(
                         "missing value for placeholder (:{})".format(i + 1, len(args))
                     )
-                tokens[index] = self._escape(args[i])
+                values[index] = args[i]
 
             # Check if any values unused
             indices = set(range(len(args))) - set(placeholders.values())
@@ -268,13 +1056,13 @@ class SQL(object):
 
         # named
         elif paramstyle == "named":
-            # Escape values
+            # Remember values
             for index, name in placeholders.items():
                 if name not in kwargs:
                     raise RuntimeError(
                         "missing value for placeholder (:{})".format(name)
                     )
-                tokens[index] = self._escape(kwargs[name])
+                values[index] = kwargs[name]
 
             # Check if any keys unused
             keys = kwargs.keys() - placeholders.values()
@@ -298,19 +1086,19 @@ class SQL(object):
                         )
                     )
 
-            # Escape values
+            # Remember values
             for i, index in enumerate(placeholders.keys()):
-                tokens[index] = self._escape(args[i])
+                values[index] = args[i]
 
         # pyformat
         elif paramstyle == "pyformat":
-            # Escape values
+            # Remember values
             for index, name in placeholders.items():
                 if name not in kwargs:
                     raise RuntimeError(
                         "missing value for placeholder (%{}s)".format(name)
                     )
-                tokens[index] = self._escape(kwargs[name])
+                values[index] = kwargs[name]
 
             # Check if any keys unused
             keys = kwargs.keys() - placeholders.values()
@@ -321,165 +1109,265 @@ class SQL(object):
                     )
                 )
 
-        # For SQL statements where a colon is required verbatim, as within an inline string, use a backslash to escape
-        # https://docs.sqlalchemy.org/en/13/core/sqlelement.html?highlight=text#sqlalchemy.sql.expression.text
-        for index, token in enumerate(tokens):
-            # In string literal
-            # https://www.sqlite.org/lang_keywords.html
-            if token.ttype in [
-                sqlparse.tokens.Literal.String,
-                sqlparse.tokens.Literal.String.Single,
-            ]:
-                token.value = re.sub(r"(^'|\s+):", r"\1\:", token.value)
-
-            # In identifier
-            # https://www.sqlite.org/lang_keywords.html
-            elif token.ttype == sqlparse.tokens.Literal.String.Symbol:
-                token.value = re.sub(r'(^"|\s+):', r"\1\:", token.value)
-
-        # Join tokens into statement
-        statement = "".join([str(token) for token in tokens])
+        # Leave values to the driver, as bound parameters
+        if self._bind_parameters:
+            statement, parameters = self._bind(parsed, values)
 
-        # If no connection yet
-        if not hasattr(_data, self._name()):
-            # Connect to database
-            setattr(_data, self._name(), self._engine.connect())
+        # Escape values into statement as literals
+        else:
+            for index, value in values.items():
+                tokens[index] = self._escape(value)
+
+                # For values where a colon is required verbatim, use a backslash to escape
+                # (the statement's own literals were escaped once, when it was parsed)
+                if tokens[index].ttype in [
+                    sqlparse.tokens.Literal.String,
+                    sqlparse.tokens.Literal.String.Single,
+                ]:
+                    tokens[index].value = re.sub(r"(^'|\s+):", r"\1\:", tokens[index].value)
+
+            # Join tokens into statement
+            statement = "".join([str(token) for token in tokens])
+            parameters = {}
+
+        def _display():
+            """Return statement with its values, abbreviating binary data as <class 'bytes'>."""
+            _tokens = list(tokens)
+            if self._bind_parameters:
+                for index, value in values.items():
+                    _tokens[index] = self._escape(value)
+            return "".join(
+                [
+                    str(bytes) if token.ttype == sqlparse.tokens.Other else str(token)
+                    for token in _tokens
+                ]
+            )
 
-        # Use this connection
-        connection = getattr(_data, self._name())
+        return parsed, statement, parameters, _display
 
-        # Disconnect if/when a Flask app is torn down
-        try:
-            import flask
+    def _bind(self, parsed, values):
+        """
+        Returns statement with a named parameter for each placeholder, along with a dict of parameters' values.
 
-            assert flask.current_app
+        Values are passed through to the driver as is, except for dates and times, which are formatted as by _escape.
+        """
 
-            def teardown_appcontext(exception):
-                self._disconnect()
+        # Bind each value as its own parameter, in order of placeholders
+        parameters = {}
+        sequences = False
+        for n, index in enumerate(parsed.placeholders):
+            value = values[index]
+            if isinstance(value, (list, tuple)):
+                sequences = True
+                for i, v in enumerate(value):
+                    parameters["p{}_{}".format(n, i)] = _bind_value(v)
+            else:
+                parameters["p{}".format(n)] = _bind_value(value)
+
+        # Reuse statement rendered when parsed
+        if not sequences:
+            return parsed.bound, parameters
+
+        # Expand sequences into one parameter per value, separated by commas
+        tokens = list(parsed.tokens)
+        for n, index in enumerate(parsed.placeholders):
+            value = values[index]
+            if isinstance(value, (list, tuple)):
+                tokens[index] = ", ".join(":p{}_{}".format(n, i) for i in range(len(value)))
+            else:
+                tokens[index] = ":p{}".format(n)
+        return "".join([str(token) for token in tokens]), parameters
 
-            if teardown_appcontext not in flask.current_app.teardown_appcontext_funcs:
-                flask.current_app.teardown_appcontext(teardown_appcontext)
-        except (ModuleNotFoundError, AssertionError):
-            pass
+    def _record(self, fingerprint, elapsed, rows):
+        """Records a statement's timing and rows under its fingerprint."""
+        with self._statistics_lock:
+            statistics = self._statistics.get(fingerprint)
+            if statistics is None:
+                statistics = self._statistics[fingerprint] = _Statistics()
+            statistics.add(elapsed, rows)
 
-        # Catch SQLAlchemy warnings
-        with warnings.catch_warnings():
-            # Raise exceptions for warnings
-            warnings.simplefilter("error")
+    def _explain(self, connection, command, statement, parameters):
+        """Returns statement's EXPLAIN QUERY PLAN, one step per line, if SQLite, else an empty str."""
 
-            # Prepare, execute statement
-            try:
-                # Join tokens into statement, abbreviating binary data as <class 'bytes'>
-                _statement = "".join(
-                    [
-                        str(bytes)
-                        if token.ttype == sqlparse.tokens.Other
-                        else str(token)
-                        for token in tokens
-                    ]
-                )
+        # Lazily import
+        import sqlalchemy
 
-                # Check for start of transaction
-                if command in ["BEGIN", "START", "VACUUM"]:  # cannot VACUUM from within a transaction
-                    self._autocommit = False
+        if command not in _EXPLAIN_COMMANDS or self._engine.url.get_backend_name() != "sqlite":
+            return ""
 
-                # Execute statement
-                if self._autocommit:
-                    connection.execute(sqlalchemy.text("BEGIN"))
-                result = connection.execute(sqlalchemy.text(statement))
-                if self._autocommit:
-                    connection.execute(sqlalchemy.text("COMMIT"))
+        # Indent each step beneath its parent, ignoring statements that can't be explained
+        try:
+            result = connection.execute(
+                sqlalchemy.text("EXPLAIN QUERY PLAN " + statement), parameters
+            )
+        except sqlalchemy.exc.DBAPIError:
+            return ""
+        depths = {0: 0}
+        lines = []
+        for id, parent, _, detail in result.all():
+            depths[id] = depths.get(parent, 0) + 1
+            lines.append("\n" + "    " * depths[id] + detail)
+        return "".join(lines)
+
+    def statistics(self, reset=False):
+        """
+        Returns timings of statements executed (by execute and executemany), as a list of dicts, one per fingerprint,
+        with most total time first.
 
-                # Check for end of transaction
-                if command in ["COMMIT", "ROLLBACK", "VACUUM"]:  # cannot VACUUM from within a transaction
-                    self._autocommit = True
+        A statement's fingerprint is the statement with its placeholders, literals, and lists of either replaced with ?,
+        so that statements differing only in values are counted together. Times are in milliseconds; p50_ms, p95_ms, and
+        p99_ms are estimated from a histogram, to within 19%. If reset is True, statistics are cleared once returned.
+        """
+        with self._statistics_lock:
+            statistics = self._statistics
+            if reset:
+                self._statistics = {}
+            return sorted(
+                [
+                    dict(statement=fingerprint, **s.summary())
+                    for fingerprint, s in statistics.items()
+                ],
+                key=lambda s: s["total_ms"],
+                reverse=True,
+            )
 
-                # Return value
-                ret = True
+    def _wrote(self, command, tables):
+        """
+        Invalidates cached results that read tables written by an INSERT, DELETE, or UPDATE, now if outside of a
+        transaction, else at its end, or all results if another command (which could change schema).
+        """
+        caches = self._caches()
+        if not caches:
+            return
+        if command not in ["DELETE", "INSERT", "UPDATE"]:
+            self._dependents = None
+            for cache in caches:
+                cache.clear()
+        elif self._autocommit:
+            self._invalidate(tables)
+        else:
+            if not hasattr(_data, self._name() + "_written"):
+                setattr(_data, self._name() + "_written", set())
+            getattr(_data, self._name() + "_written").update(tables)
 
-                # If SELECT, return result set as list of dict objects
-                if command == "SELECT":
-                    # Coerce types
-                    rows = [dict(row) for row in result.mappings().all()]
-                    for row in rows:
-                        for column in row:
-                            # Coerce decimal.Decimal objects to float objects
-                            # https://groups.google.com/d/msg/sqlalchemy/0qXMYJvq8SA/oqtvMD9Uw-kJ
-                            if isinstance(row[column], decimal.Decimal):
-                                row[column] = float(row[column])
-
-                            # Coerce memoryview objects (as from PostgreSQL's bytea columns) to bytes
-                            elif isinstance(row[column], memoryview):
-                                row[column] = bytes(row[column])
-
-                    # Rows to be returned
-                    ret = rows
+    def _invalidate(self, tables):
+        """Invalidates cached results that read tables, or tables that writes to them can write in turn."""
 
-                # If INSERT, return primary key value for a newly inserted row (or None if none)
-                elif command == "INSERT":
-                    # If PostgreSQL
-                    if self._engine.url.get_backend_name() == "postgresql":
-                        # Return LASTVAL() or NULL, avoiding
-                        # "(psycopg2.errors.ObjectNotInPrerequisiteState) lastval is not yet defined in this session",
-                        # a la https://stackoverflow.com/a/24186770/5156190;
-                        # cf. https://www.psycopg.org/docs/errors.html re 55000
-                        result = connection.execute(
-                            sqlalchemy.text(
-                                """
-                            CREATE OR REPLACE FUNCTION _LASTVAL()
-                            RETURNS integer LANGUAGE plpgsql
-                            AS $$
-                            BEGIN
-                                BEGIN
-                                    RETURN (SELECT LASTVAL());
-                                EXCEPTION
-                                    WHEN SQLSTATE '55000' THEN RETURN NULL;
-                                END;
-                            END $$;
-                            SELECT _LASTVAL();
-                        """
-                            )
-                        )
-                        ret = result.first()[0]
+        # Lazily import
+        import sqlalchemy
 
-                    # If not PostgreSQL
-                    else:
-                        ret = result.lastrowid if result.rowcount == 1 else None
+        # Infer, once, which tables writes to each table can write in turn, via cascading foreign keys and triggers
+        dependents = self._dependents
+        if dependents is None and self._engine.url.get_backend_name() == "sqlite":
+            dependents = collections.defaultdict(set)
+            with self._engine.connect() as connection:
+                for type, name, table, sql in connection.execute(
+                    sqlalchemy.text(
+                        "SELECT type, name, tbl_name, sql FROM sqlite_master WHERE type IN ('table', 'trigger')"
+                    )
+                ).all():
+                    if type == "table":
+                        for key in connection.execute(
+                            sqlalchemy.text("SELECT * FROM pragma_foreign_key_list(:name)"), {"name": name}
+                        ).mappings():
+                            if key["on_delete"] not in ["NO ACTION", "RESTRICT"] or key["on_update"] not in [
+                                "NO ACTION", "RESTRICT"
+                            ]:
+                                dependents[key["table"].lower()].add(name.lower())
+                    elif sql:
+                        body = re.split(r"\bBEGIN\b", sql, maxsplit=1, flags=re.IGNORECASE)[-1]
+                        dependents[table.lower()].update(match.lower() for match in _WRITTEN_TABLE.findall(body))
+            self._dependents = dependents
+
+        # Include tables written in turn
+        tables = set(tables)
+        pending = list(tables)
+        while pending:
+            for table in (dependents or {}).get(pending.pop(), ()):
+                if table not in tables:
+                    tables.add(table)
+                    pending.append(table)
+        for cache in self._caches():
+            cache.invalidate(tables)
+
+    def _caches(self):
+        """Returns caches of results that writes to this database can invalidate, i.e., its own and attaching ones'."""
+        with _instances_lock:
+            instances = [self] + [
+                other for other, _ in _instances.values() if other is not self and self._path in other._attached
+            ]
+        return [instance._cache for instance in instances if instance._cache is not None]
 
-                # If DELETE or UPDATE, return number of rows matched
-                elif command in ["DELETE", "UPDATE"]:
-                    ret = result.rowcount
+    def cache_info(self):
+        """
+        Returns the result cache's hits, misses, invalidated results, current size, and maximum size, as a dict, or
+        None if results aren't cached.
+        """
+        return self._cache.info() if self._cache is not None else None
 
-                # If CREATE VIEW, return True
-                elif command == "CREATE VIEW":
-                    ret = True
+    def _retry(self, e, connection, attempt):
+        """
+        Returns whether to retry a statement that failed with e, which it is if database was busy, outside of a
+        transaction, and not yet retried busy_retries times, in which case rolls back and backs off first.
+        """
 
-            # If constraint violated
-            except sqlalchemy.exc.IntegrityError as e:
-                if self._autocommit:
-                    connection.execute(sqlalchemy.text("ROLLBACK"))
-                self._logger.error(termcolor.colored(_statement, "red"))
-                e = ValueError(e.orig)
-                e.__cause__ = None
-                raise e
-
-            # If user error
-            except (
-                sqlalchemy.exc.OperationalError,
-                sqlalchemy.exc.ProgrammingError,
-            ) as e:
-                self._disconnect()
-                self._logger.error(termcolor.colored(_statement, "red"))
-                e = RuntimeError(e.orig)
-                e.__cause__ = None
-                raise e
+        # Lazily import
+        import random
+        import sqlalchemy
+        import time
 
-            # Return value
-            else:
-                self._logger.info(termcolor.colored(_statement, "green"))
-                if self._autocommit:  # Don't stay connected unnecessarily
-                    self._disconnect()
-                return ret
+        if not _is_busy(e.orig):
+            return False
+        self._contended("busy")
+        if not self._autocommit or attempt >= self._busy_retries:
+            self._contended("failed")
+            return False
+
+        # Undo attempt, unless already undone
+        try:
+            connection.execute(sqlalchemy.text("ROLLBACK"))
+        except sqlalchemy.exc.OperationalError:
+            pass
+
+        # Back off, with "full jitter"
+        delay = random.uniform(0, min(_BUSY_BACKOFF_MAX, _BUSY_BACKOFF * 2**attempt))
+        self._contended("retries", backoff_ms=delay * 1000)
+        time.sleep(delay)
+        return True
+
+    def _contended(self, *events, backoff_ms=0):
+        """Counts contention events."""
+        with self._contention_lock:
+            for event in events:
+                self._contention[event] += 1
+            self._contention["backoff_ms"] += backoff_ms
+
+    def contention_info(self):
+        """
+        Returns how many statements found the database busy (even after driver's busy_timeout), were retried,
+        recovered once retried, and failed, along with total milliseconds spent backing off, as a dict.
+        """
+        with self._contention_lock:
+            return {
+                "busy": self._contention["busy"],
+                "retries": self._contention["retries"],
+                "recovered": self._contention["recovered"],
+                "failed": self._contention["failed"],
+                "backoff_ms": round(self._contention["backoff_ms"], 3),
+            }
+
+    def write_queue_info(self):
+        """
+        Returns the writer's queue's current and maximum depth, capacity, and numbers of writes (and transactions)
+        queued, completed, and rejected because the queue was full, along with their mean wait in milliseconds, as a
+        dict, or None if reads aren't split from writes.
+        """
+        return self._writer.info() if self._writer is not None else None
+
+    @staticmethod
+    def statement_cache_info():
+        """Return hits, misses, maxsize, currsize of the parsed-statement cache."""
+        return _parse_statement.cache_info()
 
     def _escape(self, value):
         """
@@ -589,6 +1477,377 @@ class SQL(object):
             return __escape(value)
 
 
+class AsyncSQL(object):
+    """Wrap SQL to provide the same API to coroutines, executing statements on a dedicated pool of threads."""
+
+    def __init__(self, url, *args, max_workers=4, **kwargs):
+        """
+        Remember how to construct SQL, which happens lazily, on first use, so that AsyncSQL can be created before SQL
+        is configured elsewhere (e.g., by the app).
+
+        Statements are executed by up to max_workers threads, each of which keeps its own connection (since outside
+        of a Flask app context, a connection is never torn down), so max_workers should be less than the engine's
+        pool_size plus max_overflow.
+        """
+
+        # Lazily import
+        import concurrent.futures
+
+        self._url = url
+        self._args = args
+        self._kwargs = kwargs
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="sql"
+        )
+
+    @property
+    def sql(self):
+        """Return the (shared) instance of SQL for URL."""
+        return SQL(self._url, *self._args, **self._kwargs)
+
+    async def run(self, f, *args, **kwargs):
+        """
+        Call f(*args, **kwargs) on one of the pool's threads, returning its return value.
+
+        Because connections (and thus transactions) are per thread, statements that must share a transaction should
+        be executed by one such f, as with db.sql.transaction().
+        """
+
+        # Lazily import
+        import asyncio
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(f, *args, **kwargs)
+        )
+
+    async def execute(self, sql, *args, **kwargs):
+        """Execute a SQL statement, as with SQL.execute."""
+        return await self.run(self.sql.execute, sql, *args, **kwargs)
+
+    async def executemany(self, sql, rows, chunk_size=1000):
+        """Execute a SQL statement once per row of values, as with SQL.executemany."""
+        return await self.run(self.sql.executemany, sql, rows, chunk_size=chunk_size)
+
+    async def get_many(self, table, ids, columns=None, key="id", cache=False):
+        """Select rows of table by key, as with SQL.get_many."""
+        return await self.run(self.sql.get_many, table, ids, columns, key=key, cache=cache)
+
+
+def _bind_value(value):
+    """Returns value as bound natively, formatting dates and times as _escape does."""
+
+    # Lazily import
+    import datetime
+
+    # datetime.datetime
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+
+    # datetime.date
+    elif isinstance(value, datetime.date):
+        return value.strftime("%Y-%m-%d")
+
+    # datetime.time
+    elif isinstance(value, datetime.time):
+        return value.strftime("%H:%M:%S")
+
+    # bool, bytes, float, int, str, None
+    elif value is None or isinstance(value, (bool, bytes, float, int, str)):
+        return value
+
+    # Unsupported value
+    else:
+        raise RuntimeError("unsupported value: {}".format(value))
+
+
+class _Statistics(object):
+    """Call count, rows, and histogram of timings of one statement's fingerprint."""
+
+    __slots__ = ("calls", "rows", "total", "max", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(_HISTOGRAM_BOUNDS) + 1)
+
+    def add(self, elapsed, rows):
+        self.calls += 1
+        self.rows += rows
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.buckets[bisect.bisect_left(_HISTOGRAM_BOUNDS, elapsed)] += 1
+
+    def percentile(self, q):
+        """Returns upper bound of bucket containing qth percentile, in seconds, but no more than max."""
+        rank = q / 100 * self.calls
+        seen = 0
+        for bound, count in zip(_HISTOGRAM_BOUNDS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        """Returns statistics as a dict, with times in milliseconds."""
+        return {
+            "calls": self.calls,
+            "rows": self.rows,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total / self.calls * 1000, 3),
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p95_ms": round(self.percentile(95) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class _ResultCache(object):
+    """
+    Least-recently-used cache of SELECTs' results, each expiring after ttl seconds (unless None), and invalidated by
+    writes to the tables that it read.
+
+    Each table has a generation, incremented when invalidated, so that a result computed while a table was written
+    (and thus possibly already stale) isn't cached.
+    """
+
+    def __init__(self, size, ttl):
+        self._size = size
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()  # key: (expiry, tables, rows)
+        self._keys = collections.defaultdict(set)  # table: keys of results that read it
+        self._generations = collections.defaultdict(int)
+        self._epoch = 0  # Incremented when all results are invalidated
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._invalidations = 0
+
+    def get(self, key):
+        """Returns cached rows for key, or None."""
+
+        # Lazily import
+        import time
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[2]
+
+    def generations(self, tables):
+        """Returns current generations of tables, to be passed to put."""
+        with self._lock:
+            return self._epoch, tuple(self._generations[table] for table in sorted(tables))
+
+    def put(self, key, tables, generations, rows):
+        """Caches rows for key, unless tables were invalidated since generations were returned."""
+
+        # Lazily import
+        import time
+
+        with self._lock:
+            if (self._epoch, tuple(self._generations[table] for table in sorted(tables))) != generations:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self._ttl if self._ttl is not None else None, tables, rows)
+            for table in tables:
+                self._keys[table].add(key)
+            while len(self._entries) > self._size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tables):
+        """Removes results that read any of tables."""
+        with self._lock:
+            for table in tables:
+                self._generations[table] += 1
+                for key in list(self._keys.pop(table, ())):
+                    self._remove(key)
+                    self._invalidations += 1
+
+    def clear(self):
+        """Removes all results."""
+        with self._lock:
+            self._epoch += 1
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            self._keys.clear()
+
+    def _remove(self, key):
+        _, tables, _ = self._entries.pop(key)
+        for table in tables:
+            self._keys[table].discard(key)
+            if not self._keys[table]:
+                del self._keys[table]
+
+    def info(self):
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations,
+                "size": len(self._entries),
+                "max_size": self._size,
+            }
+
+
+class _Writer(object):
+    """Thread that executes a database's writes one at a time, in order, from a bounded queue."""
+
+    def __init__(self, name, size):
+        self._queue = queue.Queue(maxsize=size)
+        self._lock = threading.Lock()
+        self._queued = self._completed = self._rejected = self._max_depth = 0
+        self._wait = 0.0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # Lazily import
+        import time
+
+        while True:
+            f, future, queued = self._queue.get()
+            with self._lock:
+                self._wait += time.perf_counter() - queued
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(f())
+                except BaseException as e:
+                    future.set_exception(e)
+            with self._lock:
+                self._completed += 1
+
+    def is_current(self):
+        """Returns whether calling thread is the writer itself."""
+        return threading.current_thread() is self._thread
+
+    def _put(self, f):
+        """Queues f for the writer, waiting (for a while) for room if queue is full, returning a future."""
+
+        # Lazily import
+        import concurrent.futures
+        import time
+
+        future = concurrent.futures.Future()
+        try:
+            self._queue.put((f, future, time.perf_counter()), timeout=_WRITE_QUEUE_TIMEOUT)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise RuntimeError("too many writes queued")
+        with self._lock:
+            self._queued += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return future
+
+    def submit(self, f, *args, **kwargs):
+        """Calls f(*args, **kwargs) on the writer, returning its return value (or raising its exception)."""
+        return self._put(functools.partial(f, *args, **kwargs)).result()
+
+    def hold(self):
+        """Waits for the writer to finish writes queued so far, then blocks it until returned function is called."""
+        if self.is_current():
+            return lambda: None
+        started, done = threading.Event(), threading.Event()
+
+        def _hold():
+            started.set()
+            done.wait()
+
+        self._put(_hold)
+        started.wait()
+        return done.set
+
+    def info(self):
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "max_depth": self._max_depth,
+                "capacity": self._queue.maxsize,
+                "queued": self._queued,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "mean_wait_ms": round(self._wait / self._completed * 1000, 3) if self._completed else 0.0,
+            }
+
+
+def _teardown_appcontext(exception):
+    """Disconnect every instance, as registered by SQL.init_app."""
+    with _instances_lock:
+        instances = [self for self, _ in _instances.values()]
+    for self in instances:
+        self._teardown_appcontext(exception)
+
+
+def _is_busy(e):
+    """Returns whether e, a driver's exception, means that the database (or a table) was locked by another."""
+
+    # SQLITE_BUSY, SQLITE_LOCKED, and their extended codes
+    code = getattr(e, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in [5, 6]
+    return "database is locked" in str(e) or "database table is locked" in str(e)
+
+
+def _coerce(row):
+    """Coerces row's values to types returned by all back ends, in place, returning row."""
+
+    # Lazily import
+    import decimal
+
+    for column, value in row.items():
+        # Coerce decimal.Decimal objects to float objects
+        # https://groups.google.com/d/msg/sqlalchemy/0qXMYJvq8SA/oqtvMD9Uw-kJ
+        if isinstance(value, decimal.Decimal):
+            row[column] = float(value)
+
+        # Coerce memoryview objects (as from PostgreSQL's bytea columns) to bytes
+        elif isinstance(value, memoryview):
+            row[column] = bytes(value)
+
+    return row
+
+
+class _Record(collections.abc.Mapping):
+    """Read-only row whose values are stored in __slots__ rather than a dict."""
+
+    __slots__ = ()
+
+    def __init__(self, values):
+        for slot, value in zip(self.__slots__, values):
+            setattr(self, slot, value)
+
+    def __getitem__(self, column):
+        return getattr(self, self._slots[column])
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+@functools.lru_cache(maxsize=_STATEMENT_CACHE_SIZE)
+def _record_class(columns):
+    """Returns a subclass of _Record for rows with these columns, with one slot per column."""
+    slots = tuple("_{}".format(i) for i in range(len(columns)))
+    return type(
+        "Record",
+        (_Record,),
+        {"__slots__": slots, "_slots": dict(zip(columns, slots))},
+    )
+
+
 def _parse_exception(e):
     """Parses an exception, returns its message."""
 
@@ -654,4 +1913,178 @@ def _parse_placeholder(token):
         return "pyformat", matches.group(1)
 
     # Invalid
-    raise RuntimeError("{}: invalid placeholder".format(token.value))
\ No newline at end of file
+    raise RuntimeError("{}: invalid placeholder".format(token.value))
+
+
+# Parsed shape of a statement, shared by every execution of the same SQL
+_Statement = collections.namedtuple(
+    "_Statement", ["tokens", "placeholders", "paramstyle", "command", "bound", "fingerprint", "tables"]
+)
+
+
+@functools.lru_cache(maxsize=_STATEMENT_CACHE_SIZE)
+def _parse_statement(sql):
+    """
+    Parses a statement, returns its flattened tokens, placeholders, paramstyle, command, bound form, fingerprint, and
+    tables.
+    """
+
+    # Lazily import
+    import re
+    import sqlparse
+
+    # Parse statement, stripping comments and then leading/trailing whitespace
+    statements = sqlparse.parse(sqlparse.format(sql, strip_comments=True).strip())
+
+    # Allow only one statement at a time, since SQLite doesn't support multiple
+    # https://docs.python.org/3/library/sqlite3.html#sqlite3.Cursor.execute
+    if len(statements) > 1:
+        raise RuntimeError("too many statements at once")
+    elif len(statements) == 0:
+        raise RuntimeError("missing statement")
+
+    # Infer command from flattened statement to a single string separated by spaces
+    full_statement = " ".join(
+        str(token)
+        for token in statements[0].tokens
+        if token.ttype
+        in [
+            sqlparse.tokens.Keyword,
+            sqlparse.tokens.Keyword.DDL,
+            sqlparse.tokens.Keyword.DML,
+        ]
+    )
+    full_statement = full_statement.upper()
+
+    # Set of possible commands
+    commands = {
+        "BEGIN",
+        "COMMIT",
+        "CREATE VIEW",
+        "DELETE",
+        "INSERT",
+        "ROLLBACK",
+        "SELECT",
+        "START",
+        "UPDATE",
+        "VACUUM",
+    }
+
+    # Check if the full_statement starts with any command
+    command = next((cmd for cmd in commands if full_statement.startswith(cmd)), None)
+
+    # Flatten statement
+    tokens = list(statements[0].flatten())
+
+    # Validate paramstyle
+    placeholders = {}
+    paramstyle = None
+    for index, token in enumerate(tokens):
+        # If token is a placeholder
+        if token.ttype == sqlparse.tokens.Name.Placeholder:
+            # Determine paramstyle, name
+            _paramstyle, name = _parse_placeholder(token)
+
+            # Remember paramstyle
+            if not paramstyle:
+                paramstyle = _paramstyle
+
+            # Ensure paramstyle is consistent
+            elif _paramstyle != paramstyle:
+                raise RuntimeError("inconsistent paramstyle")
+
+            # Remember placeholder's index, name
+            placeholders[index] = name
+
+    # For SQL statements where a colon is required verbatim, as within an inline string, use a backslash to escape
+    # https://docs.sqlalchemy.org/en/13/core/sqlelement.html?highlight=text#sqlalchemy.sql.expression.text
+    for token in tokens:
+        # In string literal
+        # https://www.sqlite.org/lang_keywords.html
+        if token.ttype in [
+            sqlparse.tokens.Literal.String,
+            sqlparse.tokens.Literal.String.Single,
+        ]:
+            token.value = re.sub(r"(^'|\s+):", r"\1\:", token.value)
+
+        # In identifier
+        # https://www.sqlite.org/lang_keywords.html
+        elif token.ttype == sqlparse.tokens.Literal.String.Symbol:
+            token.value = re.sub(r'(^"|\s+):', r"\1\:", token.value)
+
+    # Render statement with a named parameter for each placeholder, for binding values natively
+    ordinals = {index: n for n, index in enumerate(placeholders)}
+    bound = "".join(
+        [
+            ":p{}".format(ordinals[index]) if index in ordinals else str(token)
+            for index, token in enumerate(tokens)
+        ]
+    )
+
+    # Normalize statement for statistics, replacing values with ? and lists of them with one ?
+    fingerprint = "".join(
+        [
+            "?"
+            if index in placeholders
+            or token.ttype in sqlparse.tokens.Literal.Number
+            or token.ttype in [sqlparse.tokens.Literal.String, sqlparse.tokens.Literal.String.Single]
+            else " " if token.is_whitespace
+            else str(token)
+            for index, token in enumerate(tokens)
+        ]
+    )
+    fingerprint = re.sub(r"\s+", " ", fingerprint).strip()
+    fingerprint = re.sub(r"\?(?:\s*,\s*\?)+", "?", fingerprint)
+
+    return _Statement(
+        tuple(tokens), placeholders, paramstyle, command, bound, fingerprint, _parse_tables(tokens)
+    )
+
+
+def _parse_tables(tokens):
+    """
+    Infers names of tables (or views) that a statement reads or writes, as a frozenset of lowercase names, from the
+    names that follow FROM, INTO, JOIN, TABLE, and UPDATE (and commas after those), ignoring aliases and schemas.
+    """
+
+    # Lazily import
+    import sqlparse
+
+    tables = set()
+    table = None
+    expect = False
+    for token in tokens:
+        if token.is_whitespace or token.ttype in sqlparse.tokens.Comment:
+            continue
+
+        # Keywords that can precede a table's name, as in UPDATE OR REPLACE and DROP TABLE IF EXISTS
+        if expect and token.normalized in [
+            "ABORT", "EXISTS", "FAIL", "IF", "IGNORE", "NOT", "OR", "REPLACE", "ROLLBACK"
+        ]:
+            continue
+
+        # Table's name, which may be a (non-reserved) keyword too
+        if expect and (
+            token.ttype in [sqlparse.tokens.Name, sqlparse.tokens.Literal.String.Symbol, sqlparse.tokens.Keyword]
+        ):
+            table = token.value.strip('"`[]').lower()
+            tables.add(table)
+            expect = False
+
+        # Start of a table's name
+        elif token.is_keyword and token.normalized != "AS":
+            expect = token.normalized in ["FROM", "INTO", "TABLE", "UPDATE"] or token.normalized.endswith("JOIN")
+            table = None
+
+        # Another table, after a comma, or a schema's name that was mistaken for a table's
+        elif table is not None and token.value in [",", "."]:
+            if token.value == ".":
+                tables.discard(table)
+            expect = True
+
+        # Neither an alias nor AS
+        elif not (table is not None and token.ttype == sqlparse.tokens.Name) and token.normalized != "AS":
+            table = None
+            expect = False
+
+    return frozenset(tables)
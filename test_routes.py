@@ -314,14 +314,14 @@ def start_ai_test():
         SELECT word_phrase, definition, example, unit_number
         FROM entries 
         WHERE unit_number = :unit_number
-    """, unit_number=unit_number)
+    """, unit_number=unit_number, cache=True)
     
     # Get notes
     notes = notes_db.execute("""
         SELECT title, content, unit_number
         FROM notes
         WHERE unit_number = :unit_number
-    """, unit_number=unit_number)
+    """, unit_number=unit_number, cache=True)
     
     # Format the context
     context = ""
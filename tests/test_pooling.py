@@ -0,0 +1,58 @@
+"""
+Test that pooling="request" returns each request's connection to the engine's pool once the request is done, so that
+more concurrent requests than the pool's size plus overflow all succeed.
+
+Usage: python -m pytest -q tests
+"""
+import concurrent.futures
+import os
+import sqlite3
+import sys
+import time
+
+import flask
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from sql import SQL
+
+# Connections the pool allows, fewer than the threads making requests at once
+POOL_SIZE = 1
+MAX_OVERFLOW = 10
+THREADS = 30
+
+
+def create_app(path, init=True):
+    """Return an app whose one route holds a connection to path (with pooling="request") for a while"""
+    sqlite3.connect(path).close()
+    db = SQL(f"sqlite:///{path}", pooling="request", pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=5)
+    app = flask.Flask(__name__)
+    if init:
+        SQL.init_app(app)
+
+    @app.route("/")
+    def index():
+        rows = db.execute("SELECT 1 AS one")
+        time.sleep(0.05)
+        return flask.jsonify(rows)
+
+    return app
+
+
+def test_concurrent_requests(tmp_path):
+    app = create_app(str(tmp_path / "pooling.db"))
+    client = app.test_client()
+    with concurrent.futures.ThreadPoolExecutor(THREADS) as executor:
+        responses = list(executor.map(lambda _: client.get("/"), range(THREADS * 2)))
+    assert THREADS > POOL_SIZE + MAX_OVERFLOW
+    assert [response.status_code for response in responses] == [200] * THREADS * 2
+    assert all(response.get_json() == [{"one": 1}] for response in responses)
+
+
+def test_init_app_after_first_request(tmp_path):
+    app = create_app(str(tmp_path / "late.db"), init=False)
+    app.test_client().get("/healthz")
+    with app.test_request_context("/"), pytest.raises(RuntimeError, match="init_app"):
+        app.view_functions["index"]()
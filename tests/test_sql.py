@@ -0,0 +1,179 @@
+"""
+Test SQL's writer queue and read-only readers, its cache's invalidation by cascades and triggers, transactions'
+savepoints, executemany's rollback of a failed batch, and retries of statements that find the database busy.
+
+Usage: python -m pytest -q tests
+"""
+import concurrent.futures
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from sql import SQL
+
+SCHEMA = """
+    CREATE TABLE units (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+    CREATE TABLE entries (
+        id INTEGER PRIMARY KEY,
+        word_phrase TEXT NOT NULL UNIQUE,
+        unit_id INTEGER REFERENCES units (id) ON DELETE CASCADE
+    );
+    CREATE TABLE history (id INTEGER PRIMARY KEY, entry_id INTEGER);
+    CREATE TRIGGER entries_history AFTER INSERT ON entries BEGIN
+        INSERT INTO history (entry_id) VALUES (new.id);
+    END;
+    INSERT INTO units (id, name) VALUES (1, 'Charter'), (2, 'Torts');
+    INSERT INTO entries (word_phrase, unit_id) VALUES ('habeas corpus', 1), ('mens rea', 1), ('negligence', 2);
+"""
+
+
+@pytest.fixture
+def url(tmp_path):
+    """Return the URL of a new database with SCHEMA (a new URL per test, since instances are shared by URL)"""
+    path = str(tmp_path / "test.db")
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    connection.close()
+    return f"sqlite:///{path}"
+
+
+def count(db, table):
+    return db.execute(f"SELECT COUNT(*) AS n FROM {table}", cache=True)[0]["n"]
+
+
+def test_cache_invalidated_by_cascade(url):
+    db = SQL(url, cache_size=16)
+    assert count(db, "entries") == 3
+    assert count(db, "entries") == 3
+    assert db.cache_info()["hits"] == 1
+
+    # Deleting a unit deletes its entries, whose cached count is thus stale
+    db.execute("DELETE FROM units WHERE id = ?", 1)
+    assert count(db, "entries") == 1
+
+
+def test_cache_invalidated_by_trigger(url):
+    db = SQL(url, cache_size=16)
+    assert count(db, "history") == 3
+
+    # Inserting an entry inserts into history, through entries_history
+    db.execute("INSERT INTO entries (word_phrase) VALUES (?)", "stare decisis")
+    assert count(db, "history") == 4
+
+
+def test_cache_not_invalidated_by_other_tables(url):
+    db = SQL(url, cache_size=16)
+    count(db, "units")
+    db.execute("INSERT INTO history (entry_id) VALUES (?)", 1)
+    count(db, "units")
+    assert db.cache_info()["hits"] == 1
+
+
+def test_savepoint_rollback_keeps_outer(url):
+    db = SQL(url)
+    with db.transaction():
+        db.execute("INSERT INTO units (name) VALUES (?)", "outer")
+        with pytest.raises(ZeroDivisionError):
+            with db.transaction():
+                db.execute("INSERT INTO units (name) VALUES (?)", "inner")
+                1 / 0
+        db.execute("INSERT INTO units (name) VALUES (?)", "after")
+    names = [row["name"] for row in db.execute("SELECT name FROM units ORDER BY id")]
+    assert names == ["Charter", "Torts", "outer", "after"]
+
+
+def test_transaction_rollback(url):
+    db = SQL(url)
+    with pytest.raises(ZeroDivisionError):
+        with db.transaction():
+            db.execute("INSERT INTO units (name) VALUES (?)", "outer")
+            with db.transaction():
+                db.execute("INSERT INTO units (name) VALUES (?)", "inner")
+            1 / 0
+    assert count(db, "units") == 2
+
+
+def test_executemany_rolls_back_failed_batch(url):
+    db = SQL(url)
+
+    # A duplicate phrase, after rows that were inserted
+    with pytest.raises(ValueError):
+        db.executemany("INSERT INTO entries (word_phrase) VALUES (?)", [("actus reus",), ("obiter",), ("mens rea",)])
+    assert count(db, "entries") == 3
+
+    # A row missing a value, after rows that were inserted
+    with pytest.raises(RuntimeError):
+        db.executemany("INSERT INTO entries (word_phrase) VALUES (:word)", [{"word": "actus reus"}, {}])
+    assert count(db, "entries") == 3
+
+    ids = db.executemany("INSERT INTO entries (word_phrase) VALUES (?)", [("actus reus",), ("obiter",)])
+    assert ids == [4, 5]
+
+
+def test_writer_queue(url):
+    db = SQL(url, readers=2, pragmas={"journal_mode": "WAL"})
+
+    # Writes from many threads at once are executed, in turn, by the one writer
+    with concurrent.futures.ThreadPoolExecutor(16) as executor:
+        ids = list(executor.map(lambda i: db.execute("INSERT INTO units (name) VALUES (?)", f"Unit {i}"), range(64)))
+    assert sorted(ids) == list(range(3, 67))
+    info = db.write_queue_info()
+    assert info["completed"] == 64 and info["rejected"] == 0
+
+    # Reads see the writer's commits
+    assert db.execute("SELECT COUNT(*) AS n FROM units")[0]["n"] == 66
+
+
+def test_readers_are_read_only(url):
+    db = SQL(url, readers=2, pragmas={"journal_mode": "WAL"})
+    assert db.execute("SELECT COUNT(*) AS n FROM units")[0]["n"] == 2
+    connection = db._connect(read_only=True)
+    with pytest.raises(Exception, match="readonly"):
+        connection.exec_driver_sql("INSERT INTO units (name) VALUES ('reader')")
+    db._disconnect()
+
+
+def lock(path, seconds):
+    """Lock the database at path exclusively, from another thread, for seconds, returning once locked"""
+    locked = threading.Event()
+
+    def hold():
+        connection = sqlite3.connect(path, isolation_level=None)
+        connection.execute("BEGIN EXCLUSIVE")
+        locked.set()
+        time.sleep(seconds)
+        connection.execute("COMMIT")
+        connection.close()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    locked.wait()
+    return thread
+
+
+def test_busy_retry(url):
+    db = SQL(url, busy_timeout=0.01, busy_retries=10)
+    thread = lock(url[len("sqlite:///"):], 0.05)
+    assert db.execute("INSERT INTO units (name) VALUES (?)", "retried") == 3
+    thread.join()
+    contention = db.contention_info()
+    assert contention["busy"] >= 1 and contention["recovered"] == 1 and contention["failed"] == 0
+
+
+def test_busy_without_retries(url):
+    db = SQL(url, busy_timeout=0.01)
+    thread = lock(url[len("sqlite:///"):], 0.2)
+    try:
+        with pytest.raises(RuntimeError, match="locked"):
+            db.execute("INSERT INTO units (name) VALUES (?)", "failed")
+    finally:
+        thread.join()
+    assert db.contention_info()["failed"] == 1
+    assert count(db, "units") == 2